@@ -8,6 +8,15 @@ import sys
 import os
 from os.path import abspath
 
+# Report the time spent importing modules with APM_IMPORT_TIME=1
+import_timer = None
+if os.environ.get('APM_IMPORT_TIME'):
+    import atexit
+    from apm.classes.importtime import ImportTimer
+    import_timer = ImportTimer()
+    import_timer.install()
+    atexit.register(lambda: print(import_timer.report('apm {}'.format(' '.join(sys.argv[1:]))), file=sys.stderr))
+
 # Input Parsing
 import argparse
 
@@ -19,31 +28,20 @@ from datetime import timedelta
 # Handle json import from file
 import json
 
-# Fix backspace on input
-import readline
-
 # Unit Testing
 import unittest
-from apm.classes import mock
+import tempfile
+import shutil
 
 # APM Imports
+# Everything else is imported by the command that needs it
 import apm
-from apm import Files
-from apm import UI
-from apm import VapMgr
-
-from apm import Stage
-from apm import Rename
-from apm import Process
-from apm import Review
-from apm import Remove
-from apm import Archive
-from apm import Cleanup
-from apm import Demo
+from apm.commands import get_command
 
 from apm.classes.system import jprint
-
-from apm import test
+from apm.classes.system import dir_pattern
+from apm.classes.system import get_exit_code
+from apm.classes.digest import ALGORITHMS as DIGESTS
 
 global max_tries
 global today
@@ -64,12 +62,20 @@ def main():
         print(apm.__version__)
         return
 
+    # Run the jobs of a manifest, each command in its own apm process
+    if sys.argv[1] == 'batch':
+        run_batch(parse_batch_args(sys.argv[2:]))
+        return
+
     # Retrieve arguments from user
     config = parse_args()
     command = config['command'].lower()
 
     # Check to see if this is a test
     if command == 'test':
+        global mock, test
+        from apm.classes import mock
+        from apm.classes import test
         test_config = test.config()
 
         sys.argv = [sys.argv[0]]
@@ -80,10 +86,14 @@ def main():
 
     # Not a test
     if command == 'info' or command == 'vapinfo':
+        from apm.classes.vapmgr import VapMgr
         vap = VapMgr({})
         vap.vap_info()
         return
 
+    # Fix backspace on input
+    import readline
+
     if command == 'auto':
         temp = validate_config(config, command)
         config = temp if temp else config
@@ -98,59 +108,103 @@ def main():
 
     # Save the config to file
     s = time.time()
-    f = Files(config)
+    f = apm.Files(config)
     f.save_config()
+
+    # Follow the deletion started by cleanup
+    if command == 'trash':
+        follow_trash(f.get_trash())
+        return
+
+    # Start or stop the watcher that keeps the listings of the job directories
+    if command == 'watch' or command == 'unwatch':
+        watch_job(f, command)
+        return
+
     f.load_filenames()
     files = f.files
 
+    # Move the sqlite ledger to and from <job>.json for hand edits
+    if command == 'export' or command == 'import':
+        if config['ledger'] != 'sqlite':
+            exit('The {} command is only used with --ledger sqlite'.format(command))
+
+        if command == 'export':
+            f.export_filenames()
+        else:
+            f.import_filenames()
+        return
+
+    # An interrupted rename left files under their new names, they are given
+    # those names in the ledger so they are not taken for untracked files
+    if os.path.exists(dir_pattern(3).format(config['stage'], config['job'], 'rename.journal')):
+        if command != 'rename':
+            exit("\nA rename of the collection was interrupted.\nPlease run `apm rename` to finish it.\n")
+
+        get_command('rename')(config, files).recover()
+
     # Check to see if any files are not currently being tracked
     # Or if any tracked files have been deleted
     print("Checking status of tracked files...", end="")
     sys.stdout.flush()
 
-    json_file = '{0}/{1}/{1}.json'.format(config['stage'], config['job'])
-    if os.path.exists(json_file) and config['ingest']:
-        fp = open(json_file, 'r')
-        files = json.loads(fp.read())
-        fp.close()
-
-        cwd = os.getcwd()
-        os.chdir('{}/{}/collection'.format(config['stage'], config['job']))
-
-        keys = files.keys()
-
-        sites = set(os.listdir('.'))
+    # A running watcher already has every listing, otherwise only the
+    # directories that changed since the last check are listed again
+    state = None
+    if files != None and config['ingest']:
+        full = config['full_scan']
+        tree = f.get_watched_tree('collection') if not full else None
+        if tree == None:
+            tree = f.get_tree('collection')
+            state = f.get_tracked_state()
+
+        def listdir(relpath):
+            if state == None:
+                return tree.listdir(relpath)
+            return state.listdir(relpath, tree.listdir, full)
+
+        seen = set([''])
+        keys = list(files.keys())
+
+        sites = set(listdir(''))
         for site in keys:
             if site not in sites:
-                files.pop(site)
+                files.drop(site)
                 continue
 
-            os.chdir(site)
-
-            instruments = set(os.listdir('.'))
-            ins_keys = files[site].keys()
+            seen.add(site)
+            instruments = set(listdir(site))
+            ins_keys = list(files[site].keys())
 
             for ins in ins_keys:
                 if ins not in instruments:
-                    files[site].pop(ins)
+                    files.drop(site, ins)
                     continue
 
-                os.chdir(ins)
+                path = dir_pattern().format(site, ins)
+                seen.add(path)
 
-                filelist = set(os.listdir('.'))
+                # A deleted file is marked so undoing the mark by hand is seen as a change
+                if state != None:
+                    tracked = [i if not v.get('deleted') else dir_pattern().format(i, 'deleted') for i, v in files[site][ins].items()]
+                    if not full and state.is_current(path, tracked):
+                        continue
+
+                filelist = set(tree.listdir(path))
                 for i in filelist:
-                    if i not in files[site][ins] and not (os.path.isdir(i) and i == "other_files"):
+                    if i not in files[site][ins] and not (i == "other_files" and tree.isdir(dir_pattern().format(path, i))):
                         exit("\nThe file {0}/{1}/{2} is currently untracked.\nPlease edit {3}.json to start tracking this file.\n".format(site, ins, i, config['job']))
 
                 for i in files[site][ins]:
-                    if i not in filelist:
-                        files[site][ins][i]["deleted"] = True
-
-                os.chdir('..')
+                    if i not in filelist and not files[site][ins][i].get("deleted"):
+                        files.set_value(site, ins, i, "deleted", True)
 
-            os.chdir('..')
+                if state != None:
+                    tracked = [i if not v.get('deleted') else dir_pattern().format(i, 'deleted') for i, v in files[site][ins].items()]
+                    state.record(path, len(filelist), tracked)
 
-        os.chdir(cwd)
+        if state != None:
+            state.forget(seen)
     print("Done") # Done checking status of tracked files
     sys.stdout.flush()
 
@@ -158,44 +212,30 @@ def main():
     if command == 'auto':
         print('Attempting to stage files for datastreams: {}'.format(config['datastream']))
 
-        skip = False
-
-        if not config['duplicates']:
-            s = Stage(config, files)
-            config, files = s.run()
-
-            if config['exit']:
-                exit()
-
-            if config['duplicates']:
-                skip = True
-
-        if not skip and not config['vap']:
-            r = Rename(config, files)
-            config, files = r.run()
-            if config['exit']:
-                exit()
-        exit()
+        # Each datastream is renamed as soon as it is staged
+        a = get_command('auto')(config, files)
+        config, files = a.run()
+        exit(get_exit_code(config))
 
     elif command == 'stage':
         print("*"*50,"\n", json.dumps(config, indent=2), "*"*50, "\n")
         skip = False
 
         if not config['duplicates']:
-            s = Stage(config, files)
+            s = get_command('stage')(config, files)
             config, files = s.run()
 
             if config['exit']:
-                exit()
+                exit(get_exit_code(config))
 
             if config['duplicates']:
                 skip = True
 
         if not skip and not config['vap']:
-            r = Rename(config, files)
+            r = get_command('rename')(config, files)
             config, files = r.run()
             if config['exit']:
-                exit()
+                exit(get_exit_code(config))
 
     elif command == 'rename':
         # If rename is called explicitly, force rename even if config is set to false
@@ -205,16 +245,16 @@ def main():
             config['rename'] = True
 
         if not config['vap']:
-            r = Rename(config, files)
+            r = get_command('rename')(config, files)
             config, files = r.run()
             if config['exit']:
-                exit()
+                exit(get_exit_code(config))
 
         if switch:
             config['rename'] = False
 
     elif command == 'process':
-        r = Rename(config, files)
+        r = get_command('rename')(config, files)
         has_coll = r.check_for_collisions()
         files = r.files
 
@@ -222,13 +262,13 @@ def main():
             config = r.config
             files = r.files
         else:
-            p = Process(config, files)
+            p = get_command('process')(config, files)
             config, files = p.run()
             if config['exit']:
-                exit()
+                exit(get_exit_code(config))
 
     elif command == 'review':
-        r = Rename(config, files)
+        r = get_command('rename')(config, files)
         has_coll = r.check_for_collisions()
         files = r.files
 
@@ -236,13 +276,13 @@ def main():
             config = r.config
             files = r.files
         else:
-            r = Review(config, files)
+            r = get_command('review')(config, files)
             config, files = r.run()
             if config['exit']:
-                exit()
+                exit(get_exit_code(config))
 
     elif command == 'remove':
-        r = Rename(config, files)
+        r = get_command('rename')(config, files)
         has_coll = r.check_for_collisions()
         files = r.files
 
@@ -250,13 +290,13 @@ def main():
             config = r.config
             files = r.files
         else:
-            r = Remove(config, files)
+            r = get_command('remove')(config, files)
             config, files = r.run()
             if config['exit']:
-                exit()
+                exit(get_exit_code(config))
 
     elif command == 'archive':
-        r = Rename(config, files)
+        r = get_command('rename')(config, files)
         has_coll = r.check_for_collisions()
         files = r.files
 
@@ -264,13 +304,13 @@ def main():
             config = r.config
             files = r.files
         else:
-            a = Archive(config, files)
+            a = get_command('archive')(config, files)
             config, files = a.run()
             if config['exit']:
-                exit()
+                exit(get_exit_code(config))
 
     elif command == 'cleanup':
-        r = Rename(config, files)
+        r = get_command('rename')(config, files)
         has_coll = r.check_for_collisions()
         files = r.files
 
@@ -278,13 +318,13 @@ def main():
             config = r.config
             files = r.files
         else:
-            c = Cleanup(config, files)
+            c = get_command('cleanup')(config, files)
             config, files = c.run()
             if config['exit']:
-                exit()
+                exit(get_exit_code(config))
 
     elif command == 'prep':
-        r = Rename(config, files)
+        r = get_command('rename')(config, files)
         has_coll = r.check_for_collisions()
         files = r.files
 
@@ -292,10 +332,10 @@ def main():
             config = r.config
             files = r.files
         else:
-            d = Demo(config, files)
+            d = get_command('prep')(config, files)
             config, files = d.run()
             if config['exit']:
-                exit()
+                exit(get_exit_code(config))
 
     elif command == "notification":
         # Alka's module goes here
@@ -309,6 +349,16 @@ def main():
     f.files = files
     f.save_config()
     f.save_filenames()
+    f.save_hashes()
+
+    # The state is only kept once the deleted files it found are saved
+    if state != None:
+        state.save()
+
+    # Naming collisions stop the commands of the job in a batch
+    code = get_exit_code(config)
+    if code != None:
+        exit(code)
 
 
 def parse_args():
@@ -321,7 +371,7 @@ def parse_args():
     stage_type = parser.add_mutually_exclusive_group()
 
     # Setup positional arguments
-    parser.add_argument('command', help='Which of the APM stages to run: stage, rename, process, review, remove, archive, cleanup')
+    parser.add_argument('command', help='Which of the APM stages to run: stage, rename, process, review, remove, archive, cleanup, import, export, trash, watch, unwatch, batch')
 
     # Demo options
     parser.add_argument('--demo', help='Prep for different stages of a demo, available options include: remove, archive, cleanup')
@@ -348,6 +398,17 @@ def parse_args():
     parser.add_argument('--no-rename', action='store_false', help='Do not strip the ARM prefix from the files')
     parser.add_argument('--no-db-up', action='store_false', help='Do not update the config database')
     parser.add_argument('--no-compare', action='store_false', help='Do not compare the ingest output for re-archiving')
+    parser.add_argument('--extract-workers', type=int, default=1, help='Number of tar files to extract at the same time. Default: 1')
+    parser.add_argument('--stage-workers', type=int, default=1, help='Number of datastreams to stage at the same time. Default: 1')
+    parser.add_argument('--ingest-workers', type=int, help='Number of ingests process runs at the same time. Default: one per ingest executable')
+    parser.add_argument('--io-limit', type=int, help='Number of datastreams that may copy or unpack tar files at the same time. Default: --stage-workers')
+    parser.add_argument('--digest', choices=sorted(DIGESTS), default='sha256', help='Digest used to check that local copies of a file are the same. Default: sha256')
+    parser.add_argument('--hash-workers', type=int, default=4, help='Number of files remove hashes at the same time. Default: 4')
+    parser.add_argument('--member-padding', type=float, metavar='HOURS', help='Only extract raw files with a timestamp within HOURS of the begin and end dates')
+    parser.add_argument('--materialize', choices=['auto', 'reflink', 'hardlink', 'copy'], default='auto', help='How stage copies the tar backups and the raw snapshot. Default: auto')
+    parser.add_argument('--ledger', choices=['json', 'sqlite'], default='json', help='Where the tracked files of the job are saved: <job>.json or <job>.db. Default: json')
+    parser.add_argument('--full-scan', action='store_true', help='Check every directory of the collection for untracked and deleted files, not only the ones that changed')
+    parser.add_argument('--stage-mode', choices=['copy', 'stream'], default='copy', help='copy: back up, unpack and snapshot the tar files in separate passes. stream: read each tar file once. Default: copy')
 
     # Other
     parser.add_argument('--ingest-flags', nargs='+', help='Flags you want APM to pass to the INGEST. Ex. --ingest-flags F (Do not use "-F" APM will add the "-") (Will apply to all ingests if running for multiple datastreams)')
@@ -385,6 +446,17 @@ def parse_args():
         'rename': arguments.no_rename,
         'db_up': arguments.no_db_up,
         'compare': arguments.no_compare,
+        'extract_workers': arguments.extract_workers,
+        'stage_mode': arguments.stage_mode,
+        'materialize': arguments.materialize,
+        'member_padding': arguments.member_padding,
+        'stage_workers': arguments.stage_workers,
+        'io_limit': arguments.io_limit,
+        'ingest_workers': arguments.ingest_workers,
+        'hash_workers': arguments.hash_workers,
+        'digest': arguments.digest,
+        'ledger': arguments.ledger,
+        'full_scan': arguments.full_scan,
         'iflags': arguments.ingest_flags,
         'ingest': arguments.ingest,
         'vap': arguments.vap,
@@ -417,7 +489,7 @@ def parse_args():
             }
         }
 
-    f = Files(args)
+    f = apm.Files(args)
 
     if args['stage'] != None:
         temp = f.clean_path(args['stage'])
@@ -428,8 +500,102 @@ def parse_args():
 
     return args
 
+def parse_batch_args(argv):
+    """ Setup argument parsing for `apm batch` and parse the arguments """
+    parser = argparse.ArgumentParser(prog='apm batch', description='Run the jobs of a manifest at the same time under shared limits')
+    parser.add_argument('manifest', help='JSON file with the jobs to run, see the readme for the format')
+    parser.add_argument('--jobs', type=int, default=4, help='Number of jobs to run at the same time. Default: 4')
+    parser.add_argument('--extract-limit', type=int, default=4, help='Number of tar files all the jobs may extract at the same time. Default: 4')
+    parser.add_argument('--ingest-limit', type=int, default=4, help='Number of ingests all the jobs may run at the same time. Default: 4')
+    parser.add_argument('--db-limit', type=int, default=8, help='Number of database connections all the jobs may hold at the same time. Default: 8')
+    parser.add_argument('--log-dir', help='Where the log of each job and the summary are written. Default: <manifest>.logs')
+
+    arguments = parser.parse_args(argv)
+
+    args = {
+        'manifest': abspath(arguments.manifest),
+        'log_dir': abspath(arguments.log_dir) if arguments.log_dir else '{}.logs'.format(os.path.splitext(abspath(arguments.manifest))[0]),
+        'limits': {
+            'jobs': arguments.jobs,
+            'extract': arguments.extract_limit,
+            'ingest': arguments.ingest_limit,
+            'db': arguments.db_limit,
+        },
+    }
+
+    return args
+
+def run_batch(args):
+    """ Run every job of the manifest and print a summary """
+    from apm.classes.batch import Batch
+    from apm.classes.batch import load_manifest
+
+    if not os.path.exists(args['manifest']):
+        exit('Unable to find the manifest {}'.format(args['manifest']))
+
+    jobs = load_manifest(args['manifest'])
+    batch = Batch(jobs, abspath(__file__), args['log_dir'], args['limits'])
+    print('Running {} jobs, logs in {}'.format(len(jobs), args['log_dir']))
+    sys.stdout.flush()
+
+    results = batch.run()
+    print(batch.summary(results))
+
+    if len([i for i in results if i['status'] != 'done']) > 0:
+        exit(1)
+
+def watch_job(f, command):
+    """ Start the watcher of the job in the background, or stop it """
+    from apm.classes import watcher
+    job_dir = dir_pattern().format(f.config['stage'], f.config['job'])
+    if command == 'unwatch':
+        pid = watcher.stop(job_dir)
+        if pid == None:
+            print("No watcher is running for this job.")
+        else:
+            print("Stopped the watcher ({}).".format(pid))
+        return
+
+    status = watcher.get_status(job_dir)
+    if status != None:
+        print("The watcher ({}) is running, last update {}.".format(status['pid'], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(status['time']))))
+        return
+
+    supported, reason = watcher.is_supported(job_dir)
+    if not supported:
+        print("Unable to watch this job: {}.\nAPM will keep scanning the job directories.".format(reason))
+        return
+
+    print("Started the watcher ({}). Run `apm -j {} unwatch` to stop it.".format(watcher.start(job_dir), f.config['job']))
+
+def follow_trash(trash):
+    """ Print the progress of the background deletion until it is done, or delete the trash if nothing is """
+    status = trash.get_status()
+    if (status == None or not status['running']) and not trash.is_empty():
+        print("Deleting the files left in the trash...", end="")
+        sys.stdout.flush()
+        status = trash.purge()
+        print("Done")
+    elif status != None and status['running']:
+        try:
+            while status != None and status['running']:
+                print("\rDeleting old files: {} files and {} directories removed...".format(status['files'], status['dirs']), end="")
+                sys.stdout.flush()
+                time.sleep(1)
+                status = trash.get_status()
+        except KeyboardInterrupt:
+            print("\nThe deletion continues in the background.")
+            return
+        print("Done")
+
+    if status == None:
+        print("Nothing to delete.")
+        return
+
+    print("{} files and {} directories deleted.".format(status['files'], status['dirs']))
+
 def validate_config(config, command):
-    f = Files(config)
+    f = apm.Files(config)
     if command == "auto":
         temp = f.db_load_config()
     else:
@@ -628,7 +794,7 @@ def check_source(config, level=1):
     return source
 
 def check_stage(config, level=1):
-    f = Files(config)
+    f = apm.Files(config)
     stage = config['stage']
     interactive = config['interactive']
     quiet = config['quiet']
@@ -675,7 +841,7 @@ def check_stage(config, level=1):
 
 def ask_for_dir(message, default=None, error=None, required=False, level=1):
     """ Ask user for a directory location """
-    f = Files({})
+    f = apm.Files({})
     folder = input(message)
     if folder == '':
         if default != None:
@@ -710,7 +876,7 @@ def check_job(config):
         job = '{0}{1}'.format(uid[0], uid[3])
 
     config['job'] = job
-    f = Files(config)
+    f = apm.Files(config)
     f.setup_job_dir()
 
     return job
@@ -1109,7 +1275,7 @@ class TestSourceStage(unittest.TestCase):
 
 
     def tearDown(self):
-        f = Files({})
+        f = apm.Files({})
         dirs = [self.stage, self.source, self.alt['source']['empty'], self.default['stage']]
         for i in dirs:
             if not i:
@@ -1310,7 +1476,7 @@ class TestJob(unittest.TestCase):
         if not os.path.exists(self.stage):
             return
 
-        f = Files({})
+        f = apm.Files({})
         if not f.is_dir_empty(self.stage):
             f.empty_dir(self.stage)
 
@@ -1368,6 +1534,156 @@ class TestJob(unittest.TestCase):
         print("Result:   {}\nExpected: {}".format(result, expected))
         assert result == expected
 
+############################################################
+# Test Rename Resume
+############################################################
+class TestRenameResume(unittest.TestCase):
+    """ Test that main finishes a rename that was interrupted """
+    def setUp(self):
+        from uuid import uuid4
+        from apm.classes.renamer import Renamer
+        from apm.classes.renamer import RenamePlan
+
+        self.cwd = os.getcwd()
+        self.config = test.config()
+        self.config['stage'] = tempfile.mkdtemp()
+        self.config['quiet'] = True
+        self.config['rename'] = True
+        self.config['exit'] = False
+
+        f = apm.Files(self.config)
+        f.setup_job_dir()
+        self.job = dir_pattern().format(self.config['stage'], self.config['job'])
+        self.path = dir_pattern(3).format(self.job, 'collection', 'sgp/sgpmfrsrC1.00')
+        os.makedirs(self.path)
+
+        # The second datastream was staged but not journaled yet, like auto leaves it
+        self.other = dir_pattern(3).format(self.job, 'collection', 'sgp/sgpmetE13.00')
+        os.makedirs(self.other)
+
+        self.names = ['sgpmfrsrC1.00.20140501.{0:02d}0000.raw.mfrsr.{0:02d}0000.dat'.format(i) for i in range(3)]
+        self.other_names = ['sgpmetE13.00.20140501.000000.raw.met.000000.dat']
+        files = {'sgp': {'sgpmfrsrC1.00': {}, 'sgpmetE13.00': {}}}
+        for path, ins, names in [(self.path, 'sgpmfrsrC1.00', self.names), (self.other, 'sgpmetE13.00', self.other_names)]:
+            for i in names:
+                open(dir_pattern().format(path, i), 'w').close()
+                files['sgp'][ins][i] = {
+                    'uuid': str(uuid4()), 'current_name': i, 'original_name': i, 'unpacked_name': i,
+                    'stripped_name': None, 'processed_name': None, 'duplicate_files': [], 'deleted': False,
+                }
+
+        fp = open(dir_pattern().format(self.job, '{}.json'.format(self.config['job'])), 'w')
+        fp.write(json.dumps(files))
+        fp.close()
+
+        # Stop the rename after its first file
+        self.renamer = Renamer(dir_pattern().format(self.job, 'rename.journal'))
+        self.renamer.plan([RenamePlan(self.path, 'sgp', 'sgpmfrsrC1.00')], f.strip_name)
+        self.renamer.write_journal()
+        self.new_names = [j for i, j in self.renamer.plans[0].moves]
+        os.rename(dir_pattern().format(self.path, self.names[0]), dir_pattern().format(self.path, self.new_names[0]))
+
+    def tearDown(self):
+        # Rename leaves the working directory in the collection
+        os.chdir(self.cwd)
+        shutil.rmtree(self.config['stage'])
+
+    def run_main(self, command):
+        config = dict(self.config, command=command)
+        with mock.patch.dict(globals(), {'parse_args': lambda: dict(config), 'validate_config': lambda config, command: config}):
+            main()
+
+    def test_1(self):
+        """ Rename after an interrupted rename -> the rename is finished and the ledger has the new names """
+        self.run_main('rename')
+
+        f = apm.Files(self.config)
+        f.load_filenames()
+        result = [sorted(os.listdir(self.path)), sorted(f.files['sgp']['sgpmfrsrC1.00']), self.renamer.has_journal()]
+        expected = [sorted(self.new_names), sorted(self.new_names), False]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Another command after an interrupted rename -> FAIL """
+        with self.assertRaises(SystemExit):
+            self.run_main('process')
+
+    def test_3(self):
+        """ Rename after an interrupted rename -> a directory missing from the journal is renamed too """
+        self.run_main('rename')
+
+        f = apm.Files(self.config)
+        f.load_filenames()
+        result = [os.listdir(self.other), list(f.files['sgp']['sgpmetE13.00'])]
+        expected = [['met.000000.dat'], ['met.000000.dat']]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+############################################################
+# Test Exit Code
+############################################################
+class TestExitCode(unittest.TestCase):
+    """ Test the exit status of a command that finds naming collisions """
+    def setUp(self):
+        from uuid import uuid4
+
+        self.config = test.config()
+        self.config['stage'] = tempfile.mkdtemp()
+        self.config['quiet'] = True
+        self.config['exit'] = False
+        self.config['command'] = 'process'
+
+        apm.Files(self.config).setup_job_dir()
+        job = dir_pattern().format(self.config['stage'], self.config['job'])
+        path = dir_pattern(3).format(job, 'collection', 'sgp/sgpmfrsrC1.00')
+        os.makedirs(path)
+
+        # Two files that were unpacked with the same name
+        names = ['mfrsr.000000.dat', 'mfrsr.000000.dat.v1']
+        uuids = [str(uuid4()) for i in names]
+        files = {'sgp': {'sgpmfrsrC1.00': {}}}
+        for i, name in enumerate(names):
+            open(dir_pattern().format(path, name), 'w').close()
+            files['sgp']['sgpmfrsrC1.00'][name] = {
+                'uuid': uuids[i], 'current_name': name, 'original_name': names[0], 'unpacked_name': name,
+                'stripped_name': name, 'processed_name': None, 'duplicate_files': [uuids[1 - i]], 'deleted': False,
+            }
+
+        fp = open(dir_pattern().format(job, '{}.json'.format(self.config['job'])), 'w')
+        fp.write(json.dumps(files))
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.config['stage'])
+
+    def run_main(self, env):
+        config = self.config
+        with mock.patch.dict(globals(), {'parse_args': lambda: dict(config), 'validate_config': lambda config, command: config}):
+            with mock.patch.dict(os.environ, env):
+                try:
+                    main()
+                except SystemExit as e:
+                    return e.code
+
+    def test_1(self):
+        """ Process with naming collisions at a terminal -> status 0 """
+        result = self.run_main({})
+        expected = None
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Process with naming collisions in a batch -> status 1 """
+        result = self.run_main({'APM_BATCH': '1'})
+        expected = 1
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
 
 ################################################################################
 
@@ -1375,6 +1691,7 @@ def signal_handler(signum, frame):
     """ Catch keyboard interrupts gracefully """
     signal.signal(signal.SIGINT, original_sigint)
 
+    from apm.classes.ui import UI
     ui = UI()
     try:
         terminate = ui.yn_choice("\nAre you sure you want to terminate?", 'y')
@@ -5,46 +5,68 @@ __version__ = '1.0'
 __author__ = 'Thom Williams'
 __copyright__ = 'Copyright 2014 PNNL'
 
-from . import classes
+import sys
+
 from . import version
 __version__ = version.version
 
-from .classes import db
-from .classes import files
-from .classes import system
-from .classes import ui
-from .classes import unpack
-from .classes import vapmgr
-from .classes import test
-from .classes import mock
-
-from .classes.db import DB
-from .classes.files import Files
-from .classes.ui import UI
-from .classes.unpack import UnPack
-from .classes.vapmgr import VapMgr
+# Modules and classes are imported the first time they are used, so each
+# command only loads what it needs: {name: (module, attribute or None)}
+LAZY = {
+    'classes': ('apm.classes', None),
+    'commands': ('apm.commands', None),
+    'pmanager': ('apm.pmanager', None),
+    'manager': ('apm.pmanager.manager', None),
 
-from . import commands
+    'db': ('apm.classes.db', None),
+    'files': ('apm.classes.files', None),
+    'system': ('apm.classes.system', None),
+    'ui': ('apm.classes.ui', None),
+    'unpack': ('apm.classes.unpack', None),
+    'vapmgr': ('apm.classes.vapmgr', None),
+    'test': ('apm.classes.test', None),
+    'mock': ('apm.classes.mock', None),
 
-from .commands import stage
-from .commands import rename
-from .commands import process
+    'DB': ('apm.classes.db', 'DB'),
+    'Files': ('apm.classes.files', 'Files'),
+    'FileLedger': ('apm.classes.ledger', 'FileLedger'),
+    'UI': ('apm.classes.ui', 'UI'),
+    'UnPack': ('apm.classes.unpack', 'UnPack'),
+    'VapMgr': ('apm.classes.vapmgr', 'VapMgr'),
 
-from .commands.stage import Stage
-from .commands.rename import Rename
-from .commands.process import Process
-from .commands.review import Review
-from .commands.remove import Remove
-from .commands.archive import Archive
-from .commands.cleanup import Cleanup
-from .commands.demo import Demo
+    'stage': ('apm.commands.stage', None),
+    'rename': ('apm.commands.rename', None),
+    'process': ('apm.commands.process', None),
 
-from . import pmanager
+    'Stage': ('apm.commands.stage', 'Stage'),
+    'Rename': ('apm.commands.rename', 'Rename'),
+    'Process': ('apm.commands.process', 'Process'),
+    'Review': ('apm.commands.review', 'Review'),
+    'Remove': ('apm.commands.remove', 'Remove'),
+    'Archive': ('apm.commands.archive', 'Archive'),
+    'Cleanup': ('apm.commands.cleanup', 'Cleanup'),
+    'Demo': ('apm.commands.demo', 'Demo'),
 
-from .pmanager import manager
+    'PluginManager': ('apm.pmanager.manager', 'PluginManager'),
+}
 
-from .pmanager.manager import PluginManager
+def load_lazy(package, lazy, name):
+    """ Import the module of a lazy name and set it on the package """
+    if name not in lazy:
+        raise AttributeError("module '{}' has no attribute '{}'".format(package, name))
 
+    module, attribute = lazy[name]
+    # __import__ rather than importlib so --import-time sees these imports
+    __import__(module)
+    value = sys.modules[module]
+    if attribute != None:
+        value = getattr(value, attribute)
 
+    setattr(sys.modules[package], name, value)
+    return value
 
+def __getattr__(name):
+    return load_lazy(__name__, LAZY, name)
 
+def __dir__():
+    return sorted(set(globals()) | set(LAZY))
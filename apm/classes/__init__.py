@@ -5,19 +5,61 @@ __version__ = '1.0'
 __author__ = 'Thom Williams'
 __copyright__ = 'Copyright 2014 PNNL'
 
-from . import db
-from . import reproc_db
-from . import files
-from . import system
-from . import ui
-from . import unpack
-from . import vapmgr
-from . import test
-from . import mock
+from .. import load_lazy
 
-from .db import DB
-from .reproc_db import ReprocDB
-from .files import Files
-from .ui import UI
-from .unpack import UnPack
-from .vapmgr import VapMgr
+# Imported the first time they are used: {name: (module, attribute or None)}
+LAZY = {
+    'db': ('apm.classes.db', None),
+    'reproc_db': ('apm.classes.reproc_db', None),
+    'files': ('apm.classes.files', None),
+    'system': ('apm.classes.system', None),
+    'ui': ('apm.classes.ui', None),
+    'unpack': ('apm.classes.unpack', None),
+    'vapmgr': ('apm.classes.vapmgr', None),
+    'catalog': ('apm.classes.catalog', None),
+    'materialize': ('apm.classes.materialize', None),
+    'fasttar': ('apm.classes.fasttar', None),
+    'record': ('apm.classes.record', None),
+    'ledger': ('apm.classes.ledger', None),
+    'hashcache': ('apm.classes.hashcache', None),
+    'digest': ('apm.classes.digest', None),
+    'snapshot': ('apm.classes.snapshot', None),
+    'renamer': ('apm.classes.renamer', None),
+    'trash': ('apm.classes.trash', None),
+    'dirtree': ('apm.classes.dirtree', None),
+    'trackedstate': ('apm.classes.trackedstate', None),
+    'watcher': ('apm.classes.watcher', None),
+    'batch': ('apm.classes.batch', None),
+    'scheduler': ('apm.classes.scheduler', None),
+    'jobstore': ('apm.classes.jobstore', None),
+    'test': ('apm.classes.test', None),
+    'mock': ('apm.classes.mock', None),
+
+    'DB': ('apm.classes.db', 'DB'),
+    'ReprocDB': ('apm.classes.reproc_db', 'ReprocDB'),
+    'Files': ('apm.classes.files', 'Files'),
+    'UI': ('apm.classes.ui', 'UI'),
+    'UnPack': ('apm.classes.unpack', 'UnPack'),
+    'VapMgr': ('apm.classes.vapmgr', 'VapMgr'),
+    'TarCatalog': ('apm.classes.catalog', 'TarCatalog'),
+    'Materializer': ('apm.classes.materialize', 'Materializer'),
+    'FastTar': ('apm.classes.fasttar', 'FastTar'),
+    'FileRecord': ('apm.classes.record', 'FileRecord'),
+    'FileLedger': ('apm.classes.ledger', 'FileLedger'),
+    'JobStore': ('apm.classes.jobstore', 'JobStore'),
+    'HashCache': ('apm.classes.hashcache', 'HashCache'),
+    'TreeSnapshot': ('apm.classes.snapshot', 'TreeSnapshot'),
+    'Renamer': ('apm.classes.renamer', 'Renamer'),
+    'Trash': ('apm.classes.trash', 'Trash'),
+    'DirTree': ('apm.classes.dirtree', 'DirTree'),
+    'TrackedState': ('apm.classes.trackedstate', 'TrackedState'),
+    'Watcher': ('apm.classes.watcher', 'Watcher'),
+    'Batch': ('apm.classes.batch', 'Batch'),
+    'Scheduler': ('apm.classes.scheduler', 'Scheduler'),
+}
+
+def __getattr__(name):
+    return load_lazy(__name__, LAZY, name)
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY))
@@ -0,0 +1,383 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import unittest
+import tempfile
+import shutil
+
+# Commands a job of a batch may run
+COMMANDS = ['auto', 'stage', 'rename', 'process', 'review', 'remove', 'archive', 'cleanup', 'prep', 'notification', 'trash']
+
+# Commands that unpack tar files and commands that run ingests
+EXTRACT_COMMANDS = ['auto', 'stage']
+INGEST_COMMANDS = ['process']
+
+DEFAULT_LIMITS = {'jobs': 4, 'extract': 4, 'ingest': 4, 'db': 8}
+
+class Budget:
+    """
+        Counts of shared resources, taken all at once by a command and given back when it is done
+        Requests are served in the order they are made, so a large one is not starved by smaller ones
+    """
+
+    def __init__(self, limits):
+        self.limits = dict(limits)
+        self.used = dict((k, 0) for k in limits)
+        self.queue = []
+        self.lock = threading.Condition()
+
+    def check(self, needs):
+        """ Raise ValueError for a need larger than its limit, it could never be met """
+        for k, v in needs.items():
+            if k in self.limits and v > self.limits[k]:
+                raise ValueError('needs {} {} but --{}-limit is {}'.format(v, k, k, self.limits[k]))
+
+    def acquire(self, needs):
+        self.check(needs)
+        needs = dict((k, v) for k, v in needs.items() if k in self.limits)
+        ticket = object()
+        with self.lock:
+            self.queue.append(ticket)
+            while self.queue[0] is not ticket or any(self.used[k] + v > self.limits[k] for k, v in needs.items()):
+                self.lock.wait()
+
+            self.queue.pop(0)
+            for k, v in needs.items():
+                self.used[k] += v
+            self.lock.notify_all()
+
+        return needs
+
+    def release(self, needs):
+        with self.lock:
+            for k, v in needs.items():
+                self.used[k] -= v
+            self.lock.notify_all()
+
+def load_manifest(path):
+    """
+        Read a manifest of jobs, either a list of jobs or {"defaults": {...}, "jobs": [...]}
+        Each job is {"job", "commands", "datastream", "begin", "end", "extract_workers", "stage_workers", "ingest_workers", "args"}
+        Only "job" is required, the defaults fill in the rest
+    """
+    fp = open(path, 'r')
+    try:
+        manifest = json.loads(fp.read())
+    except ValueError as e:
+        exit('Unable to read the manifest {}: {}'.format(path, e))
+    finally:
+        fp.close()
+
+    if type(manifest) == list:
+        manifest = {'jobs': manifest}
+
+    defaults = manifest.get('defaults', {})
+    jobs = []
+    seen = set()
+    for entry in manifest.get('jobs', []):
+        job = dict(defaults, **entry)
+        if not job.get('job'):
+            exit('Every job in the manifest needs a "job": {}'.format(entry))
+
+        job['job'] = str(job['job'])
+        if job['job'] in seen:
+            exit('The job {} is in the manifest more than once'.format(job['job']))
+        seen.add(job['job'])
+
+        if type(job.get('commands')) == str:
+            job['commands'] = [job['commands']]
+        if not job.get('commands'):
+            exit('No commands to run for the job {}'.format(job['job']))
+
+        for command in job['commands']:
+            if command not in COMMANDS:
+                exit('The job {} runs an unknown command: {}. Available commands: {}'.format(job['job'], command, ', '.join(COMMANDS)))
+
+        if type(job.get('datastream')) == str:
+            job['datastream'] = [job['datastream']]
+
+        jobs.append(job)
+
+    if len(jobs) == 0:
+        exit('There are no jobs in the manifest {}'.format(path))
+
+    return jobs
+
+class Batch:
+    """
+        Run the command chains of many jobs at the same time, each command in its own apm process
+        Each command holds its share of the extraction workers, ingests and database
+        connections while it runs, so the jobs together never go over the limits
+        APM_BATCH is set for the commands so they exit with 1 when they stop early
+    """
+
+    def __init__(self, jobs, script, log_dir, limits=None):
+        self.jobs = jobs
+        self.script = script
+        self.log_dir = log_dir
+        self.limits = dict(DEFAULT_LIMITS, **dict((k, v) for k, v in (limits or {}).items() if v != None))
+        self.budget = Budget(dict((k, max(1, int(v))) for k, v in self.limits.items() if k != 'jobs'))
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def get_log(self, job):
+        return os.path.join(self.log_dir, '{}.log'.format(job['job']))
+
+    def get_workers(self, job):
+        """ Return the extraction settings of a job, scaled down to fit in the extraction limit """
+        stage_workers = max(1, min(int(job.get('stage_workers') or 1), self.budget.limits['extract']))
+        extract_workers = max(1, min(int(job.get('extract_workers') or 1), self.budget.limits['extract'] // stage_workers))
+        return stage_workers, extract_workers
+
+    def get_ingests(self, job):
+        """ Return the ingests process runs at once, one per datastream up to the limits unless the job sets them """
+        if job.get('ingest_workers'):
+            return int(job['ingest_workers'])
+
+        return max(1, min(len(job.get('datastream') or []) or 1, self.budget.limits['ingest'], self.budget.limits['db'] - 1))
+
+    def get_needs(self, job, command):
+        """ Return the resources a command of a job holds while it runs """
+        needs = {'extract': 0, 'ingest': 0, 'db': 1}
+        if command in EXTRACT_COMMANDS:
+            stage_workers, extract_workers = self.get_workers(job)
+            needs['extract'] = stage_workers * extract_workers
+
+        # Every ingest connects to the database on its own
+        if command in INGEST_COMMANDS:
+            needs['ingest'] = self.get_ingests(job)
+            needs['db'] += needs['ingest']
+
+        return needs
+
+    def get_args(self, job, command):
+        """ Return the command line of a command of a job """
+        args = [sys.executable, self.script, command, '-j', job['job'], '-q']
+        if job.get('datastream'):
+            args += ['-d'] + job['datastream']
+        if job.get('begin'):
+            args += ['-b', str(job['begin'])]
+        if job.get('end'):
+            args += ['-e', str(job['end'])]
+
+        stage_workers, extract_workers = self.get_workers(job)
+        args += ['--stage-workers', str(stage_workers), '--extract-workers', str(extract_workers)]
+
+        # process never runs more ingests than the command holds
+        if command in INGEST_COMMANDS:
+            args += ['--ingest-workers', str(self.get_ingests(job))]
+
+        return args + [str(i) for i in job.get('args', [])]
+
+    def run_job(self, job):
+        """ Run the commands of a job in order, stopping at the first one that fails """
+        # A command that needs more than a limit would wait forever, the job is not started
+        for command in job['commands']:
+            try:
+                self.budget.check(self.get_needs(job, command))
+            except ValueError as e:
+                raise ValueError('{} {}'.format(command, e))
+
+        result = {'job': job['job'], 'status': 'done', 'commands': [], 'log': self.get_log(job)}
+        start = time.time()
+
+        log = open(result['log'], 'a')
+        try:
+            for command in job['commands']:
+                needs = self.budget.acquire(self.get_needs(job, command))
+                began = time.time()
+                try:
+                    args = self.get_args(job, command)
+                    log.write('\n{}\n{} {}\n{}\n'.format('*' * 50, time.strftime('%Y-%m-%d %H:%M:%S'), ' '.join(args), '*' * 50))
+                    log.flush()
+                    code = subprocess.call(args, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, env=dict(os.environ, APM_BATCH='1'))
+                finally:
+                    self.budget.release(needs)
+
+                result['commands'].append({'command': command, 'code': code, 'time': time.time() - began})
+                if code != 0:
+                    result['status'] = 'failed'
+                    result['failed'] = command
+                    break
+        finally:
+            log.close()
+
+        result['time'] = time.time() - start
+        with self.lock:
+            self.results[job['job']] = result
+            print('{} {} ({:.0f}s)'.format(job['job'], 'finished' if result['status'] == 'done' else 'failed at {}'.format(result['failed']), result['time']))
+            sys.stdout.flush()
+
+        return result
+
+    def run(self):
+        """ Run every job, return the results in the order of the manifest """
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max(1, int(self.limits['jobs']))) as pool:
+            for job in self.jobs:
+                futures[job['job']] = pool.submit(self.run_job, job)
+
+        # A job that could not be started still shows up in the summary
+        for job in self.jobs:
+            error = futures[job['job']].exception()
+            if error != None:
+                self.results[job['job']] = {'job': job['job'], 'status': 'error', 'commands': [], 'log': self.get_log(job), 'time': 0, 'error': str(error)}
+
+        results = [self.results[job['job']] for job in self.jobs]
+        fp = open(os.path.join(self.log_dir, 'summary.json'), 'w')
+        fp.write(json.dumps(results, indent=2))
+        fp.close()
+
+        return results
+
+    def summary(self, results):
+        """ Return a table of the results """
+        lines = ['{:<20} {:<8} {:<30} {:>8}  {}'.format('job', 'status', 'commands', 'time', 'log')]
+        for result in results:
+            commands = ' '.join('{}{}'.format(i['command'], '' if i['code'] == 0 else '({})'.format(i['code'])) for i in result['commands'])
+            lines.append('{:<20} {:<8} {:<30} {:>7.0f}s  {}'.format(result['job'], result['status'], commands, result['time'], result['log']))
+            if 'error' in result:
+                lines.append('    {}'.format(result['error']))
+
+        failed = len([i for i in results if i['status'] != 'done'])
+        lines.append('{} jobs, {} failed'.format(len(results), failed))
+        return '\n'.join(lines)
+
+################################################################################
+# Unit tests
+################################################################################
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+        # Stands in for apm, prints its arguments, fails archive and stops review early
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.script = '{}/apm.py'.format(self.path)
+        fp = open(self.script, 'w')
+        fp.write('\n'.join([
+            'import sys, time',
+            'sys.path.insert(0, {!r})'.format(root),
+            'from apm.classes.system import get_exit_code',
+            'print(" ".join(sys.argv[1:]))',
+            'time.sleep(0.2)',
+            'if sys.argv[1] == "review":',
+            '    exit(get_exit_code({"exit": True, "duplicates": False}))',
+            'sys.exit(1 if sys.argv[1] == "archive" else 0)',
+        ]))
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ Read a manifest with defaults -> jobs with the defaults filled in """
+        manifest = '{}/jobs.json'.format(self.path)
+        fp = open(manifest, 'w')
+        fp.write(json.dumps({
+            'defaults': {'commands': ['stage', 'process'], 'begin': 20190101},
+            'jobs': [{'job': 'D1', 'datastream': 'sgpmfrsrC1.00'}, {'job': 'D2', 'commands': 'archive', 'begin': 20190201}],
+        }))
+        fp.close()
+
+        jobs = load_manifest(manifest)
+        result = [(i['job'], i['commands'], i['begin'], i.get('datastream')) for i in jobs]
+        expected = [('D1', ['stage', 'process'], 20190101, ['sgpmfrsrC1.00']), ('D2', ['archive'], 20190201, None)]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Take a budget from two threads -> never over the limit, a need over the limit is refused """
+        budget = Budget({'extract': 3, 'db': 2})
+        peak = [0]
+        def take(needs):
+            needs = budget.acquire(needs)
+            peak[0] = max(peak[0], budget.used['extract'])
+            time.sleep(0.05)
+            budget.release(needs)
+
+        threads = [threading.Thread(target=take, args=({'extract': i, 'db': 1},)) for i in [2, 2, 3, 1]]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+
+        try:
+            budget.acquire({'extract': 5, 'db': 1})
+            refused = None
+        except ValueError as e:
+            refused = str(e)
+
+        result = [peak[0], budget.used, refused]
+        expected = [3, {'extract': 0, 'db': 0}, 'needs 5 extract but --extract-limit is 3']
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ Run two jobs, one failing at archive -> the chain stops there and the logs have each command """
+        jobs = [
+            {'job': 'D1', 'commands': ['stage', 'archive', 'cleanup'], 'extract_workers': 4, 'stage_workers': 2},
+            {'job': 'D2', 'commands': ['stage', 'process'], 'datastream': ['sgpmfrsrC1.00', 'sgpmetE13.00']},
+        ]
+        batch = Batch(jobs, self.script, '{}/logs'.format(self.path), {'extract': 4})
+        results = batch.run()
+
+        fp = open('{}/logs/D1.log'.format(self.path))
+        log = fp.read()
+        fp.close()
+
+        result = [[(i['status'], [j['command'] for j in i['commands']]) for i in results], 'stage -j D1 -q --stage-workers 2 --extract-workers 2' in log]
+        expected = [[('failed', ['stage', 'archive']), ('done', ['stage', 'process'])], True]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert os.path.exists('{}/logs/summary.json'.format(self.path))
+
+    def test_4(self):
+        """ Run a command that stops early, which exits with 0 outside a batch -> the job fails there """
+        jobs = [{'job': 'D1', 'commands': ['stage', 'review', 'process']}]
+        results = Batch(jobs, self.script, '{}/logs'.format(self.path)).run()
+
+        env = dict((k, v) for k, v in os.environ.items() if k != 'APM_BATCH')
+        alone = subprocess.call([sys.executable, self.script, 'review'], stdout=subprocess.DEVNULL, env=env)
+
+        result = [results[0]['status'], [(i['command'], i['code']) for i in results[0]['commands']], alone]
+        expected = ['failed', [('stage', 0), ('review', 1)], 0]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_5(self):
+        """ Run ingests within the limits and a job asking for more -> ingest count passed, the other job is refused """
+        jobs = [
+            {'job': 'D1', 'commands': ['process'], 'datastream': ['sgpmfrsrC1.00', 'sgpmetE13.00', 'sgpaosC1.00']},
+            {'job': 'D2', 'commands': ['stage', 'process'], 'ingest_workers': 3},
+        ]
+        batch = Batch(jobs, self.script, '{}/logs'.format(self.path), {'ingest': 2, 'db': 4})
+        results = batch.run()
+
+        fp = open('{}/logs/D1.log'.format(self.path))
+        log = fp.read()
+        fp.close()
+
+        result = [[i['status'] for i in results], batch.get_needs(jobs[0], 'process'), '--ingest-workers 2' in log, results[1]['error']]
+        expected = [['done', 'error'], {'extract': 0, 'ingest': 2, 'db': 3}, True, 'process needs 3 ingest but --ingest-limit is 2']
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert not os.path.exists('{}/logs/D2.log'.format(self.path))
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
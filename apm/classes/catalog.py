@@ -0,0 +1,212 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import json
+import bisect
+import tempfile
+
+import unittest
+import shutil
+
+from apm.classes.system import dir_pattern
+
+CACHE_HOME = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+class TarCatalog:
+    """ Date indexed list of the tar files in a datastream directory """
+
+    def __init__(self, path, cache_dir=None):
+        """ Initialize with the archive path of the datastream """
+        self.path = path.rstrip('/')
+
+        # The catalog is not written next to the tar files because
+        #  writing it would change the mtime it is validated against
+        if cache_dir == None:
+            cache_dir = os.path.join(CACHE_HOME, 'apm', 'catalog')
+        self.cache_dir = cache_dir
+        self.cache_file = dir_pattern().format(cache_dir, '{}.json'.format(self.path.strip('/').replace('/', '%')))
+
+        self.mtime = None
+        self.dates = []
+        self.tars = {}
+        self.loaded = False
+
+    def load(self):
+        """ Load the catalog from the cache, rebuilding it if the directory has changed """
+        mtime = os.stat(self.path).st_mtime_ns
+
+        try:
+            fp = open(self.cache_file, 'r')
+            cache = json.loads(fp.read())
+            fp.close()
+        except (IOError, OSError, ValueError):
+            cache = None
+
+        if cache != None and cache.get('mtime') == mtime:
+            self.mtime = mtime
+            self.tars = cache['tars']
+            self.dates = sorted(self.tars.keys())
+        else:
+            self.build(mtime)
+            self.save()
+
+        self.loaded = True
+        return self
+
+    def build(self, mtime=None):
+        """ Scan the directory once and index the tar files by date """
+        if mtime == None:
+            mtime = os.stat(self.path).st_mtime_ns
+
+        tars = {}
+        for entry in os.scandir(self.path):
+            name = entry.name
+            if name.startswith('.') or not name.endswith('.tar'):
+                continue
+
+            date = self.get_date(name)
+            if date == None:
+                continue
+
+            if date not in tars:
+                tars[date] = [name]
+            else:
+                tars[date].append(name)
+
+        for i in tars:
+            tars[i].sort()
+
+        self.mtime = mtime
+        self.tars = tars
+        self.dates = sorted(tars.keys())
+
+    def save(self):
+        """ Write the catalog to the cache """
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            fd, temp = tempfile.mkstemp(dir=self.cache_dir, prefix='.catalog')
+            fp = os.fdopen(fd, 'w')
+            fp.write(json.dumps({'path': self.path, 'mtime': self.mtime, 'tars': self.tars}))
+            fp.close()
+            os.replace(temp, self.cache_file)
+        except OSError:
+            # The catalog is only a cache, the directory will be scanned next time
+            pass
+
+    def get_date(self, name):
+        """ Return the YYYYMMDD date from a tar file name """
+        temp = name.split('.')
+        if len(temp) < 3:
+            return
+
+        date = temp[2]
+        if len(date) == 6:
+            date = "19%s" % date
+
+        if len(date) < 8 or not date[:8].isdigit():
+            return
+
+        return date[:8]
+
+    def is_empty(self):
+        if not self.loaded:
+            self.load()
+
+        return len(self.dates) == 0
+
+    def get_range(self, begin, end):
+        """
+            Return the tar files between begin and end (YYYYMMDD)
+            The closest date before begin and after end are included
+            so all of the data in the range is collected
+        """
+        if not self.loaded:
+            self.load()
+
+        if len(self.dates) == 0:
+            return
+
+        begin = str(begin)[:8]
+        end = str(end)[:8]
+
+        begin_index = max(bisect.bisect_left(self.dates, begin) - 1, 0)
+        end_index = min(bisect.bisect_right(self.dates, end), len(self.dates) - 1)
+
+        if begin_index > end_index:
+            return
+
+        tar_files = []
+        for i in range(begin_index, end_index + 1):
+            tar_files.extend(self.tars[self.dates[i]])
+
+        return tar_files
+
+################################################################################
+# Unit tests
+################################################################################
+class TestGetRange(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.archive = dir_pattern().format(self.path, 'sgpmfrsrC1.00')
+        self.cache = dir_pattern().format(self.path, 'cache')
+        os.mkdir(self.archive)
+
+        for i in ['20140501', '20140503', '20140505', '20140507']:
+            for j in range(2):
+                name = 'sgpmfrsrC1.00.{}.{:02d}0000.tar'.format(i, j)
+                open(dir_pattern().format(self.archive, name), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ Range inside the data -> include the date before and after """
+        catalog = TarCatalog(self.archive, self.cache)
+        result = catalog.get_range(20140503, 20140505)
+        expected = [
+            'sgpmfrsrC1.00.20140501.000000.tar', 'sgpmfrsrC1.00.20140501.010000.tar',
+            'sgpmfrsrC1.00.20140503.000000.tar', 'sgpmfrsrC1.00.20140503.010000.tar',
+            'sgpmfrsrC1.00.20140505.000000.tar', 'sgpmfrsrC1.00.20140505.010000.tar',
+            'sgpmfrsrC1.00.20140507.000000.tar', 'sgpmfrsrC1.00.20140507.010000.tar',
+        ]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Range after the data -> return the last date """
+        catalog = TarCatalog(self.archive, self.cache)
+        result = catalog.get_range(20150101, 20150102)
+        expected = ['sgpmfrsrC1.00.20140507.000000.tar', 'sgpmfrsrC1.00.20140507.010000.tar']
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ New tar file -> catalog is rebuilt """
+        TarCatalog(self.archive, self.cache).load()
+        name = 'sgpmfrsrC1.00.20140509.000000.tar'
+        open(dir_pattern().format(self.archive, name), 'w').close()
+        os.utime(self.archive, ns=(0, os.stat(self.archive).st_mtime_ns + 1))
+
+        result = TarCatalog(self.archive, self.cache).get_range(20140509, 20140509)
+        expected = ['sgpmfrsrC1.00.20140507.000000.tar', 'sgpmfrsrC1.00.20140507.010000.tar', name]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_4(self):
+        """ Empty directory -> return None """
+        shutil.rmtree(self.archive)
+        os.mkdir(self.archive)
+        result = TarCatalog(self.archive, self.cache).get_range(20140501, 20140507)
+        expected = None
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
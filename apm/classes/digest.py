@@ -0,0 +1,54 @@
+#!/apps/base/python3/bin/python3
+
+import hashlib
+
+import unittest
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Digests used to check that two local copies of a file are the same
+ALGORITHMS = {
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+}
+if xxhash != None:
+    ALGORITHMS['xxh3'] = xxhash.xxh3_128
+
+def new(algorithm):
+    """ Return a new hasher for the algorithm """
+    if algorithm not in ALGORITHMS:
+        raise ValueError('Unknown digest {}, available: {}'.format(algorithm, ', '.join(sorted(ALGORITHMS))))
+
+    return ALGORITHMS[algorithm]()
+
+################################################################################
+# Unit tests
+################################################################################
+class TestDigest(unittest.TestCase):
+    def test_1(self):
+        """ Hash with each algorithm -> same as hashlib """
+        result = {}
+        for i in ['sha256', 'blake2b']:
+            h = new(i)
+            h.update(b'hello, ')
+            h.update(b'World!')
+            result[i] = h.digest()
+
+        expected = {
+            'sha256': hashlib.sha256(b'hello, World!').digest(),
+            'blake2b': hashlib.blake2b(b'hello, World!', digest_size=32).digest(),
+        }
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Ask for an unknown algorithm -> ValueError """
+        self.assertRaises(ValueError, new, 'crc')
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
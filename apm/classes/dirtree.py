@@ -0,0 +1,213 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import shutil
+import threading
+
+import unittest
+import tempfile
+
+# One tree per directory so every command of a run shares its listings
+TREES = {}
+TREES_LOCK = threading.Lock()
+
+class DirTree:
+    """
+        Directory listings of a tree read once with scandir
+        The DirEntry objects keep the entry types and stat results, so a
+        directory is only read again after it is changed through the tree or
+        invalidated by code that writes to it some other way
+        Paths are relative to the root, '' is the root itself
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.listings = {}
+
+    @staticmethod
+    def open(root):
+        """ Return the shared tree of root """
+        root = os.path.abspath(root)
+        with TREES_LOCK:
+            if root not in TREES:
+                TREES[root] = DirTree(root)
+
+            return TREES[root]
+
+    @staticmethod
+    def reset():
+        """ Forget every listing of every shared tree """
+        with TREES_LOCK:
+            for tree in TREES.values():
+                tree.invalidate()
+
+    def get_path(self, relpath=''):
+        return os.path.join(self.root, relpath) if relpath else self.root
+
+    def entries(self, relpath=''):
+        """ Return {name: os.DirEntry} of a directory """
+        relpath = relpath.strip('/')
+        if relpath not in self.listings:
+            with os.scandir(self.get_path(relpath)) as entries:
+                self.listings[relpath] = dict((entry.name, entry) for entry in entries)
+
+        return self.listings[relpath]
+
+    def listdir(self, relpath=''):
+        return list(self.entries(relpath))
+
+    def dirs(self, relpath=''):
+        """ Return the names of the subdirectories, symlinks to directories are left out """
+        return [k for k, v in self.entries(relpath).items() if v.is_dir(follow_symlinks=False)]
+
+    def files(self, relpath=''):
+        """ Return the names of everything that is not a directory """
+        return [k for k, v in self.entries(relpath).items() if not v.is_dir()]
+
+    def get(self, relpath):
+        """ Return the DirEntry of a path, None if it does not exist """
+        parent, name = os.path.split(relpath.strip('/'))
+        try:
+            return self.entries(parent).get(name)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def exists(self, relpath):
+        return relpath.strip('/') == '' or self.get(relpath) != None
+
+    def isdir(self, relpath):
+        if relpath.strip('/') == '':
+            return os.path.isdir(self.root)
+
+        entry = self.get(relpath)
+        return entry != None and entry.is_dir()
+
+    def isfile(self, relpath):
+        entry = self.get(relpath)
+        return entry != None and entry.is_file()
+
+    def islink(self, relpath):
+        entry = self.get(relpath)
+        return entry != None and entry.is_symlink()
+
+    def stat(self, relpath):
+        """ Return the cached stat of a path, following symlinks """
+        entry = self.get(relpath)
+        if entry == None:
+            raise FileNotFoundError(2, 'No such file or directory', self.get_path(relpath))
+
+        return entry.stat()
+
+    def walk(self, relpath=''):
+        """ Yield (relpath, dirs, files) top down like os.walk, without following symlinks """
+        relpath = relpath.strip('/')
+        dirs = sorted(self.dirs(relpath))
+        yield relpath, dirs, sorted(self.files(relpath))
+
+        for name in dirs:
+            for i in self.walk(os.path.join(relpath, name) if relpath else name):
+                yield i
+
+    def is_empty(self, relpath=''):
+        """ Return True if there are no files in a directory or any of its subdirectories """
+        for path, dirs, files in self.walk(relpath):
+            if len(files) > 0:
+                return False
+
+        return True
+
+    def invalidate(self, relpath=None):
+        """ Forget the listing of a directory and of everything under it, or of the whole tree """
+        if relpath == None:
+            self.listings = {}
+            return
+
+        relpath = relpath.strip('/')
+        if relpath == '':
+            self.listings = {}
+            return
+
+        for i in list(self.listings):
+            if i == relpath or i.startswith(relpath + '/'):
+                del self.listings[i]
+
+    def changed(self, relpath):
+        """ Forget the listings changed by creating or removing relpath """
+        self.invalidate(relpath)
+        self.invalidate_listing(os.path.dirname(relpath.strip('/')))
+
+    def invalidate_listing(self, relpath):
+        self.listings.pop(relpath.strip('/'), None)
+
+    def mkdir(self, relpath):
+        os.mkdir(self.get_path(relpath))
+        self.changed(relpath)
+
+    def remove(self, relpath):
+        os.remove(self.get_path(relpath))
+        self.changed(relpath)
+
+    def rename(self, src, dst):
+        """ Rename a path, moving it across filesystems if needed """
+        try:
+            os.rename(self.get_path(src), self.get_path(dst))
+        except OSError:
+            shutil.move(self.get_path(src), self.get_path(dst))
+
+        self.changed(src)
+        self.changed(dst)
+
+    def move(self, relpath, folder):
+        """ Move a path into a directory, keeping its name """
+        self.rename(relpath, os.path.join(folder.strip('/'), os.path.basename(relpath.strip('/'))))
+
+################################################################################
+# Unit tests
+################################################################################
+class TestDirTree(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for i in ['sgp/sgpmfrsrC1.00', 'sgp/sgpmfrsrC1.b1', 'sgp/empty.00/other_files']:
+            os.makedirs('{}/{}'.format(self.path, i))
+        for i in ['sgp/sgpmfrsrC1.00/a.dat', 'sgp/sgpmfrsrC1.00/b.dat', 'sgp/sgpmfrsrC1.b1/c.nc']:
+            open('{}/{}'.format(self.path, i), 'w').close()
+        os.symlink('{}/sgp/sgpmfrsrC1.b1'.format(self.path), '{}/sgp/link.b1'.format(self.path))
+
+        self.tree = DirTree(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ Walk the tree -> directories and files, symlinks are not followed """
+        result = list(self.tree.walk('sgp'))
+        expected = [
+            ('sgp', ['empty.00', 'sgpmfrsrC1.00', 'sgpmfrsrC1.b1'], []),
+            ('sgp/empty.00', ['other_files'], []),
+            ('sgp/empty.00/other_files', [], []),
+            ('sgp/sgpmfrsrC1.00', [], ['a.dat', 'b.dat']),
+            ('sgp/sgpmfrsrC1.b1', [], ['c.nc']),
+        ]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert self.tree.isdir('sgp/link.b1') and self.tree.islink('sgp/link.b1')
+        assert self.tree.is_empty('sgp/empty.00') and not self.tree.is_empty('sgp')
+
+    def test_2(self):
+        """ Change the tree behind its back, then through the model -> listings follow the model only """
+        self.tree.listdir('sgp/sgpmfrsrC1.00')
+        open('{}/sgp/sgpmfrsrC1.00/c.dat'.format(self.path), 'w').close()
+        result = [sorted(self.tree.files('sgp/sgpmfrsrC1.00'))]
+
+        self.tree.mkdir('sgp/sgpmfrsrC1.00/no_archive')
+        self.tree.move('sgp/sgpmfrsrC1.00/a.dat', 'sgp/sgpmfrsrC1.00/no_archive')
+        result += [sorted(self.tree.files('sgp/sgpmfrsrC1.00')), self.tree.listdir('sgp/sgpmfrsrC1.00/no_archive')]
+        expected = [['a.dat', 'b.dat'], ['b.dat', 'c.dat'], ['a.dat']]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,280 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import mmap
+import errno
+
+import unittest
+import tarfile
+import tempfile
+import shutil
+import hashlib
+import io
+
+BLOCK = 512
+CHUNK = 1048576
+
+REGTYPES = (b'0', b'\x00')
+DIRTYPE = b'5'
+
+class FastTarError(Exception):
+    """ The tar file uses a feature the fast reader does not handle """
+    pass
+
+class FastMember:
+    """ A regular file or directory in a tar file """
+    __slots__ = ['name', 'offset', 'size', 'mtime', 'mode', 'type']
+
+    def __init__(self, name, offset, size, mtime, mode, type):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.type = type
+
+    def isfile(self):
+        return self.type in REGTYPES
+
+    def isdir(self):
+        return self.type == DIRTYPE
+
+class MemberReader:
+    """ File like reader over the data of a member, read returns memoryview slices """
+
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.view) - self.pos
+        buf = self.view[self.pos:self.pos + size]
+        self.pos += len(buf)
+        return buf
+
+class FastTar:
+    """
+        Read uncompressed ustar/gnu tar files that only hold regular files and directories
+        The headers are scanned through mmap and members are extracted with
+        copy_file_range, anything else raises FastTarError so the caller can use tarfile
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self.fd).st_size
+        self.map = None
+        if self.size > 0:
+            self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.map != None:
+            self.map.close()
+            self.map = None
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_number(self, field):
+        """ Parse a nul or space terminated octal field """
+        if len(field) > 0 and field[0] & 0x80:
+            raise FastTarError('base-256 number')
+
+        field = field.split(b'\x00', 1)[0].strip()
+        if field == b'':
+            return 0
+
+        try:
+            return int(field, 8)
+        except ValueError:
+            raise FastTarError('invalid number field')
+
+    def getmembers(self):
+        """ Return the member table """
+        members = []
+        if self.map == None:
+            return members
+
+        offset = 0
+        while offset + BLOCK <= self.size:
+            header = self.map[offset:offset + BLOCK]
+            if header.count(0) == BLOCK:
+                break
+
+            checksum = self.get_number(header[148:156])
+            unsigned = sum(header[:148]) + sum(header[156:]) + 256
+            if checksum != unsigned and checksum != unsigned - 256 * sum(1 for i in header if i > 127):
+                raise FastTarError('bad header checksum at {}'.format(offset))
+
+            type = header[156:157]
+            if type not in REGTYPES and type != DIRTYPE:
+                # Long names, links, pax headers and sparse files
+                raise FastTarError('unsupported member type {}'.format(type))
+
+            name = header[0:100].split(b'\x00', 1)[0]
+            if header[257:263] == b'ustar\x00':
+                prefix = header[345:500].split(b'\x00', 1)[0]
+                if prefix != b'':
+                    name = prefix + b'/' + name
+
+            name = name.decode('utf-8', 'surrogateescape')
+            if type == DIRTYPE:
+                name = name.rstrip('/')
+
+            if name.startswith('/') or '..' in name.split('/'):
+                raise FastTarError('unsafe member name {}'.format(name))
+
+            size = self.get_number(header[124:136]) if type in REGTYPES else 0
+            if offset + BLOCK + size > self.size:
+                raise FastTarError('truncated member {}'.format(name))
+
+            members.append(FastMember(
+                name,
+                offset + BLOCK,
+                size,
+                self.get_number(header[136:148]),
+                self.get_number(header[100:108]),
+                type,
+            ))
+
+            offset += BLOCK + (size + BLOCK - 1) // BLOCK * BLOCK
+
+        return members
+
+    def getnames(self):
+        return [m.name for m in self.getmembers()]
+
+    def extractfile(self, member):
+        """ Return a reader over the data of a member """
+        return MemberReader(memoryview(self.map)[member.offset:member.offset + member.size])
+
+    def extract(self, member, path, hasher=None):
+        """
+            Write a member to path, the data is copied by the kernel
+            The data is passed to hasher from the mapped file if one is given
+        """
+        # Other workers may be creating the same directory
+        if member.isdir():
+            os.makedirs(path, exist_ok=True)
+            os.chmod(path, member.mode)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        out = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            pos = 0
+            kernel = hasattr(os, 'copy_file_range')
+            while pos < member.size:
+                count = min(CHUNK, member.size - pos)
+                if hasher != None:
+                    hasher.update(memoryview(self.map)[member.offset + pos:member.offset + pos + count])
+
+                sent = 0
+                if kernel:
+                    try:
+                        sent = os.copy_file_range(self.fd, out, count, member.offset + pos)
+                    except OSError as e:
+                        if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                            raise e
+                        kernel = False
+
+                if sent == 0:
+                    sent = os.write(out, memoryview(self.map)[member.offset + pos:member.offset + pos + count])
+
+                pos += sent
+        finally:
+            os.close(out)
+
+        os.chmod(path, member.mode)
+        os.utime(path, (member.mtime, member.mtime))
+
+################################################################################
+# Unit tests
+################################################################################
+class TestFastTar(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.tar = '{}/test.tar'.format(self.path)
+        self.data = {
+            'sgpmfrsrC1.00.20140501.000000.raw.dat': b'hello, World!',
+            'sgpmfrsrC1.00.20140501.010000.raw.dat': b'x' * 3000,
+            'sub/empty.dat': b'',
+        }
+
+        tar = tarfile.open(self.tar, 'w', format=tarfile.USTAR_FORMAT)
+        info = tarfile.TarInfo('sub')
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        tar.addfile(info)
+        for i in sorted(self.data):
+            info = tarfile.TarInfo(i)
+            info.size = len(self.data[i])
+            info.mtime = 1400000000
+            tar.addfile(info, io.BytesIO(self.data[i]))
+        tar.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ List a ustar file -> same names as tarfile """
+        tar = tarfile.open(self.tar, 'r')
+        expected = tar.getnames()
+        tar.close()
+
+        with FastTar(self.tar) as fast:
+            result = fast.getnames()
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Extract the members -> same data, mtime and sha256 """
+        dest = '{}/out'.format(self.path)
+        with FastTar(self.tar) as fast:
+            for m in fast.getmembers():
+                hasher = hashlib.sha256()
+                fast.extract(m, '{}/{}'.format(dest, m.name), hasher)
+                if m.isfile():
+                    assert hasher.digest() == hashlib.sha256(self.data[m.name]).digest()
+
+        result = {}
+        for i in self.data:
+            result[i] = open('{}/{}'.format(dest, i), 'rb').read()
+            assert os.path.getmtime('{}/{}'.format(dest, i)) == 1400000000
+        expected = self.data
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ Pass a tar with a symlink -> FastTarError """
+        tar = tarfile.open(self.tar, 'a')
+        info = tarfile.TarInfo('link')
+        info.type = tarfile.SYMTYPE
+        info.linkname = 'sub'
+        tar.addfile(info)
+        tar.close()
+
+        with FastTar(self.tar) as fast:
+            self.assertRaises(FastTarError, fast.getmembers)
+
+    def test_4(self):
+        """ Pass a tar with a long gnu name -> FastTarError """
+        tar = tarfile.open(self.tar, 'a', format=tarfile.GNU_FORMAT)
+        info = tarfile.TarInfo('a' * 150)
+        tar.addfile(info, io.BytesIO(b''))
+        tar.close()
+
+        with FastTar(self.tar) as fast:
+            self.assertRaises(FastTarError, fast.getmembers)
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -7,18 +7,22 @@ import json
 from glob import glob
 import subprocess
 import hashlib
+import tempfile
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 
 import unittest
-import mock
 import time
 
-import test
-
 from apm.classes.system import jprint
 from apm.classes.system import get_shell
 from apm.classes.system import dir_pattern
-from apm.classes.reproc_db import ReprocDB
+from apm.classes.ledger import FileLedger
+from apm.classes.record import FileRecord
+from apm.classes.hashcache import HashCache
+from apm.classes import digest
+from apm.classes.dirtree import DirTree
 
 # TODO FOR DEBUGGING DURRING DEVELOPMENT
 from inspect import currentframe, getframeinfo, getouterframes
@@ -26,6 +30,7 @@ from inspect import currentframe, getframeinfo, getouterframes
 # print("\n\t*** outerframes ***\n{}\n".format(getouterframes(currentframe(), context=2)))
 
 REPROC_HOME = os.environ.get('REPROC_HOME')
+HASH_BLOCKSIZE = 1048576
 
 class Files:
     """ Work with Files """
@@ -43,19 +48,30 @@ class Files:
             "db_up": True,
             "demo": None,
             "devel": False,
+            "digest": "sha256",
             "duplicates": False,
             "end": 0,
             "exit": False,
+            "extract_workers": 1,
             "facility": None,
+            "full_scan": False,
+            "hash_workers": 4,
             "iflags": None,
             "ingest": True,
+            "ingest_workers": None,
             "instrument": None,
             "interactive": False,
+            "io_limit": None,
             "job": None,
+            "ledger": "json",
+            "materialize": "auto",
+            "member_padding": None,
             "quiet": False,
             "site": None,
             "source": None,
             "stage": None,
+            "stage_mode": "copy",
+            "stage_workers": 1,
             "vap": False,
             "cleanup_status": {
                 "review": {
@@ -89,6 +105,9 @@ class Files:
         return production_config, development_config
 
     def db_load_config(self):
+        # Only auto reads the DQR, so armlib is not imported by the other commands
+        from apm.classes.reproc_db import ReprocDB
+
         production_config, development_config = self.load_db_config()
 
         reproc_db = ReprocDB(production_config, self.config['job'])
@@ -214,6 +233,7 @@ class Files:
             'interactive',
             'quiet',
             'demo',
+            'full_scan',
         ]
 
         for i in default:
@@ -370,60 +390,237 @@ class Files:
         divider = ' '
         create_env(ext, divider, command)
 
+    def get_store(self):
+        """ Open the sqlite file ledger of the job """
+        if getattr(self, 'store', None) == None:
+            from apm.classes.jobstore import JobStore
+            filename = '{}.db'.format(self.config['job'])
+            path = dir_pattern().format(self.config['stage'], self.config['job'])
+            self.store = JobStore.open(dir_pattern().format(path, filename))
+
+        return self.store
+
     def save_filenames(self):
-        """ Save list of filenames to json file """
+        """ Save list of filenames to json file or the sqlite ledger """
+        if self.config['ledger'] == 'sqlite':
+            self.get_store().save(self.files)
+            return
+
         filename = '{}.json'.format(self.config['job'])
         path = dir_pattern().format(self.config['stage'], self.config['job'])
-        fp = open(dir_pattern().format(path, filename), 'w')
-        fp.write(json.dumps(self.files, indent=4, sort_keys=True, separators=(',', ': ')))
+        json_file = dir_pattern().format(path, filename)
+
+        # Write to a temp file first so a crash can not leave a partial ledger
+        fp = open('{}.tmp'.format(json_file), 'w')
+        fp.write(json.dumps(self.files, indent=4, sort_keys=True, separators=(',', ': '), default=FileRecord.default))
         fp.close()
+        os.replace('{}.tmp'.format(json_file), json_file)
         return
 
     def load_filenames(self):
-        """ Load list of filenames from json file """
+        """ Load list of filenames from json file or the sqlite ledger """
         filename = '{}.json'.format(self.config['job'])
         path = dir_pattern().format(self.config['stage'], self.config['job'])
+        json_file = dir_pattern().format(path, filename)
+
+        if self.config['ledger'] == 'sqlite':
+            db_file = dir_pattern().format(path, '{}.db'.format(self.config['job']))
+            if not os.path.exists(db_file) and os.path.exists(json_file):
+                # Existing job, move its ledger into the database
+                return self.import_filenames()
+
+            if not os.path.exists(db_file):
+                return None
+
+            self.files = self.get_store().load()
+            return self.files
+
         try:
-            fp = open(dir_pattern().format(path, filename), 'r')
-            self.files = json.loads(fp.read())
+            fp = open(json_file, 'r')
+            self.files = FileLedger(json.loads(fp.read()))
             fp.close()
             return self.files
         except:
             return None
 
-    def get_hash(self, file_name):
+    def import_filenames(self):
+        """ Replace the sqlite ledger with <job>.json """
+        filename = '{}.json'.format(self.config['job'])
+        path = dir_pattern().format(self.config['stage'], self.config['job'])
+        self.files = self.get_store().import_json(dir_pattern().format(path, filename))
+        return self.files
+
+    def export_filenames(self):
+        """ Write the sqlite ledger to <job>.json """
+        filename = '{}.json'.format(self.config['job'])
+        path = dir_pattern().format(self.config['stage'], self.config['job'])
+        self.files = self.get_store().export_json(dir_pattern().format(path, filename))
+        return self.files
+
+    def get_hash_cache(self):
+        """ Return the digest cache of the job, None if there is no job directory """
+        if self.config.get('stage') == None or self.config.get('job') == None:
+            return None
+
+        path = dir_pattern().format(self.config['stage'], self.config['job'])
+        if not os.path.isdir(path):
+            return None
+
+        return HashCache.open(dir_pattern().format(path, '{}.hashes.json'.format(self.config['job'])))
+
+    def get_tree(self, folder):
+        """ Return the shared listings of a directory in the job, like `collection` or `datastream` """
+        return DirTree.open(dir_pattern(3).format(self.config['stage'], self.config['job'], folder))
+
+    def get_watched_tree(self, folder):
+        """ Return the listings of a directory in the job kept by `apm watch`, None if it is not watched """
+        from apm.classes import watcher
+        return watcher.open_tree(dir_pattern().format(self.config['stage'], self.config['job']), folder)
+
+    def get_tracked_state(self):
+        """ Return the state of the collection when the tracked files were last checked """
+        from apm.classes.trackedstate import TrackedState
+        path = dir_pattern().format(self.config['stage'], self.config['job'])
+        collection = dir_pattern().format(path, 'collection')
+        return TrackedState(collection, dir_pattern().format(path, '{}.tracked.json'.format(self.config['job'])))
+
+    def get_trash(self):
+        """ Return the trash of the job, directories are moved into it to be deleted in the background """
+        from apm.classes.trash import Trash
+        path = dir_pattern().format(self.config['stage'], self.config['job'])
+        return Trash(dir_pattern().format(path, '.trash'))
+
+    def save_hashes(self):
+        """ Save the digest cache of the job and print how much it saved """
+        cache = self.get_hash_cache()
+        if cache == None:
+            return
+
+        if cache.hits + cache.misses > 0 and not self.config.get('quiet'):
+            print(cache.summary())
+
+        cache.save()
+
+    def update_snapshot(self, tree, select=None):
+        """
+            Update the snapshot of <job>/<tree>, only hashing the files whose stat changed
+            select(relpath) limits the files that are hashed, see TreeSnapshot.update
+            Return (snapshot, changes since the last snapshot) or (None, None) if the tree does not exist
+        """
+        path = dir_pattern().format(self.config['stage'], self.config['job'])
+        root = dir_pattern().format(path, tree)
+        if not os.path.isdir(root):
+            return None, None
+
+        from apm.classes.snapshot import TreeSnapshot
+        saved = dir_pattern().format(path, '{}.snapshot.json'.format(tree))
+        old = TreeSnapshot.load(saved, root, self.config.get('digest') or 'sha256')
+        new = old.update(self.get_hashes, select)
+        new.save(saved)
+
+        return new, old.diff(new)
+
+    def get_hash(self, file_name, algorithm=None):
+        """ Return the digest of a file, by default with the digest set for the job """
+        if algorithm == None:
+            algorithm = self.config.get('digest') or 'sha256'
+
         if not os.path.exists(file_name):
             return None
 
-        blocksize = 65536
-        hasher = hashlib.sha256()
-        afile = open(file_name, 'rb')
-        buf = afile.read(blocksize)
-        while (len(buf) > 0):
-            hasher.update(buf)
-            buf = afile.read(blocksize)
+        afile = open(file_name, 'rb', buffering=0)
+        stat = os.fstat(afile.fileno())
+        cache = self.get_hash_cache()
+
+        if cache != None:
+            result = cache.get(stat, algorithm)
+            if result != None:
+                afile.close()
+                return result
+
+        # Read into one large buffer, hashlib releases the GIL while it hashes
+        hasher = digest.new(algorithm)
+        buf = bytearray(HASH_BLOCKSIZE)
+        view = memoryview(buf)
+        count = afile.readinto(buf)
+        while count > 0:
+            hasher.update(view[:count])
+            count = afile.readinto(buf)
+
+        result = hasher.digest()
+
+        # Only cache the digest if the file did not change while it was read
+        if cache != None and HashCache.get_key(os.fstat(afile.fileno())) == HashCache.get_key(stat):
+            cache.put(stat, result, algorithm)
         afile.close()
 
-        return hasher.digest()
+        return result
+
+    def get_hash_workers(self, workers=None):
+        if workers == None:
+            workers = self.config.get('hash_workers')
+
+        return max(1, int(workers or 1))
+
+    def get_hashes(self, paths, workers=None):
+        """ Hash files concurrently, yield (path, digest) as each one finishes """
+        with ThreadPoolExecutor(max_workers=self.get_hash_workers(workers)) as pool:
+            jobs = {pool.submit(self.get_hash, path): path for path in set(paths)}
+            for job in as_completed(jobs):
+                yield jobs[job], job.result()
+
+    def compare_files(self, pairs, workers=None):
+        """
+            Compare (file_1, file_2, record) tuples concurrently and yield
+            (file_1, file_2, same) as each one finishes. file_1 is checked
+            against the digest in record when it has one, record may be None
+        """
+        with ThreadPoolExecutor(max_workers=self.get_hash_workers(workers)) as pool:
+            jobs = {}
+            for pair in pairs:
+                file_1, file_2, record = pair if len(pair) == 3 else (pair[0], pair[1], None)
+                jobs[pool.submit(self.compare_file, file_1, file_2, record)] = (file_1, file_2)
+
+            for job in as_completed(jobs):
+                file_1, file_2 = jobs[job]
+                yield file_1, file_2, job.result()
+
+    def compare_file(self, file_1, file_2, record=None):
+        same = None
+        if record != None:
+            same = self.matches_record(file_1, record)
+        if same == None:
+            same = self.is_same_file(file_1, file_2)
+
+        return same
 
     def is_same_file(self, file_1, file_2):
         return self.get_hash(file_1) == self.get_hash(file_2)
 
+    def matches_record(self, file_name, record):
+        """
+            Compare a file with the digest recorded when it was unpacked
+            Return None if the record does not have a digest
+        """
+        if record.get('digest') == None or record.get('digest_type') not in digest.ALGORITHMS:
+            return None
+
+        if not os.path.exists(file_name):
+            return False
+
+        if record.get('size') != None and os.path.getsize(file_name) != record['size']:
+            return False
+
+        return self.get_hash(file_name, record['digest_type']).hex() == record['digest']
+
     def empty_dir(self, folder):
         """ Delete all files and folders in the specified directory """
+        from apm.classes.trash import delete_tree
         folder = self.clean_path(folder)
-        filelist = os.listdir(folder)
-        if len(filelist) > 0:
-            for i in filelist:
-                f = dir_pattern().format(folder, i)
-
-                if os.path.isfile(f) or os.path.islink(f):
-                    os.remove(f)
-                elif os.path.isdir(f):
-                    self.empty_dir(f)
-                    os.rmdir(f)
-                else:
-                    exit("Unable to delete {}. Please manually remove this file and try again.".format(f))
+        try:
+            delete_tree(folder, keep_root=True)
+        except OSError as e:
+            exit("Unable to delete {}. Please manually remove this file and try again.".format(e.filename))
 
 
     def setup_job_dir(self):
@@ -512,13 +709,13 @@ class Files:
         return
 
     def rename_files(self, location, files):
-        """ Strip the ARM prefix from a list of files """
-        cwd = os.getcwd()
-        os.chdir(location)
-        for i in files:
-            self.rename_file(i)
+        """ Strip the ARM prefix from a list of files, nothing is renamed if any of them conflict """
+        from apm.classes.renamer import RenamePlan
+        plan = RenamePlan(location).plan(self.strip_name, files)
+        if len(plan.conflicts) > 0:
+            exit("{}\n Please fix these conflicts and try again.".format('\n'.join(plan.conflicts)))
 
-        os.chdir(cwd)
+        plan.apply()
         return
 
     def is_dir_writable(self, folder, verbose=False):
@@ -549,6 +746,10 @@ class Files:
         if self.files == None or uuid == None:
             return
 
+        if isinstance(self.files, FileLedger):
+            location = self.files.find_uuid(uuid)
+            return None if location == None else location[2]
+
         for i in self.files:
             for j in self.files[i]:
                 for k,v in self.files[i][j].items():
@@ -585,6 +786,10 @@ class Files:
         if self.files == None or name == None or key == None:
             return
 
+        if isinstance(self.files, FileLedger):
+            location = self.files.find_name(name)
+            return None if location == None else self.files[location[0]][location[1]][name][key]
+
         for i in self.files:
             for j in self.files[i]:
                 if name in self.files[i][j]:
@@ -597,6 +802,12 @@ class Files:
 ################################################################################
 # Unit tests
 ################################################################################
+def setUpModule():
+    """ Only the tests need mock and the test config """
+    global mock, test
+    import mock
+    import test
+
 class TestFiles(unittest.TestCase):
     """ Test the Files Class """
     def setUp(self):
@@ -1155,6 +1366,111 @@ class TestIsSameFile(unittest.TestCase):
         assert result == expected
 
 
+################################################################################
+# Matches Record
+################################################################################
+class TestMatchesRecord(unittest.TestCase):
+    def setUp(self):
+        self.config = test.config()
+        self.file = Files(self.config)
+        self.home = tempfile.mkdtemp()
+        self.testhello = '{}/hello.txt'.format(self.home)
+
+        fp = open(self.testhello, 'w')
+        fp.write("hello, World!")
+        fp.close()
+
+        self.record = {
+            "digest": hashlib.sha256(b"hello, World!").hexdigest(),
+            "digest_type": "sha256",
+            "size": 13,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def test_1(self):
+        """ pass file matching its record """
+        result = self.file.matches_record(self.testhello, self.record)
+        expected = True
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ pass changed file """
+        fp = open(self.testhello, 'w')
+        fp.write("hello, world!")
+        fp.close()
+
+        result = self.file.matches_record(self.testhello, self.record)
+        expected = False
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ pass record without a digest """
+        result = self.file.matches_record(self.testhello, {"digest": None})
+        expected = None
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_4(self):
+        """ pass blake2b record """
+        record = {
+            "digest": hashlib.blake2b(b"hello, World!", digest_size=32).hexdigest(),
+            "digest_type": "blake2b",
+            "size": 13,
+        }
+        result = self.file.matches_record(self.testhello, record)
+        expected = True
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+
+################################################################################
+# Get Hashes / Compare Files
+################################################################################
+class TestCompareFiles(unittest.TestCase):
+    def setUp(self):
+        self.config = test.config()
+        self.file = Files(self.config)
+        self.home = tempfile.mkdtemp()
+        self.data = {}
+        for i in range(4):
+            name = '{}/file{}.txt'.format(self.home, i)
+            self.data[name] = "hello, World!" if i < 3 else "testing"
+            fp = open(name, 'w')
+            fp.write(self.data[name])
+            fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def test_1(self):
+        """ pass a list of files -> digest of each file """
+        result = dict(self.file.get_hashes(list(self.data), workers=3))
+        expected = {k: hashlib.sha256(v.encode()).digest() for k,v in self.data.items()}
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ pass pairs with and without records -> same for identical files """
+        names = sorted(self.data)
+        record = {"digest": hashlib.sha256(b"hello, World!").hexdigest(), "digest_type": "sha256", "size": 13}
+        pairs = [(names[0], names[1]), (names[0], names[3]), (names[2], names[3], record), (names[3], names[0], record)]
+
+        result = sorted(self.file.compare_files(pairs, workers=2))
+        expected = sorted([(names[0], names[1], True), (names[0], names[3], False), (names[2], names[3], True), (names[3], names[0], False)])
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+
 ################################################################################
 # Test Empty Dir Methods
 ################################################################################
@@ -1598,6 +1914,39 @@ class TestIsDirWritable(unittest.TestCase):
         print("Result:   {}\nExpected: {}".format(result, expected))
         assert result == expected
 
+################################################################################
+# Sqlite Ledger
+################################################################################
+class TestSqliteLedger(unittest.TestCase):
+    def setUp(self):
+        self.config = test.config()
+        self.config['stage'] = tempfile.mkdtemp()
+        self.config['job'] = 'test'
+        self.config['ledger'] = 'sqlite'
+        os.mkdir('{}/test'.format(self.config['stage']))
+
+        self.files = FileLedger({'sgp': {'sgpmfrsrC1.00': {
+            'sgpmfrsrC1.00.20140501.000000.raw.a.dat': {'uuid': '1', 'current_name': 'sgpmfrsrC1.00.20140501.000000.raw.a.dat'},
+            'b.dat': {'uuid': '2', 'current_name': 'b.dat'},
+        }}})
+
+    def tearDown(self):
+        Files(self.config).get_store().close()
+        shutil.rmtree(self.config['stage'])
+
+    def test_1(self):
+        """ Save, rename a file and save through another Files object -> only the new name is stored """
+        from apm.classes.jobstore import JobStore
+        Files(self.config, self.files).save_filenames()
+        self.files.rename('sgp', 'sgpmfrsrC1.00', 'sgpmfrsrC1.00.20140501.000000.raw.a.dat', 'a.dat')
+        Files(self.config, self.files).save_filenames()
+
+        result = sorted(JobStore('{}/test/test.db'.format(self.config['stage'])).load()['sgp']['sgpmfrsrC1.00'])
+        expected = ['a.dat', 'b.dat']
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
 ################################################################################
 # Get Shell
 ################################################################################
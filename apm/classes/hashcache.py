@@ -0,0 +1,169 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import unittest
+import tempfile
+import shutil
+
+MAX_ENTRIES = 262144
+
+# One cache per file so every Files object of a job shares it
+CACHES = {}
+CACHES_LOCK = threading.Lock()
+
+class HashCache:
+    """
+        Digests of files keyed by (device, inode, size, mtime_ns, algorithm)
+        A file that is changed gets a new mtime so its old digest is never used
+        The least recently used digests are dropped past max_entries
+    """
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.dirty = False
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        if path != None and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def open(path):
+        """ Return the shared cache saved at path """
+        with CACHES_LOCK:
+            if path not in CACHES:
+                CACHES[path] = HashCache(path)
+
+            return CACHES[path]
+
+    @staticmethod
+    def get_key(stat, algorithm='sha256'):
+        return '{}:{}:{}:{}:{}'.format(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, algorithm)
+
+    def get(self, stat, algorithm='sha256'):
+        """ Return the cached digest for a file stat, None on a miss """
+        key = self.get_key(stat, algorithm)
+        with self.lock:
+            digest = self.entries.get(key)
+            if digest == None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += stat.st_size
+            return digest
+
+    def put(self, stat, digest, algorithm='sha256'):
+        key = self.get_key(stat, algorithm)
+        with self.lock:
+            self.entries[key] = digest
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def load(self):
+        try:
+            fp = open(self.path, 'r')
+            entries = json.loads(fp.read())
+            fp.close()
+        except (OSError, ValueError):
+            return
+
+        for key, digest in entries.items():
+            self.entries[key] = bytes.fromhex(digest)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        """ Write the cache, oldest entries first """
+        if self.path == None or not self.dirty:
+            return
+
+        with self.lock:
+            entries = OrderedDict((k, v.hex()) for k, v in self.entries.items())
+            self.dirty = False
+
+        temp = '{}.tmp'.format(self.path)
+        fp = open(temp, 'w')
+        fp.write(json.dumps(entries))
+        fp.close()
+        os.replace(temp, self.path)
+
+    def summary(self):
+        return 'Hash cache: {} hits, {} misses, {:.1f} MB not read'.format(self.hits, self.misses, self.bytes_saved / 1048576.0)
+
+################################################################################
+# Unit tests
+################################################################################
+class TestHashCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.file = '{}/hello.txt'.format(self.path)
+        fp = open(self.file, 'w')
+        fp.write('hello, World!')
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ Look up a file before and after it is changed -> miss, hit, miss """
+        cache = HashCache()
+        result = [cache.get(os.stat(self.file))]
+        cache.put(os.stat(self.file), b'\x01')
+        result.append(cache.get(os.stat(self.file)))
+        os.utime(self.file, ns=(0, 0))
+        result.append(cache.get(os.stat(self.file)))
+        expected = [None, b'\x01', None]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert (cache.hits, cache.misses, cache.bytes_saved) == (1, 2, 13)
+
+    def test_2(self):
+        """ Add more entries than max_entries -> least recently used is dropped """
+        cache = HashCache(max_entries=2)
+        stats = []
+        for i in range(3):
+            os.utime(self.file, ns=(i, i))
+            stats.append(os.stat(self.file))
+
+        cache.put(stats[0], b'\x00')
+        cache.put(stats[1], b'\x01')
+        cache.get(stats[0])
+        cache.put(stats[2], b'\x02')
+
+        result = [cache.get(i) for i in stats]
+        expected = [b'\x00', None, b'\x02']
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ Save and load a cache -> same digests """
+        path = '{}/hashes.json'.format(self.path)
+        cache = HashCache(path)
+        cache.put(os.stat(self.file), b'\xab\xcd')
+        cache.save()
+
+        result = HashCache(path).get(os.stat(self.file))
+        expected = b'\xab\xcd'
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
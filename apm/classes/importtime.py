@@ -0,0 +1,97 @@
+#!/apps/base/python3/bin/python3
+
+import sys
+import time
+import builtins
+from importlib.util import resolve_name
+
+import unittest
+
+class ImportTimer:
+    """
+        Time every module imported while installed, like `python -X importtime`
+        The self time of a module leaves out the modules it imports
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.times = {}
+        self.stack = []
+        self.original = None
+
+    def install(self):
+        self.original = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def uninstall(self):
+        if self.original != None:
+            builtins.__import__ = self.original
+            self.original = None
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        try:
+            package = globals.get('__package__') if globals != None else None
+            module = resolve_name('.' * level + name, package) if level > 0 else name
+        except (ImportError, ValueError):
+            module = name
+
+        # Modules that are already loaded cost nothing, but their fromlist may import submodules
+        if module in sys.modules:
+            return self.original(name, globals, locals, fromlist, level)
+
+        self.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.stack.pop()
+            if len(self.stack) > 0:
+                self.stack[-1] += elapsed
+
+            if module in sys.modules:
+                self.times[module] = (elapsed - children, elapsed)
+
+    def report(self, title='', limit=25):
+        """ Return the slowest imports by self time and the time since the timer was created """
+        lines = ['Import time{}: {:.1f} ms in {} modules, {:.1f} ms since start'.format(
+            ' of {}'.format(title) if title else '',
+            sum(i[0] for i in self.times.values()) * 1000,
+            len(self.times),
+            (time.perf_counter() - self.start) * 1000,
+        )]
+        lines.append('{:>10} {:>10}  {}'.format('self ms', 'total ms', 'module'))
+
+        ranked = sorted(self.times.items(), key=lambda i: i[1][0], reverse=True)
+        for module, (own, total) in ranked[:limit]:
+            lines.append('{:10.1f} {:10.1f}  {}'.format(own * 1000, total * 1000, module))
+
+        return '\n'.join(lines)
+
+################################################################################
+# Unit tests
+################################################################################
+class TestImportTimer(unittest.TestCase):
+    def test_1(self):
+        """ Import new modules while installed -> only the new modules are timed """
+        for i in ['xml.dom.minidom', 'xml.dom']:
+            sys.modules.pop(i, None)
+
+        timer = ImportTimer()
+        timer.install()
+        try:
+            import builtins
+            import xml.dom.minidom
+        finally:
+            timer.uninstall()
+
+        result = ['builtins' in timer.times, 'xml.dom.minidom' in timer.times, builtins.__import__ != timer.timed_import]
+        expected = [False, True, True]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert timer.report('test').splitlines()[2].split()[2] in timer.times
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,288 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import json
+import sqlite3
+import threading
+
+import unittest
+import tempfile
+import shutil
+
+from apm.classes.ledger import FileLedger
+from apm.classes.record import FileRecord
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS files (
+        site TEXT NOT NULL,
+        process TEXT NOT NULL,
+        name TEXT NOT NULL,
+        uuid TEXT,
+        record TEXT NOT NULL,
+        PRIMARY KEY (site, process, name)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS files_uuid ON files (uuid)",
+    "CREATE INDEX IF NOT EXISTS files_name ON files (name)",
+]
+
+# One store per database so every Files object of a job shares it
+STORES = {}
+STORES_LOCK = threading.Lock()
+
+class JobStore:
+    """
+        SQLite file ledger for a job, only the records that changed are written on save
+        A FileLedger tracks the records it changed, only those are encoded
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            for i in SCHEMA:
+                self.conn.execute(i)
+
+        # Serialized records as they are in the database
+        self.saved = {}
+
+        # Keys in the database, read again when another connection changes it
+        self.keys = None
+        self.version = None
+
+    @staticmethod
+    def open(path):
+        """ Return the shared store of the database at path """
+        path = os.path.abspath(path)
+        with STORES_LOCK:
+            if path not in STORES:
+                STORES[path] = JobStore(path)
+
+            return STORES[path]
+
+    def close(self):
+        with STORES_LOCK:
+            if STORES.get(os.path.abspath(self.path)) is self:
+                del STORES[os.path.abspath(self.path)]
+
+        self.conn.close()
+
+    def get_keys(self):
+        """ Return the (site, process, name) of every row """
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if self.keys == None or version != self.version:
+            self.keys = set(self.conn.execute('SELECT site, process, name FROM files'))
+            self.version = version
+
+        return self.keys
+
+    def encode(self, record):
+        return json.dumps(record, sort_keys=True, separators=(',', ':'), default=FileRecord.default)
+
+    def load(self):
+        """ Return the ledger stored in the database """
+        files = {}
+        self.saved = {}
+        for site, process, name, record in self.conn.execute('SELECT site, process, name, record FROM files'):
+            if site not in files:
+                files[site] = {}
+            if process not in files[site]:
+                files[site][process] = {}
+
+            files[site][process][name] = json.loads(record)
+            self.saved[(site, process, name)] = record
+
+        self.keys = set(self.saved)
+        self.version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+        files = FileLedger(files)
+        files.changed = set()
+        return files
+
+    def save(self, files):
+        """ Write the records that were added or changed and delete the ones that are gone, in one transaction """
+        if files == None:
+            files = {}
+
+        # Changes made while saving go to a new set, they are saved next time
+        changed = getattr(files, 'changed', None)
+        if isinstance(files, FileLedger):
+            files.changed = set()
+
+        try:
+            written, removed = self.write(files, changed)
+        except BaseException:
+            if changed != None:
+                files.changed.update(changed)
+            raise
+
+        return len(written), len(removed)
+
+    def write(self, files, changed):
+        """ Write the records at the changed locations, or compare every record when changed is None """
+        with self.lock, self.conn:
+            keys = self.get_keys()
+
+            # Without the changes of a FileLedger every record is compared
+            if changed == None:
+                locations = set(keys)
+                for site in files:
+                    for process in files[site]:
+                        for name in files[site][process]:
+                            locations.add((site, process, name))
+            else:
+                locations = changed
+
+            written = []
+            removed = []
+            for k in locations:
+                record = files.get(k[0], {}).get(k[1], {}).get(k[2])
+                if record == None:
+                    if k in keys:
+                        removed.append(k)
+                    continue
+
+                encoded = self.encode(record)
+                if k not in keys or self.saved.get(k) != encoded:
+                    written.append((k, record.get('uuid'), encoded))
+
+            self.conn.executemany('DELETE FROM files WHERE site = ? AND process = ? AND name = ?', removed)
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO files (site, process, name, uuid, record) VALUES (?, ?, ?, ?, ?)',
+                [k + (uuid, encoded) for k, uuid, encoded in written]
+            )
+
+            for k in removed:
+                self.saved.pop(k, None)
+                keys.discard(k)
+            for k, uuid, encoded in written:
+                self.saved[k] = encoded
+                keys.add(k)
+
+        return written, removed
+
+    def find(self, site=None, process=None, name=None, uuid=None):
+        """ Return [(site, process, name, record)] of the records matching all of the given values """
+        where = []
+        values = []
+        for column, value in [('site', site), ('process', process), ('name', name), ('uuid', uuid)]:
+            if value != None:
+                where.append('{} = ?'.format(column))
+                values.append(value)
+
+        query = 'SELECT site, process, name, record FROM files'
+        if len(where) > 0:
+            query += ' WHERE ' + ' AND '.join(where)
+
+        return [(s, p, n, json.loads(r)) for s, p, n, r in self.conn.execute(query + ' ORDER BY site, process, name', values)]
+
+    def import_json(self, json_file):
+        """ Replace the stored ledger with the one in a json file """
+        fp = open(json_file, 'r')
+        files = json.loads(fp.read())
+        fp.close()
+
+        self.load()
+        self.save(files)
+        return FileLedger(files)
+
+    def export_json(self, json_file):
+        """ Write the stored ledger to a json file """
+        files = self.load()
+        temp = '{}.tmp'.format(json_file)
+        fp = open(temp, 'w')
+        fp.write(json.dumps(files, indent=4, sort_keys=True, separators=(',', ': '), default=FileRecord.default))
+        fp.close()
+        os.replace(temp, json_file)
+        return files
+
+################################################################################
+# Unit tests
+################################################################################
+class TestJobStore(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = JobStore('{}/test.db'.format(self.path))
+        self.files = {
+            'sgp': {
+                'sgpmfrsrC1.00': {
+                    'a.dat': {'uuid': '1', 'current_name': 'a.dat', 'deleted': False},
+                    'b.dat': {'uuid': '2', 'current_name': 'b.dat', 'deleted': False},
+                },
+            },
+        }
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ Save then load -> same ledger """
+        self.store.save(self.files)
+        result = JobStore('{}/test.db'.format(self.path)).load()
+        expected = self.files
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Save after changing one record and removing another -> only those rows are written """
+        self.store.save(self.files)
+        self.files['sgp']['sgpmfrsrC1.00']['a.dat']['deleted'] = True
+        self.files['sgp']['sgpmfrsrC1.00'].pop('b.dat')
+        result = self.store.save(self.files)
+        expected = (1, 1)
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert self.store.find(uuid='1')[0][3]['deleted'] == True
+        assert self.store.find(name='b.dat') == []
+
+    def test_3(self):
+        """ Export then import json -> same ledger """
+        self.store.save(self.files)
+        json_file = '{}/test.json'.format(self.path)
+        self.store.export_json(json_file)
+
+        store = JobStore('{}/other.db'.format(self.path))
+        result = store.import_json(json_file)
+        store.close()
+        expected = self.files
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_4(self):
+        """ Save a renamed record through a second store of the same database -> the old row is deleted """
+        self.store.save(self.files)
+        records = self.files['sgp']['sgpmfrsrC1.00']
+        records['c.dat'] = records.pop('a.dat')
+
+        store = JobStore('{}/test.db'.format(self.path))
+        result = [store.save(self.files), sorted(i[2] for i in self.store.find())]
+        store.close()
+        expected = [(2, 1), ['b.dat', 'c.dat']]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_5(self):
+        """ Save a ledger loaded from the store after changing one record -> only that record is encoded """
+        self.store.save(self.files)
+        files = self.store.load()
+        files.set_value('sgp', 'sgpmfrsrC1.00', 'a.dat', 'deleted', True)
+
+        encoded = []
+        encode = self.store.encode
+        self.store.encode = lambda record: encoded.append(record['current_name']) or encode(record)
+        result = [self.store.save(files), encoded, files.changed, self.store.find(uuid='1')[0][3]['deleted']]
+        expected = [(1, 0), ['a.dat'], set(), True]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
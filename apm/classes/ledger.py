@@ -0,0 +1,250 @@
+#!/apps/base/python3/bin/python3
+
+import sys
+
+import unittest
+
+from apm.classes.record import FileRecord
+from apm.classes.record import pack_uuid
+
+# Index values are a single location, or a list once a second one is added
+
+def put_location(index, key, location):
+    current = index.get(key)
+    if current == None:
+        index[key] = location
+    elif type(current) == tuple:
+        index[key] = [current, location]
+    else:
+        current.append(location)
+
+def drop_location(index, key, location):
+    current = index.get(key)
+    if current == location:
+        index.pop(key)
+    elif type(current) == list and location in current:
+        current.remove(location)
+        if len(current) == 1:
+            index[key] = current[0]
+
+def get_locations(index, key):
+    current = index.get(key)
+    if current == None:
+        return []
+    if type(current) == tuple:
+        return [current]
+
+    return list(current)
+
+class FileLedger(dict):
+    """
+        The tracked files of a job, {site: {process: {name: record}}}
+        Records are kept as FileRecords and indexed by uuid, current name and
+        the name keys in INDEXED
+        Changes must go through add, remove, drop, rename and set_value to
+        keep the indexes up to date, call reindex after changing the dicts
+        directly
+        changed holds the locations written since the ledger was last saved
+        to a JobStore, None when it is not known so every record is compared
+    """
+
+    INDEXED = ['original_name', 'stripped_name', 'processed_name']
+
+    def __init__(self, files=None):
+        dict.__init__(self, files if files != None else {})
+        self.reindex()
+
+    @staticmethod
+    def wrap(files):
+        """ Return files as a FileLedger, None stays None """
+        if files == None or isinstance(files, FileLedger):
+            return files
+
+        return FileLedger(files)
+
+    def reindex(self):
+        """ Rebuild all of the indexes """
+        self.changed = None
+        self.by_uuid = {}
+        self.by_name = {}
+        self.by_key = {}
+        for key in self.INDEXED:
+            self.by_key[key] = {}
+
+        for site in self:
+            for process in self[site]:
+                records = self[site][process]
+                for name, record in records.items():
+                    if not isinstance(record, FileRecord):
+                        record = FileRecord(record)
+                        record.share(name)
+                        records[name] = record
+                    self.index(site, process, name, record)
+
+    def index(self, site, process, name, record):
+        # One location tuple per record is shared by all of the indexes
+        location = (site, process, name)
+        if self.changed != None:
+            self.changed.add(location)
+
+        if record.raw('uuid') != None:
+            self.by_uuid[record.raw('uuid')] = location
+
+        put_location(self.by_name, name, location)
+
+        for key in self.INDEXED:
+            if record.raw(key) != None:
+                put_location(self.by_key[key], record.raw(key), location)
+
+    def unindex(self, site, process, name, record):
+        location = (site, process, name)
+        if self.changed != None:
+            self.changed.add(location)
+        if self.by_uuid.get(record.raw('uuid')) == location:
+            self.by_uuid.pop(record.raw('uuid'))
+
+        drop_location(self.by_name, name, location)
+
+        for key in self.INDEXED:
+            if record.raw(key) != None:
+                drop_location(self.by_key[key], record.raw(key), location)
+
+    def add(self, site, process, name, record):
+        """ Track a file """
+        record = FileRecord.wrap(record)
+        if site not in self:
+            self[sys.intern(site)] = {}
+
+        if process not in self[site]:
+            self[site][sys.intern(process)] = {}
+
+        if name in self[site][process]:
+            self.unindex(site, process, name, self[site][process][name])
+
+        record.share(name)
+        self[site][process][name] = record
+        self.index(site, process, name, record)
+
+    def remove(self, site, process, name):
+        """ Stop tracking a file and return its record """
+        record = self[site][process].pop(name)
+        self.unindex(site, process, name, record)
+        return record
+
+    def drop(self, site, process=None):
+        """ Stop tracking every file of a site, or of one process of a site """
+        processes = [process] if process != None else list(self[site])
+        for i in processes:
+            for name in list(self[site][i]):
+                self.remove(site, i, name)
+            self[site].pop(i)
+
+        if process == None:
+            self.pop(site)
+
+    def rename(self, site, process, name, new_name):
+        """ Move a record to a new name and set its current_name """
+        record = self.remove(site, process, name)
+        record['current_name'] = new_name
+        self.add(site, process, new_name, record)
+        return record
+
+    def set_value(self, site, process, name, key, value):
+        """ Change one value of a record """
+        record = self[site][process][name]
+        self.unindex(site, process, name, record)
+        record[key] = value
+        self.index(site, process, name, record)
+
+    def find_uuid(self, uuid):
+        """ Return (site, process, name) of the file with the uuid """
+        return self.by_uuid.get(pack_uuid(uuid))
+
+    def find_name(self, name):
+        """ Return (site, process) of the first file tracked by this name """
+        locations = get_locations(self.by_name, name)
+        if len(locations) == 0:
+            return
+
+        return locations[0][:2]
+
+    def find(self, key, value):
+        """ Return the (site, process, name) of the files with record[key] == value """
+        if key == 'uuid':
+            location = self.find_uuid(value)
+            return [] if location == None else [location]
+
+        if key == 'current_name':
+            return get_locations(self.by_name, value)
+
+        return sorted(get_locations(self.by_key[key], value))
+
+################################################################################
+# Unit tests
+################################################################################
+class TestFileLedger(unittest.TestCase):
+    def setUp(self):
+        self.files = FileLedger({
+            'sgp': {
+                'sgpmfrsrC1.00': {
+                    'a.dat': {'uuid': '1', 'current_name': 'a.dat', 'original_name': 'x.a.dat', 'stripped_name': None, 'processed_name': None},
+                    'b.dat': {'uuid': '2', 'current_name': 'b.dat', 'original_name': 'x.b.dat', 'stripped_name': None, 'processed_name': None},
+                },
+            },
+        })
+
+    def test_1(self):
+        """ Find by uuid and name -> location of the record """
+        result = [self.files.find_uuid('2'), self.files.find_name('a.dat'), self.files.find('original_name', 'x.b.dat')]
+        expected = [('sgp', 'sgpmfrsrC1.00', 'b.dat'), ('sgp', 'sgpmfrsrC1.00'), [('sgp', 'sgpmfrsrC1.00', 'b.dat')]]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Rename and set values -> indexes follow the record """
+        self.files.rename('sgp', 'sgpmfrsrC1.00', 'a.dat', 'c.dat')
+        self.files.set_value('sgp', 'sgpmfrsrC1.00', 'c.dat', 'stripped_name', 'c.dat')
+
+        result = [self.files.find_uuid('1'), self.files.find_name('a.dat'), self.files.find('stripped_name', 'c.dat')]
+        expected = [('sgp', 'sgpmfrsrC1.00', 'c.dat'), None, [('sgp', 'sgpmfrsrC1.00', 'c.dat')]]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert self.files['sgp']['sgpmfrsrC1.00']['c.dat']['current_name'] == 'c.dat'
+
+    def test_3(self):
+        """ Remove a record -> no longer found """
+        self.files.remove('sgp', 'sgpmfrsrC1.00', 'b.dat')
+        result = [self.files.find_uuid('2'), self.files.find('original_name', 'x.b.dat')]
+        expected = [None, []]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_4(self):
+        """ Change records once the changes are tracked -> only their locations are changed """
+        self.files.changed = set()
+        self.files.set_value('sgp', 'sgpmfrsrC1.00', 'a.dat', 'deleted', True)
+        self.files.rename('sgp', 'sgpmfrsrC1.00', 'b.dat', 'c.dat')
+
+        result = sorted(i[2] for i in self.files.changed)
+        expected = ['a.dat', 'b.dat', 'c.dat']
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_5(self):
+        """ Drop a process -> its records are removed and marked changed """
+        self.files.changed = set()
+        self.files.drop('sgp', 'sgpmfrsrC1.00')
+
+        result = [self.files, self.files.find_uuid('1'), sorted(i[2] for i in self.files.changed)]
+        expected = [{'sgp': {}}, None, ['a.dat', 'b.dat']]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
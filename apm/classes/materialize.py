@@ -0,0 +1,232 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import errno
+import fcntl
+import shutil
+import tempfile
+
+import unittest
+
+from apm.classes.system import dir_pattern
+
+# ioctl request to share the data blocks of one file with another (linux/fs.h)
+FICLONE = 0x40049409
+
+MODES = ['auto', 'reflink', 'hardlink', 'copy']
+
+# Errors that mean the filesystem can not do what was asked
+UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOSYS, errno.EINVAL, errno.EPERM, errno.EACCES, errno.EMLINK)
+
+class Materializer:
+    """ Place a copy of a file using the cheapest method the filesystem supports """
+
+    def __init__(self, mode='auto', readonly=False):
+        """
+            mode is one of MODES
+            readonly allows hardlinks, only use it when neither the source
+            nor the destination will be changed in place, otherwise hardlink
+            places a reflink or a copy
+        """
+        if mode == None:
+            mode = 'auto'
+
+        if mode not in MODES:
+            raise ValueError('Unknown materialize mode: {}'.format(mode))
+
+        self.mode = mode
+        self.readonly = readonly
+
+        # Methods that failed for each (source device, destination device)
+        self.unsupported = {}
+
+        # Number of files placed by each method
+        self.count = {'hardlink': 0, 'reflink': 0, 'copy': 0}
+
+    def get_methods(self):
+        """ Return the methods to try in order """
+        if self.mode == 'auto':
+            if self.readonly:
+                return ['hardlink', 'reflink', 'copy']
+            return ['reflink', 'copy']
+
+        if self.mode == 'copy':
+            return ['copy']
+
+        # A link to a file that may be changed would change with it
+        if self.mode == 'hardlink' and not self.readonly:
+            return ['reflink', 'copy']
+
+        return [self.mode, 'copy']
+
+    def materialize(self, src, dst):
+        """
+            Place src at dst, return the method that was used
+            dst may be a directory like shutil.copy
+        """
+        if os.path.isdir(dst):
+            dst = dir_pattern().format(dst, os.path.basename(src))
+
+        devices = (os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+        failed = self.unsupported.setdefault(devices, set())
+
+        for method in self.get_methods():
+            if method in failed:
+                continue
+
+            if method == 'copy':
+                shutil.copy2(src, dst)
+            else:
+                try:
+                    method = getattr(self, method)(src, dst) or method
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED:
+                        raise e
+
+                    # Do not try this method again between these filesystems
+                    failed.add(method)
+                    continue
+
+            self.count[method] += 1
+            return method
+
+    def copy(self, src, dst):
+        """ Use as the copy_function of shutil.copytree """
+        self.materialize(src, dst)
+        return dst
+
+    def copytree(self, src, dst):
+        """ Materialize a directory tree """
+        return shutil.copytree(src, dst, copy_function=self.copy)
+
+    def hardlink(self, src, dst):
+        """ Link dst to the same inode as src """
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.link(src, dst)
+
+    def reflink(self, src, dst):
+        """
+            Clone the data blocks of src if the filesystem supports it
+            otherwise let the kernel copy the data with copy_file_range
+            Return 'copy' if the data was copied
+        """
+        method = 'reflink'
+        fsrc = open(src, 'rb')
+        fdst = open(dst, 'wb')
+        try:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError as e:
+                if e.errno not in UNSUPPORTED or not hasattr(os, 'copy_file_range'):
+                    raise e
+
+                method = 'copy'
+                size = os.fstat(fsrc.fileno()).st_size
+                offset = 0
+                while offset < size:
+                    sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+        finally:
+            fsrc.close()
+            if not fdst.closed:
+                fdst.close()
+
+        shutil.copystat(src, dst)
+        return method
+
+################################################################################
+# Unit tests
+################################################################################
+class TestMaterialize(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.src = dir_pattern().format(self.path, 'source.tar')
+        fp = open(self.src, 'wb')
+        fp.write(b'0123456789' * 1000)
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ Read only auto -> hardlink on the same filesystem """
+        m = Materializer('auto', readonly=True)
+        dst = dir_pattern().format(self.path, 'backup.tar')
+        result = m.materialize(self.src, dst)
+        expected = 'hardlink'
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert os.stat(dst).st_ino == os.stat(self.src).st_ino
+
+    def test_2(self):
+        """ Writable auto -> a separate file with the same contents """
+        m = Materializer('auto')
+        dst = dir_pattern().format(self.path, 'backup.tar')
+        result = m.materialize(self.src, dst)
+
+        print("Result:   {}\nExpected: {}".format(result, ['reflink', 'copy']))
+        assert result in ['reflink', 'copy']
+        assert os.stat(dst).st_ino != os.stat(self.src).st_ino
+        assert open(dst, 'rb').read() == open(self.src, 'rb').read()
+
+    def test_3(self):
+        """ Copy mode with a directory destination -> physical copy into the directory """
+        m = Materializer('copy')
+        dst = dir_pattern().format(self.path, 'backup')
+        os.mkdir(dst)
+        result = m.materialize(self.src, dst)
+        expected = 'copy'
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert os.path.isfile(dir_pattern().format(dst, 'source.tar'))
+
+    def test_4(self):
+        """ Unknown mode -> ValueError """
+        self.assertRaises(ValueError, Materializer, 'symlink')
+
+    def test_5(self):
+        """ Reflink on a filesystem without FICLONE -> counted as a copy """
+        if not hasattr(os, 'copy_file_range'):
+            self.skipTest('copy_file_range is not available')
+
+        def ioctl(*args):
+            raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+
+        m = Materializer('reflink')
+        dst = dir_pattern().format(self.path, 'backup.tar')
+        original = fcntl.ioctl
+        fcntl.ioctl = ioctl
+        try:
+            result = [m.materialize(self.src, dst), m.count]
+        finally:
+            fcntl.ioctl = original
+        expected = ['copy', {'hardlink': 0, 'reflink': 0, 'copy': 1}]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert open(dst, 'rb').read() == open(self.src, 'rb').read()
+
+    def test_6(self):
+        """ Writable hardlink -> a separate file, hardlink read only -> the same file """
+        result = []
+        for readonly in [False, True]:
+            dst = dir_pattern().format(self.path, 'backup{}.tar'.format(int(readonly)))
+            Materializer('hardlink', readonly=readonly).materialize(self.src, dst)
+            result.append(os.stat(dst).st_ino == os.stat(self.src).st_ino)
+        expected = [False, True]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
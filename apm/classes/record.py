@@ -0,0 +1,248 @@
+#!/apps/base/python3/bin/python3
+
+import json
+from uuid import UUID
+
+import unittest
+
+# Empty duplicate_files lists are only created when they are asked for
+NO_DUPLICATES = ()
+
+def pack_uuid(value):
+    """ Return a uuid string as its 16 bytes, anything else is returned as is """
+    if type(value) == str and len(value) == 36 and value == value.lower():
+        if value[8] == value[13] == value[18] == value[23] == '-':
+            try:
+                raw = bytes.fromhex(value.replace('-', ''))
+                if len(raw) == 16:
+                    return raw
+            except ValueError:
+                pass
+
+    return value
+
+class FileRecord:
+    """
+        Compact record of a tracked file, used by FileLedger in place of a dict
+        Works like the dict it replaces and serializes to the same json
+        The uuid is kept as 16 bytes and equal names share one string
+    """
+
+    FIELDS = [
+        'uuid',
+        'current_name',
+        'original_name',
+        'stripped_name',
+        'processed_name',
+        'unpacked_name',
+        'duplicate_files',
+        'deleted',
+        'digest',
+        'digest_type',
+        'size',
+    ]
+    NAMES = ['current_name', 'original_name', 'stripped_name', 'processed_name', 'unpacked_name']
+
+    # Fields that were never set are left empty so they are not written out
+    __slots__ = FIELDS + ['extra']
+
+    def __init__(self, record=None):
+        self.extra = None
+        if record == None:
+            return
+
+        # Same as setting each key, without the method calls
+        names = {}
+        for key, value in record.items():
+            if key not in FileRecord.FIELDS:
+                self[key] = value
+                continue
+
+            if key == 'uuid':
+                value = pack_uuid(value)
+            elif key == 'duplicate_files' and value == []:
+                value = NO_DUPLICATES
+            elif key in FileRecord.NAMES and value != None:
+                value = names.setdefault(value, value)
+
+            setattr(self, key, value)
+
+    @staticmethod
+    def wrap(record):
+        """ Return record as a FileRecord """
+        if isinstance(record, FileRecord):
+            return record
+
+        return FileRecord(record)
+
+    @staticmethod
+    def default(obj):
+        """ json.dumps default for ledgers holding FileRecords """
+        if isinstance(obj, FileRecord):
+            return obj.to_dict()
+
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+    def raw(self, key):
+        """ Return the value as it is stored, the uuid stays packed """
+        return getattr(self, key, None)
+
+    def share(self, name):
+        """ Point the names equal to name, usually the ledger key, at that string """
+        for i in FileRecord.NAMES:
+            if getattr(self, i, None) == name:
+                setattr(self, i, name)
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __getitem__(self, key):
+        if key in FileRecord.__slots__ and key != 'extra':
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+
+            if key == 'uuid' and type(value) == bytes:
+                return str(UUID(bytes=value))
+
+            if key == 'duplicate_files' and value is NO_DUPLICATES:
+                value = []
+                setattr(self, key, value)
+
+            return value
+
+        if self.extra == None or key not in self.extra:
+            raise KeyError(key)
+
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key == 'uuid':
+            value = pack_uuid(value)
+
+        elif key == 'duplicate_files' and value == []:
+            value = NO_DUPLICATES
+
+        elif key in FileRecord.NAMES and value != None:
+            # Share the string with another name that has the same value
+            for i in FileRecord.NAMES:
+                if i != key and getattr(self, i, None) == value:
+                    value = getattr(self, i)
+                    break
+
+        if key in FileRecord.FIELDS:
+            setattr(self, key, value)
+            return
+
+        if self.extra == None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __contains__(self, key):
+        if key in FileRecord.FIELDS:
+            return hasattr(self, key)
+
+        return self.extra != None and key in self.extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, FileRecord):
+            other = other.to_dict()
+        if not isinstance(other, dict):
+            return NotImplemented
+
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def keys(self):
+        keys = [i for i in FileRecord.FIELDS if hasattr(self, i)]
+        if self.extra != None:
+            keys.extend(self.extra)
+
+        return keys
+
+    def values(self):
+        return [self[i] for i in self.keys()]
+
+    def items(self):
+        return [(i, self[i]) for i in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        if key not in self:
+            if len(default) > 0:
+                return default[0]
+            raise KeyError(key)
+
+        value = self[key]
+        if key in FileRecord.FIELDS:
+            delattr(self, key)
+        else:
+            self.extra.pop(key)
+
+        return value
+
+################################################################################
+# Unit tests
+################################################################################
+class TestFileRecord(unittest.TestCase):
+    def setUp(self):
+        self.record = {
+            'uuid': '0f4b8c1e-4b0a-4c55-9f4e-2a1b6f3c9d10',
+            'current_name': 'sgpmfrsrC1.00.20140501.000000.raw.dat',
+            'original_name': 'sgpmfrsrC1.00.20140501.000000.raw.dat',
+            'stripped_name': None,
+            'processed_name': None,
+            'unpacked_name': 'sgpmfrsrC1.00.20140501.000000.raw.dat',
+            'duplicate_files': [],
+            'deleted': False,
+        }
+
+    def test_1(self):
+        """ Serialize a record -> same json as the dict """
+        result = json.dumps(FileRecord(self.record), default=FileRecord.default, sort_keys=True)
+        expected = json.dumps(self.record, sort_keys=True)
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Change values through the dict interface -> record follows """
+        record = FileRecord(self.record)
+        record['duplicate_files'].append('1')
+        record['current_name'] = '20140501_000000.dat'
+        record['notes'] = 'edited'
+
+        result = [record['duplicate_files'], record.get('current_name'), record['notes'], 'digest' in record, record.get('digest')]
+        expected = [['1'], '20140501_000000.dat', 'edited', False, None]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        self.assertRaises(KeyError, record.__getitem__, 'digest')
+
+    def test_3(self):
+        """ Equal names in a record -> one shared string """
+        record = FileRecord(json.loads(json.dumps(self.record)))
+        result = record.current_name is record.original_name is record.unpacked_name
+        expected = True
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert record == self.record
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,281 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import unittest
+import tempfile
+
+RENAME_WORKERS = 4
+
+class RenamePlan:
+    """
+        The renames of one directory, computed from a single listing
+        moves holds [name, new_name] pairs, unchanged the names that keep their name
+    """
+
+    def __init__(self, path, site=None, process=None, moves=None, unchanged=None):
+        self.path = path
+        self.site = site
+        self.process = process
+        self.moves = moves if moves != None else []
+        self.unchanged = unchanged if unchanged != None else []
+        self.conflicts = []
+
+    def plan(self, strip_name, names=None):
+        """
+            Compute the stripped name of every file, or of the given names, and find every conflict
+            strip_name(name) must return (new_name, move_to_other_files) like Files.strip_name
+        """
+        listing = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                listing[entry.name] = entry.is_dir() and not entry.is_symlink()
+
+        others = set()
+        if listing.get('other_files'):
+            others = set('other_files/{}'.format(i) for i in os.listdir(os.path.join(self.path, 'other_files')))
+
+        if names == None:
+            names = sorted(i for i in listing if not listing[i])
+
+        targets = {}
+        for name in names:
+            if name not in listing:
+                continue
+
+            new_name, move = strip_name(name)
+            if new_name == None:
+                self.unchanged.append(name)
+                continue
+
+            if move:
+                new_name = 'other_files/{}'.format(new_name)
+
+            if new_name in targets:
+                self.conflicts.append('{} and {} would both be renamed to {}'.format(targets[new_name], name, new_name))
+            elif new_name != name and (new_name in listing or new_name in others):
+                self.conflicts.append('File named {} already exists.'.format(os.path.join(self.path, new_name)))
+
+            targets[new_name] = name
+            if new_name == name:
+                self.unchanged.append(name)
+            else:
+                self.moves.append([name, new_name])
+
+        return self
+
+    def apply(self):
+        """
+            Rename the files, moves that were already done are skipped so an interrupted plan can be applied again
+            Return the moves that are done, files that no longer exist are left out
+        """
+        done = []
+        for name, new_name in self.moves:
+            old = os.path.join(self.path, name)
+            new = os.path.join(self.path, new_name)
+            if os.path.lexists(old):
+                if os.path.lexists(new):
+                    exit("File named {} already exists.\n Please fix this conflict and try again.".format(new))
+
+                if not os.path.exists(os.path.dirname(new)):
+                    os.mkdir(os.path.dirname(new))
+
+                try:
+                    os.rename(old, new)
+                except OSError:
+                    shutil.move(old, new)
+
+            elif not os.path.lexists(new):
+                continue
+
+            done.append([name, new_name])
+
+        return done
+
+    def done(self):
+        """ Return the moves an interrupted run already did, without renaming anything """
+        done = []
+        for name, new_name in self.moves:
+            if not os.path.lexists(os.path.join(self.path, name)) and os.path.lexists(os.path.join(self.path, new_name)):
+                done.append([name, new_name])
+
+        return done
+
+    def to_dict(self):
+        return {'path': self.path, 'site': self.site, 'process': self.process, 'moves': self.moves, 'unchanged': self.unchanged}
+
+class Renamer:
+    """
+        Plan the renames of several directories, check all of them for conflicts
+        before anything is renamed, then apply them with a journal so an
+        interrupted run is finished by the next one
+    """
+
+    def __init__(self, journal, workers=RENAME_WORKERS):
+        self.journal = journal
+        self.workers = max(1, workers)
+        self.plans = []
+        self.lock = threading.Lock()
+
+    def has_journal(self):
+        return os.path.exists(self.journal)
+
+    def load(self):
+        """ Load the plans of an interrupted run """
+        fp = open(self.journal, 'r')
+        data = json.loads(fp.read())
+        fp.close()
+
+        self.plans = [RenamePlan(**i) for i in data['plans']]
+        return self.plans
+
+    def plan(self, plans, strip_name):
+        """ Plan each directory along with the loaded plans and return the conflicts of the new ones """
+        plans = [i.plan(strip_name) for i in plans]
+        self.plans.extend(plans)
+
+        conflicts = []
+        for i in plans:
+            conflicts.extend(i.conflicts)
+
+        return conflicts
+
+    def add(self, plan, strip_name):
+        """
+            Plan one more directory and journal it with the others, so it can be applied right away
+            Return its conflicts, a directory with conflicts is not added
+        """
+        plan.plan(strip_name)
+        if len(plan.conflicts) == 0:
+            with self.lock:
+                self.plans.append(plan)
+                self.write_journal()
+
+        return plan.conflicts
+
+    def write_journal(self):
+        temp = '{}.tmp'.format(self.journal)
+        fp = open(temp, 'w')
+        fp.write(json.dumps({'plans': [i.to_dict() for i in self.plans]}))
+        fp.flush()
+        os.fsync(fp.fileno())
+        fp.close()
+        os.replace(temp, self.journal)
+
+    def apply(self):
+        """ Journal the plans and apply them, one directory per worker, return [(plan, moves done)] """
+        self.write_journal()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(RenamePlan.apply, self.plans))
+
+        return list(zip(self.plans, results))
+
+    def finish(self):
+        """ Remove the journal once the renames are saved in the ledger """
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+
+################################################################################
+# Unit tests
+################################################################################
+def strip(name):
+    temp = name.split('.')
+    if len(temp) > 5:
+        move = temp[4] in ('orig', 'bad')
+        return '.'.join(temp[5:] if temp[4] == 'raw' else temp), move
+
+    return None, False
+
+class TestRenamer(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.dir = '{}/sgp/sgpmfrsrC1.00'.format(self.path)
+        os.makedirs(self.dir)
+        self.names = [
+            'sgpmfrsrC1.00.20140501.000000.raw.a.dat',
+            'sgpmfrsrC1.00.20140501.010000.raw.b.dat',
+            'sgpmfrsrC1.00.20140501.020000.bad.c.dat',
+            'unchanged.dat',
+        ]
+        for i in self.names:
+            open('{}/{}'.format(self.dir, i), 'w').close()
+
+        self.renamer = Renamer('{}/rename.journal'.format(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ Plan and apply a directory -> files renamed and journal removed """
+        conflicts = self.renamer.plan([RenamePlan(self.dir, 'sgp', 'sgpmfrsrC1.00')], strip)
+        self.renamer.apply()
+        self.renamer.finish()
+
+        result = [conflicts, sorted(os.listdir(self.dir)), os.listdir('{}/other_files'.format(self.dir)), self.renamer.has_journal()]
+        expected = [[], ['a.dat', 'b.dat', 'other_files', 'unchanged.dat'], ['sgpmfrsrC1.00.20140501.020000.bad.c.dat'], False]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Plan a directory with a conflict -> conflict reported and nothing renamed """
+        open('{}/b.dat'.format(self.dir), 'w').close()
+        conflicts = self.renamer.plan([RenamePlan(self.dir)], strip)
+
+        result = [len(conflicts), sorted(os.listdir(self.dir))]
+        expected = [1, sorted(self.names + ['b.dat'])]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ Resume from the journal after part of the renames -> the rest are done """
+        self.renamer.plan([RenamePlan(self.dir, 'sgp', 'sgpmfrsrC1.00')], strip)
+        self.renamer.write_journal()
+        os.rename('{}/{}'.format(self.dir, self.names[0]), '{}/a.dat'.format(self.dir))
+
+        renamer = Renamer(self.renamer.journal)
+        renamer.load()
+        result = renamer.apply()[0][1]
+        expected = [[self.names[0], 'a.dat'], [self.names[1], 'b.dat'], [self.names[2], 'other_files/{}'.format(self.names[2])]]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_4(self):
+        """ Add two directories one at a time -> both journaled, the one with a conflict is left out """
+        other = '{}/sgp/sgpmetE13.00'.format(self.path)
+        os.makedirs(other)
+        for i in ['sgpmetE13.00.20140501.000000.raw.a.dat', 'a.dat']:
+            open('{}/{}'.format(other, i), 'w').close()
+
+        first = self.renamer.add(RenamePlan(self.dir, 'sgp', 'sgpmfrsrC1.00'), strip)
+        second = self.renamer.add(RenamePlan(other, 'sgp', 'sgpmetE13.00'), strip)
+        journaled = Renamer(self.renamer.journal).load()
+
+        result = [first, len(second), [i.process for i in journaled]]
+        expected = [[], 1, ['sgpmfrsrC1.00']]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_5(self):
+        """ Interrupt a journaled rename after one file -> only that move is done """
+        self.renamer.plan([RenamePlan(self.dir, 'sgp', 'sgpmfrsrC1.00')], strip)
+        self.renamer.write_journal()
+        os.rename('{}/{}'.format(self.dir, self.names[0]), '{}/a.dat'.format(self.dir))
+
+        result = [i.done() for i in Renamer(self.renamer.journal).load()]
+        expected = [[[self.names[0], 'a.dat']]]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
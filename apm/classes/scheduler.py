@@ -0,0 +1,221 @@
+#!/apps/base/python3/bin/python3
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+import unittest
+
+class Task:
+    """ One step of a Scheduler, run once every task it depends on is done """
+
+    def __init__(self, name, func, deps=None, resource=None):
+        self.name = name
+        self.func = func
+        self.deps = deps if deps != None else []
+        self.resource = resource
+        self.state = 'pending'
+        self.result = None
+        self.error = None
+        self.start = None
+        self.end = None
+
+    def get_time(self):
+        return self.end - self.start if self.end != None else 0.0
+
+class Scheduler:
+    """
+        Run a graph of tasks with a pool of workers
+        A task starts as soon as its dependencies are done and a worker and its
+        resource are free, the tasks with the longest chain after them go first
+        After a failure no new task is started, the running ones are finished
+        and the first error is raised again
+    """
+
+    def __init__(self, workers=1, resources=None):
+        self.workers = max(1, workers)
+        self.resources = dict((k, max(1, v)) for k, v in (resources or {}).items())
+        self.tasks = {}
+        self.order = []
+        self.started = None
+        self.finished = None
+
+    def add(self, name, func, deps=None, resource=None):
+        """ Add a task, its dependencies must already be added so the graph can not have a cycle """
+        if name in self.tasks:
+            raise ValueError('The task {} was already added'.format(name))
+
+        deps = [i for i in (deps or []) if i != None]
+        for i in deps:
+            if i not in self.tasks:
+                raise ValueError('The task {} depends on {} which was not added'.format(name, i))
+
+        if resource != None and resource not in self.resources:
+            raise ValueError('The task {} uses {} which has no limit'.format(name, resource))
+
+        self.tasks[name] = Task(name, func, deps, resource)
+        self.order.append(name)
+        return name
+
+    def get_ranks(self):
+        """ Return the number of tasks on the longest chain that starts at each task """
+        ranks = dict((i, 1) for i in self.order)
+        for name in reversed(self.order):
+            for i in self.tasks[name].deps:
+                ranks[i] = max(ranks[i], ranks[name] + 1)
+
+        return ranks
+
+    def run(self):
+        """ Run every task, return {name: result} """
+        ranks = self.get_ranks()
+        used = dict((k, 0) for k in self.resources)
+        running = {}
+        failed = None
+        self.started = time.time()
+
+        def call(task):
+            task.start = time.time()
+            try:
+                return task.func()
+            finally:
+                task.end = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                if failed == None:
+                    ready = [self.tasks[i] for i in self.order if self.tasks[i].state == 'pending' and all(self.tasks[j].state == 'done' for j in self.tasks[i].deps)]
+                    ready.sort(key=lambda i: -ranks[i.name])
+                    for task in ready:
+                        if len(running) >= self.workers:
+                            break
+                        if task.resource != None and used[task.resource] >= self.resources[task.resource]:
+                            continue
+
+                        if task.resource != None:
+                            used[task.resource] += 1
+                        task.state = 'running'
+                        running[pool.submit(call, task)] = task
+
+                if len(running) == 0:
+                    break
+
+                finished, pending = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    if task.resource != None:
+                        used[task.resource] -= 1
+
+                    # Commands stop with exit(), so SystemExit is a failure like any other
+                    try:
+                        task.result = future.result()
+                        task.state = 'done'
+                    except BaseException as e:
+                        task.error = e
+                        task.state = 'failed'
+                        if failed == None:
+                            failed = task
+
+        self.finished = time.time()
+        for name in self.order:
+            if self.tasks[name].state == 'pending':
+                self.tasks[name].state = 'cancelled'
+
+        if failed != None:
+            raise failed.error
+
+        return dict((i, self.tasks[i].result) for i in self.order)
+
+    def critical_path(self):
+        """
+            Return the tasks that held up the end of the run, first to last
+            Each task is preceded by the dependency that finished last
+        """
+        ran = [self.tasks[i] for i in self.order if self.tasks[i].end != None]
+        if len(ran) == 0:
+            return []
+
+        path = [max(ran, key=lambda i: i.end)]
+        while True:
+            deps = [self.tasks[i] for i in path[0].deps if self.tasks[i].end != None]
+            if len(deps) == 0:
+                break
+            path.insert(0, max(deps, key=lambda i: i.end))
+
+        return path
+
+    def report(self):
+        """ Return the critical path with the time each task ran and waited after its dependencies """
+        path = self.critical_path()
+        if len(path) == 0 or self.started == None:
+            return 'Critical path: no tasks ran'
+
+        total = self.finished - self.started
+        busy = sum(i.get_time() for i in path)
+        lines = ['Critical path: {:.1f}s of {:.1f}s running, {:.1f}s of work in {} tasks'.format(
+            busy, total, sum(i.get_time() for i in self.tasks.values()), len([i for i in self.tasks.values() if i.end != None]))]
+
+        last = self.started
+        for task in path:
+            lines.append('    {:<40} {:8.1f}s  waited {:.1f}s'.format(task.name, task.get_time(), max(0.0, task.start - last)))
+            last = task.end
+
+        return '\n'.join(lines)
+
+################################################################################
+# Unit tests
+################################################################################
+class TestScheduler(unittest.TestCase):
+    def test_1(self):
+        """ Pipeline two datastreams with one stage slot -> rename of the first runs while the second stages """
+        log = []
+        lock = threading.Lock()
+        def step(name, seconds):
+            def run():
+                with lock:
+                    log.append('start {}'.format(name))
+                time.sleep(seconds)
+                with lock:
+                    log.append('end {}'.format(name))
+                return name
+            return run
+
+        scheduler = Scheduler(workers=2, resources={'stage': 1})
+        for i in ['a', 'b']:
+            scheduler.add('stage {}'.format(i), step('stage {}'.format(i), 0.2), resource='stage')
+            scheduler.add('rename {}'.format(i), step('rename {}'.format(i), 0.05), ['stage {}'.format(i)])
+
+        results = scheduler.run()
+        result = [log.index('start rename a') < log.index('end stage b'), results['rename b'], [i.name for i in scheduler.critical_path()]]
+        expected = [True, 'rename b', ['stage b', 'rename b']]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert scheduler.report().splitlines()[1].split()[:2] == ['stage', 'b']
+
+    def test_2(self):
+        """ Fail a task -> its dependents are cancelled and the error is raised """
+        def fail():
+            exit('stage failed')
+
+        scheduler = Scheduler(workers=1)
+        scheduler.add('stage a', fail)
+        scheduler.add('rename a', lambda: 'a', ['stage a'])
+
+        try:
+            scheduler.run()
+            error = None
+        except SystemExit as e:
+            error = str(e)
+
+        result = [error, scheduler.tasks['stage a'].state, scheduler.tasks['rename a'].state]
+        expected = ['stage failed', 'failed', 'cancelled']
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,251 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import json
+
+import unittest
+import tempfile
+import shutil
+
+from apm.classes import digest
+
+class TreeSnapshot:
+    """
+        Merkle tree of a directory, {'d': digest, 'e': {name: node}} for
+        directories and {'d': digest, 's': [size, mtime_ns, inode]} for files
+        A file is only hashed again when its stat changes, and two snapshots
+        are compared by skipping every directory with the same digest
+    """
+
+    def __init__(self, root, algorithm='sha256', tree=None):
+        self.root = root
+        self.algorithm = algorithm
+        self.tree = tree if tree != None else {'d': None, 'e': {}}
+
+    @staticmethod
+    def load(path, root, algorithm='sha256'):
+        """ Return the snapshot saved at path, or an empty one """
+        if os.path.exists(path):
+            try:
+                fp = open(path, 'r')
+                data = json.loads(fp.read())
+                fp.close()
+                if data.get('algorithm') == algorithm:
+                    return TreeSnapshot(root, algorithm, data['tree'])
+            except (OSError, ValueError, KeyError):
+                pass
+
+        return TreeSnapshot(root, algorithm)
+
+    def save(self, path):
+        temp = '{}.tmp'.format(path)
+        fp = open(temp, 'w')
+        fp.write(json.dumps({'algorithm': self.algorithm, 'tree': self.tree}, separators=(',', ':')))
+        fp.close()
+        os.replace(temp, path)
+
+    def update(self, hasher, select=None):
+        """
+            Return a new snapshot of the root, reusing the digests of files whose stat did not change
+            hasher(paths) must yield (path, digest) for each of the paths
+            Only the files whose relative path passes select are hashed, the
+            others are compared by their stat
+        """
+        stale = {}
+        tree = self.scan(self.root, '', self.tree, stale, select)
+
+        # Files that were renamed or moved keep their stat
+        if len(stale) > 0:
+            known = {}
+            get_signatures(self.tree, known)
+            for path in list(stale):
+                value = known.get(tuple(stale[path]['s']))
+                if value != None:
+                    stale.pop(path)['d'] = value
+
+        for path, value in hasher(list(stale)):
+            stale[path]['d'] = value.hex() if value != None else None
+
+        self.seal(tree)
+        return TreeSnapshot(self.root, self.algorithm, tree)
+
+    def scan(self, path, relpath, old, stale, select=None):
+        """ Stat the entries of a directory, collecting the files that need to be hashed """
+        node = {'d': None, 'e': {}}
+        old_entries = old.get('e', {}) if old != None else {}
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                previous = old_entries.get(entry.name)
+                name = '{}/{}'.format(relpath, entry.name) if relpath else entry.name
+                if entry.is_symlink():
+                    node['e'][entry.name] = {'d': None, 'l': os.readlink(entry.path)}
+                elif entry.is_dir():
+                    node['e'][entry.name] = self.scan(entry.path, name, previous if previous != None and 'e' in previous else None, stale, select)
+                elif entry.is_file():
+                    info = entry.stat()
+                    signature = [info.st_size, info.st_mtime_ns, info.st_ino]
+                    if select != None and not select(name):
+                        node['e'][entry.name] = {'d': 'stat:{}:{}:{}'.format(*signature), 's': signature}
+                    elif previous != None and previous.get('s') == signature and previous.get('d') != None and not previous['d'].startswith('stat:'):
+                        node['e'][entry.name] = {'d': previous['d'], 's': signature}
+                    else:
+                        node['e'][entry.name] = {'d': None, 's': signature}
+                        stale[entry.path] = node['e'][entry.name]
+
+        return node
+
+    def seal(self, node):
+        """ Set the digests of the directories from the digests of their entries """
+        h = digest.new(self.algorithm)
+        for name in sorted(node['e']):
+            child = node['e'][name]
+            if 'e' in child:
+                self.seal(child)
+                kind = 'd'
+            elif 'l' in child:
+                link = digest.new(self.algorithm)
+                link.update(child['l'].encode('utf-8', 'surrogateescape'))
+                child['d'] = link.hexdigest()
+                kind = 'l'
+            else:
+                kind = 'f'
+
+            h.update('{}\x00{}\x00{}\n'.format(kind, name, child['d']).encode('utf-8', 'surrogateescape'))
+
+        node['d'] = h.hexdigest()
+
+    def get(self, relpath):
+        """ Return the node of a path relative to the root, None if it is not in the snapshot """
+        node = self.tree
+        for name in relpath.split('/'):
+            if name == '':
+                continue
+            if 'e' not in node or name not in node['e']:
+                return None
+            node = node['e'][name]
+
+        return node
+
+    def get_digest(self, relpath):
+        node = self.get(relpath)
+        return node['d'] if node != None else None
+
+    def diff(self, other):
+        """
+            Return {'added': [], 'removed': [], 'changed': []} file paths, relative
+            to the root, that are different in the other snapshot
+        """
+        changes = {'added': [], 'removed': [], 'changed': []}
+        compare(self.tree, other.tree, '', changes)
+        for i in changes:
+            changes[i].sort()
+
+        return changes
+
+def compare(old, new, path, changes):
+    if old['d'] == new['d'] and old['d'] != None:
+        return
+
+    for name in set(old['e']) | set(new['e']):
+        relpath = '{}/{}'.format(path, name) if path else name
+        a = old['e'].get(name)
+        b = new['e'].get(name)
+        if a != None and b != None and ('e' in a) == ('e' in b):
+            if 'e' in a:
+                compare(a, b, relpath, changes)
+            elif a['d'] != b['d'] or a['d'] == None:
+                changes['changed'].append(relpath)
+            continue
+
+        if a != None:
+            list_files(a, relpath, changes['removed'])
+        if b != None:
+            list_files(b, relpath, changes['added'])
+
+def get_signatures(node, result):
+    """ Fill result with {(size, mtime_ns, inode): digest} of the files under node """
+    for child in node.get('e', {}).values():
+        if 'e' in child:
+            get_signatures(child, result)
+        elif 's' in child and child['d'] != None and not child['d'].startswith('stat:'):
+            result[tuple(child['s'])] = child['d']
+
+def list_files(node, path, result):
+    if 'e' not in node:
+        result.append(path)
+        return
+
+    for name in node['e']:
+        list_files(node['e'][name], '{}/{}'.format(path, name), result)
+
+################################################################################
+# Unit tests
+################################################################################
+def hash_paths(paths):
+    for path in paths:
+        h = digest.new('sha256')
+        fp = open(path, 'rb')
+        h.update(fp.read())
+        fp.close()
+        yield path, h.digest()
+
+class TestTreeSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.root = '{}/collection'.format(self.path)
+        for i in ['sgp/sgpmfrsrC1.00', 'sgp/sgpmetE13.00']:
+            os.makedirs('{}/{}'.format(self.root, i))
+            for j in range(3):
+                self.write('{}/file{}.dat'.format(i, j), str(j))
+
+        self.hashed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, text):
+        fp = open('{}/{}'.format(self.root, name), 'w')
+        fp.write(text)
+        fp.close()
+
+    def hasher(self, paths):
+        self.hashed.extend(paths)
+        return hash_paths(paths)
+
+    def test_1(self):
+        """ Change, add and remove files -> only those are in the diff """
+        old = TreeSnapshot(self.root).update(self.hasher)
+        self.write('sgp/sgpmfrsrC1.00/file0.dat', 'changed')
+        self.write('sgp/sgpmetE13.00/file3.dat', '3')
+        os.remove('{}/sgp/sgpmetE13.00/file1.dat'.format(self.root))
+
+        result = old.diff(TreeSnapshot(self.root).update(self.hasher))
+        expected = {
+            'added': ['sgp/sgpmetE13.00/file3.dat'],
+            'removed': ['sgp/sgpmetE13.00/file1.dat'],
+            'changed': ['sgp/sgpmfrsrC1.00/file0.dat'],
+        }
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Update a saved snapshot -> only files with a new stat are hashed """
+        path = '{}/collection.snapshot.json'.format(self.path)
+        old = TreeSnapshot(self.root).update(self.hasher)
+        old.save(path)
+
+        self.hashed = []
+        os.utime('{}/sgp/sgpmetE13.00/file2.dat'.format(self.root), ns=(0, 0))
+        new = TreeSnapshot.load(path, self.root).update(self.hasher)
+
+        result = [self.hashed, old.diff(new), new.tree['d'] == old.tree['d']]
+        expected = [['{}/sgp/sgpmetE13.00/file2.dat'.format(self.root)], {'added': [], 'removed': [], 'changed': []}, True]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -37,6 +37,18 @@ def dir_pattern(depth=2):
 
 ################################################################################
 
+def get_exit_code(config):
+    """
+        Return the exit status of a command that stopped early or found naming collisions
+        At a terminal it is 0, a batch sets APM_BATCH to get 1 so it stops the commands of the job
+    """
+    if os.environ.get('APM_BATCH') and (config.get('exit') or config.get('duplicates')):
+        return 1
+
+    return None
+
+################################################################################
+
 def get_shell():
     """Get the user's default shell"""
     shell = None
@@ -7,16 +7,27 @@ def config():
 		"compare": True,
 		"datastream": None,
 		"duplicates": False,
+		"digest": "sha256",
 		"end": 20140507,
+		"extract_workers": 1,
 		"facility": "C1",
+		"full_scan": False,
+		"hash_workers": 4,
 		"ingest": True,
+		"ingest_workers": None,
 		"instrument": "mfrsr",
 		"interactive": False,
+		"io_limit": None,
 		"job": "test",
+		"ledger": "json",
+		"materialize": "auto",
+		"member_padding": None,
 		"quiet": False,
 		"site": "sgp",
 		"source": None,
 		"stage": None,
+		"stage_mode": "copy",
+		"stage_workers": 1,
 		"username": os.environ.get('USER'),
 		"vap": False
 	}
@@ -0,0 +1,172 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import json
+import time
+import zlib
+
+import unittest
+import tempfile
+import shutil
+
+# A directory changed this close to the scan may change again within the same mtime tick
+RACY_NS = 2000000000
+
+class TrackedState:
+    """
+        The stat of each directory of the collection when the tracked files
+        were last checked against it, so only directories that changed since
+        are listed again
+        {relpath: {'m': mtime_ns, 'n': nlink, 'c': entries, 't': tracked signature, 'e': names}}
+        Names are only kept for the site level directories, the file listings
+        are never stored
+    """
+
+    def __init__(self, root, path=None):
+        self.root = root
+        self.path = path
+        self.dirs = {}
+        self.started = time.time_ns()
+
+        if path != None and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        try:
+            fp = open(self.path, 'r')
+            self.dirs = json.loads(fp.read())
+            fp.close()
+        except (OSError, ValueError):
+            self.dirs = {}
+
+    def save(self):
+        if self.path == None:
+            return
+
+        temp = '{}.tmp'.format(self.path)
+        fp = open(temp, 'w')
+        fp.write(json.dumps(self.dirs, separators=(',', ':')))
+        fp.close()
+        os.replace(temp, self.path)
+
+    def get_stat(self, relpath):
+        info = os.stat(os.path.join(self.root, relpath) if relpath else self.root)
+        return info.st_mtime_ns, info.st_nlink
+
+    @staticmethod
+    def get_signature(names):
+        """ Return a signature of a set of names that does not depend on their order """
+        total = 0
+        for name in names:
+            total += zlib.crc32(name.encode('utf-8', 'surrogateescape'))
+
+        return '{}:{}'.format(len(names), total)
+
+    def is_current(self, relpath, tracked=None):
+        """ Return True if a directory, and the names tracked in it, did not change since it was recorded """
+        entry = self.dirs.get(relpath)
+        if entry == None:
+            return False
+
+        mtime, nlink = self.get_stat(relpath)
+        if entry['m'] != mtime or entry['n'] != nlink:
+            return False
+
+        return tracked == None or entry.get('t') == self.get_signature(tracked)
+
+    def record(self, relpath, count, tracked=None, names=None):
+        """ Record a directory that was just listed and checked """
+        mtime, nlink = self.get_stat(relpath)
+        if mtime >= self.started - RACY_NS:
+            self.dirs.pop(relpath, None)
+            return
+
+        entry = {'m': mtime, 'n': nlink, 'c': count}
+        if tracked != None:
+            entry['t'] = self.get_signature(tracked)
+        if names != None:
+            entry['e'] = sorted(names)
+
+        self.dirs[relpath] = entry
+
+    def listdir(self, relpath, lister, full=False):
+        """ Return the names in a directory, from the state if it did not change or from lister(relpath) """
+        entry = self.dirs.get(relpath)
+        if not full and entry != None and 'e' in entry and self.is_current(relpath):
+            return entry['e']
+
+        names = lister(relpath)
+        self.record(relpath, len(names), names=names)
+        return names
+
+    def forget(self, keep):
+        """ Drop the directories that were not seen in this run """
+        for i in list(self.dirs):
+            if i not in keep:
+                del self.dirs[i]
+
+################################################################################
+# Unit tests
+################################################################################
+class TestTrackedState(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.root = '{}/collection'.format(self.path)
+        self.dir = '{}/sgp/sgpmfrsrC1.00'.format(self.root)
+        os.makedirs(self.dir)
+        for i in ['a.dat', 'b.dat']:
+            open('{}/{}'.format(self.dir, i), 'w').close()
+
+        # Make the directories old enough to be recorded
+        for i in [self.dir, os.path.dirname(self.dir), self.root]:
+            os.utime(i, ns=(0, 0))
+
+        self.state_file = '{}/test.tracked.json'.format(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ Record a directory, then change it and the tracked names -> only unchanged is current """
+        state = TrackedState(self.root, self.state_file)
+        state.record('sgp/sgpmfrsrC1.00', 2, ['a.dat', 'b.dat'])
+        state.save()
+
+        state = TrackedState(self.root, self.state_file)
+        result = [state.is_current('sgp/sgpmfrsrC1.00', ['b.dat', 'a.dat']), state.is_current('sgp/sgpmfrsrC1.00', ['a.dat'])]
+        os.remove('{}/a.dat'.format(self.dir))
+        result.append(state.is_current('sgp/sgpmfrsrC1.00', ['b.dat', 'a.dat']))
+        expected = [True, False, False]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ List a directory twice, then with full -> listed, from the state, listed """
+        listed = []
+        def lister(relpath):
+            listed.append(relpath)
+            return os.listdir('{}/{}'.format(self.root, relpath))
+
+        state = TrackedState(self.root)
+        result = [state.listdir('sgp', lister), state.listdir('sgp', lister), state.listdir('sgp', lister, full=True), listed]
+        expected = [['sgpmfrsrC1.00'], ['sgpmfrsrC1.00'], ['sgpmfrsrC1.00'], ['sgp', 'sgp']]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ Record a directory changed during the scan -> not recorded """
+        state = TrackedState(self.root)
+        open('{}/c.dat'.format(self.dir), 'w').close()
+        state.record('sgp/sgpmfrsrC1.00', 3, ['a.dat', 'b.dat', 'c.dat'])
+
+        result = state.is_current('sgp/sgpmfrsrC1.00', ['a.dat', 'b.dat', 'c.dat'])
+        expected = False
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
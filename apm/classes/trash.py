@@ -0,0 +1,265 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import sys
+import json
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+import unittest
+import tempfile
+import shutil
+
+DELETE_WORKERS = 8
+
+def clear_dir(path):
+    """
+        Unlink everything in a directory but its subdirectories, return (subdirectories, files removed)
+        Entries another purge already removed are skipped
+    """
+    subdirs = []
+    count = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+
+                try:
+                    os.unlink(entry.path)
+                    count += 1
+                except FileNotFoundError:
+                    pass
+    except FileNotFoundError:
+        pass
+
+    return subdirs, count
+
+def delete_tree(path, keep_root=False, workers=DELETE_WORKERS, progress=None):
+    """
+        Delete a directory tree with a pool of workers, one directory per task
+        The entry types from scandir are used so nothing is stat'ed
+        progress(files, dirs) is called as directories are cleared
+    """
+    dirs = [path]
+    files = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(clear_dir, path)}
+        while len(pending) > 0:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for job in finished:
+                subdirs, count = job.result()
+                files += count
+                dirs.extend(subdirs)
+                for i in subdirs:
+                    pending.add(pool.submit(clear_dir, i))
+
+            if progress != None:
+                progress(files, len(dirs))
+
+    # Subdirectories are always found after their parents
+    for i in reversed(dirs[1:] if keep_root else dirs):
+        try:
+            os.rmdir(i)
+        except FileNotFoundError:
+            pass
+
+    return files, len(dirs)
+
+class Trash:
+    """
+        Directory that trees are renamed into so they disappear at once,
+        then deleted in the foreground or by a background process
+        The trash must be on the same filesystem as the trees moved into it
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.status_file = '{}.status'.format(path.rstrip('/'))
+
+    def move(self, item):
+        """ Rename a file or directory into the trash """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        name = '{}.{}.{}'.format(os.path.basename(item.rstrip('/')), int(time.time() * 1000000), os.getpid())
+        os.rename(item, os.path.join(self.path, name))
+
+    def empty(self, folder):
+        """ Move a directory into the trash and leave an empty one with the same mode in its place """
+        mode = os.stat(folder).st_mode & 0o7777
+        self.move(folder)
+        os.mkdir(folder)
+        os.chmod(folder, mode)
+
+    def is_empty(self):
+        return not os.path.exists(self.path) or len(os.listdir(self.path)) == 0
+
+    def get_status(self):
+        """ Return the status written by the process deleting the trash, None if there is none """
+        try:
+            fp = open(self.status_file, 'r')
+            status = json.loads(fp.read())
+            fp.close()
+        except (OSError, ValueError):
+            return None
+
+        status['running'] = status.get('done') == False and is_running(status.get('pid'))
+        return status
+
+    def write_status(self, status):
+        temp = '{}.tmp'.format(self.status_file)
+        fp = open(temp, 'w')
+        fp.write(json.dumps(status))
+        fp.close()
+        os.replace(temp, self.status_file)
+
+    def purge(self, workers=DELETE_WORKERS):
+        """ Delete everything in the trash, writing the progress to the status file """
+        status = {'pid': os.getpid(), 'started': time.time(), 'files': 0, 'dirs': 0, 'done': False}
+        self.write_status(status)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        last = [0]
+        def progress(files, dirs):
+            now = time.time()
+            if now - last[0] > 1:
+                last[0] = now
+                self.write_status(dict(status, files=status['files'] + files, dirs=status['dirs'] + dirs))
+
+        files, dirs = delete_tree(self.path, keep_root=True, workers=workers, progress=progress)
+        status.update(files=files, dirs=dirs, done=True, finished=time.time())
+        self.write_status(status)
+
+        return status
+
+    def start(self):
+        """ Delete the trash in a background process that outlives apm, return its pid """
+        status = self.get_status()
+        if status != None and status['running']:
+            return status['pid']
+
+        # Load this file on its own so the process does not import the rest of apm
+        code = '; '.join([
+            'import importlib.util',
+            'spec = importlib.util.spec_from_file_location("trash", {!r})'.format(os.path.abspath(__file__)),
+            'module = importlib.util.module_from_spec(spec)',
+            'spec.loader.exec_module(module)',
+            'module.Trash({!r}).purge()'.format(os.path.abspath(self.path)),
+        ])
+
+        process = subprocess.Popen(
+            [sys.executable, '-c', code],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+        # Mark the purge as running right away with the pid of the process, unless it already did
+        status = self.get_status()
+        if status == None or status.get('pid') != process.pid:
+            self.write_status({'pid': process.pid, 'started': time.time(), 'files': 0, 'dirs': 0, 'done': False})
+
+        return process.pid
+
+def is_running(pid):
+    if pid == None:
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    # A finished child that was not waited on is a zombie
+    try:
+        fp = open('/proc/{}/stat'.format(pid), 'r')
+        state = fp.read().rsplit(')', 1)[-1].split()[0]
+        fp.close()
+        return state != 'Z'
+    except (OSError, IndexError):
+        return True
+
+################################################################################
+# Unit tests
+################################################################################
+class TestTrash(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.data = '{}/datastream'.format(self.path)
+        for i in ['sgp/sgpmfrsrC1.00', 'sgp/sgpmfrsrC1.b1', 'sgp/sgpmetE13.00/other_files']:
+            os.makedirs('{}/{}'.format(self.data, i))
+            for j in range(5):
+                open('{}/{}/file{}'.format(self.data, i, j), 'w').close()
+        os.symlink('/nonexistent', '{}/sgp/link'.format(self.data))
+
+        self.trash = Trash('{}/.trash'.format(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_1(self):
+        """ Delete a tree, keeping the root -> empty root and counts """
+        result = [delete_tree(self.data, keep_root=True, workers=3), os.listdir(self.data)]
+        expected = [(16, 6), []]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Empty a directory into the trash and purge it -> empty directory and empty trash """
+        self.trash.empty(self.data)
+        moved = os.listdir(self.data)
+        status = self.trash.purge(workers=2)
+
+        result = [moved, self.trash.is_empty(), status['files'], status['done'], self.trash.get_status()['running']]
+        expected = [[], True, 16, True, False]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ Empty a directory and delete the trash in the background -> trash empty once it is done """
+        self.trash.empty(self.data)
+        pid = self.trash.start()
+        status = self.trash.get_status()
+        assert status['pid'] == pid
+        for i in range(100):
+            if not status['running']:
+                break
+            time.sleep(0.1)
+            status = self.trash.get_status()
+
+        result = [status['done'], status['files'], self.trash.is_empty()]
+        expected = [True, 16, True]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_4(self):
+        """ Remove part of a tree while it is deleted, like a second purge -> deleted without errors """
+        removed = []
+        def progress(files, dirs):
+            # Once the directories of sgp were found
+            if dirs >= 5 and len(removed) == 0:
+                removed.append(True)
+                shutil.rmtree('{}/sgp/sgpmetE13.00'.format(self.data))
+
+        delete_tree(self.data, keep_root=True, workers=1, progress=progress)
+        result = [removed, os.listdir(self.data), clear_dir('{}/missing'.format(self.path))]
+        expected = [[True], [], ([], 0)]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -1,20 +1,32 @@
 #!/apps/base/python3/bin/python3
 
 import os
+import calendar
 import shutil
 import tarfile
+import tempfile
 import time
-import datetime
 import threading
 
-from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from uuid import UUID
 
 from apm.classes.ui import UI
+from apm.classes.catalog import TarCatalog
+from apm.classes.materialize import Materializer
+from apm.classes.fasttar import FastTar
+from apm.classes.fasttar import FastTarError
 from apm.classes.files import Files
+from apm.classes import digest
 from apm.classes.system import jprint
 from apm.classes.system import dir_pattern
+from apm.classes.system import convert_date_to_timestamp
 
+BLOCKSIZE = 1048576
+
+# Colliding members larger than this are spooled to disk while they are compared
+SPOOLSIZE = 67108864
 
 class UnPack:
     """ Interface to unpack tar files """
@@ -26,6 +38,7 @@ class UnPack:
         self.begin = self.config['begin']
         self.end = self.config['end']
         self.quiet = self.config['quiet']
+        self.workers = max(1, int(self.config['extract_workers'] or 1))
 
         self.source = self.config['source']
         self.stage = self.config['stage']
@@ -42,107 +55,45 @@ class UnPack:
         self.files = None
 
         # duplicate file manipulation
-        self.file_names = []
-        self.st_files = []
-        self.members = []
+        # Both indexes are keyed by the stripped name of a member
+        self.placed = {}        # Number of members placed with this name
+        self.first_names = {}   # Name of the member unpacked into the stage dir
         self.duplicates = {}
         self.dups = None
+        self.hashes = {}        # Digest and size of each file written, keyed by its name
+        self.algorithm = self.config['digest']
+        self.cache = Files(self.config).get_hash_cache()
+        self.versions = {}      # .vN names written for each first member
 
-    def get_tar_files(self):
-        """ Retrieve a list of tar files that match the specified dates """
-        os.chdir(self.archive_path)
-        files = glob('*.tar')
+        # Bytes read from disk by each phase of staging
+        self.bytes_read = {'backup': 0, 'extract': 0, 'snapshot': 0}
 
-        temp = str(self.begin)
-        by = int(temp[:4])
-        bm = int(temp[4:6])
-        bd = int(temp[6:8])
-        temp = str(self.end)
-        ey = int(temp[:4])
-        em = int(temp[4:6])
-        ed = int(temp[6:8])
+        # Only extract members with a timestamp within padding hours of the dates
+        self.window = None
+        padding = self.config['member_padding']
+        if padding != None:
+            padding = float(padding) * 3600
+            begin = convert_date_to_timestamp(str(self.begin)[:8]) - padding
+            end = convert_date_to_timestamp(str(self.end)[:8]) + 86400 + padding
+            self.window = (begin, end)
 
-        begin = datetime.date(by, bm, bd)
-        end = datetime.date(ey, em, ed)
+        self.skipped = {'members': 0, 'bytes': 0}
 
-        tar_files = []
-        dates = {}
+    def get_tar_files(self):
+        """ Retrieve a list of tar files that match the specified dates """
+        catalog = TarCatalog(self.archive_path)
 
         # Check to see if data exists for the selected instrument
-        if len(files) == 0:
+        if catalog.is_empty():
             if not self.quiet:
                 print("No data for the selected instrument.")
             return
 
-        # Make sure I have only the names of the files, not the full path
-        for k,v in enumerate(files):
-            files[k] = v.split('/')[-1]
-
-        # Sort the files by date
-        files.sort()
-
-        # Collect all the dates for the various files
-        for i in files:
-            temp = i.split('.')
-            date = temp[2]
-            if len(date) == 6:
-                date = "19%s" % date
-
-            year = date[:4]
-            month = date[4:6]
-            day = date[6:8]
-            key = "{}-{}-{}".format(year, month, day)
-            if key not in dates:
-                dates[key] = [i]
-            else:
-                dates[key].append(i)
-
-        keys = dates.keys()
-        keys = sorted(keys)
-
-        first = keys[0].split('-')
-        first = datetime.date(int(first[0]), int(first[1]), int(first[2]))
-        last = keys[-1].split('-')
-        last = datetime.date(int(last[0]), int(last[1]), int(last[2]))
-
-        begin_index = None if (begin < first or begin > last or begin == None) else 0
-        end_index = None if (end < first or end > last or end == None) else 0
-
-        if (begin != None) or (end != None):
-            for k,v in enumerate(keys):
-                # Get the file's date
-                temp = v.split('-')
-                temp = datetime.date(int(temp[0]), int(temp[1]), int(temp[2]))
-                if temp <= begin:
-                    if not temp == begin:
-                        begin_index = k
-                    elif not begin_index:
-                        begin_index = k if k == 0 else (k - 1)
-
-                if temp >= end:
-                    if temp == end:
-                        end_index = (k + 1) if ((k + 1) < len(dates)) else k
-                    elif not end_index:
-                        end_index = k
-
-                if (k == 0) and (temp > begin):
-                    begin_index = k
-
-                if ((k + 1) == len(dates)) and (temp < end) and (end_index == None):
-                    end_index = k
-
-        if begin_index != None and end_index == None:
-            end_index = begin_index
-        elif begin_index == None and end_index != None:
-            begin_index = end_index
-        elif begin_index == None and end_index == None:
+        tar_files = catalog.get_range(self.begin, self.end)
+        if not tar_files:
             print("No data for the selected date range")
             return
 
-        for i in range(begin_index, end_index + 1):
-            for j in dates[keys[i]]:
-                tar_files.append(j)
-
         return tar_files
 
     def extract_tar_files(self, files=None):
@@ -151,33 +102,265 @@ class UnPack:
         if not self.quiet:
             print('\n{} files will be extracted from: \n {}\n and will be staged in: \n {}'.format(len(files), self.archive_path, self.stage_path))
 
-        # cd to the stage dir
+        # Make sure the stage dir exists
         if not os.path.exists(self.stage_path):
             os.makedirs(self.stage_path)
-        os.chdir(self.stage_path)
+
+        untars = [UnTarFiles(self, f) for f in files]
 
         # Setup the progress bar
         pbar = UI()
-        length = len(files)
-        for i,f in enumerate(files):
-            # Set initial percentage
-            percent = int((i / float(length)) * 100)
-            untar = UnTarFiles(self, f)
-            untar.start()
-            while untar.is_alive():
-                # Update percentage
+        length = len(untars)
+        pbar.progress(0)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Read the member lists of all of the tar files
+            for untar in pool.map(UnTarFiles.get_members, untars):
+                pass
+
+            # Members are placed in tar order so collisions are
+            #  resolved the same way regardless of the number of workers
+            for untar in untars:
+                untar.place_members()
+
+            # Extract the tar files, updating the progress as each one completes
+            jobs = [pool.submit(untar.extract) for untar in untars]
+            for i,job in enumerate(as_completed(jobs)):
+                job.result()
+                percent = int((float(i + 1) / float(length)) * 100)
                 pbar.progress(percent)
 
-            # Make sure percentage reaches 100
-            percent = int((float(i + 1) / float(length)) * 100)
-            pbar.progress(percent)
+        # Colliding members are compared in tar order once all of the
+        #  first members have been unpacked
+        self.hash_first_members(untars)
+        for untar in untars:
+            untar.resolve_duplicates()
 
+        for untar in untars:
+            self.bytes_read['extract'] += os.path.getsize(untar.path)
 
         # Go to the next line in the console
         print("")
+        self.print_skipped()
 
         os.chdir(self.cwd)
 
+    def hash_first_members(self, untars):
+        """ Hash the first members of the collisions that were not hashed as they were written, in one batch """
+        f = Files(self.config)
+        paths = {}
+        for untar in untars:
+            for m in untar.collisions:
+                first = self.first_names[self.get_placed_name(m.name, f)]
+                if first not in self.hashes:
+                    paths[dir_pattern().format(self.stage_path, first)] = first
+
+        for path, value in f.get_hashes(paths):
+            if value != None:
+                self.hashes[paths[path]] = (value.hex(), os.path.getsize(path))
+
+    def get_member_time(self, name):
+        """ Return the timestamp in an ARM file name or None if it does not have one """
+        temp = os.path.basename(name).split('.')
+        if len(temp) < 4:
+            return
+
+        date = temp[2]
+        if len(date) == 6:
+            date = "19%s" % date
+        stamp = temp[3]
+
+        if len(date) != 8 or len(stamp) != 6 or not date.isdigit() or not stamp.isdigit():
+            return
+
+        try:
+            return calendar.timegm(time.strptime(date + stamp, '%Y%m%d%H%M%S'))
+        except ValueError:
+            return
+
+    def skip_member(self, member):
+        """ Return True if the member is outside the extraction window """
+        if self.window == None or not member.isfile():
+            return False
+
+        timestamp = self.get_member_time(member.name)
+        if timestamp == None or self.window[0] <= timestamp < self.window[1]:
+            return False
+
+        self.skipped['members'] += 1
+        self.skipped['bytes'] += member.size
+        return True
+
+    def print_skipped(self):
+        """ Report the members left out by the extraction window """
+        if self.window != None and not self.quiet:
+            print("Skipped {members} members ({bytes} bytes) outside the date range".format(**self.skipped))
+
+    def get_placed_name(self, name, f):
+        """ Return the name a member will have once it is unpacked """
+        sn, move = f.strip_name(name)
+        if sn == None:
+            sn = name
+
+        return sn
+
+    def place_member(self, name, f):
+        """
+            Return the number of members placed before this one with the same name
+            0 is unpacked, N > 0 collides with the first member
+        """
+        sn = self.get_placed_name(name, f)
+
+        level = self.placed.get(sn, 0)
+        self.placed[sn] = level + 1
+
+        if level == 0:
+            self.first_names[sn] = name
+        else:
+            key = self.first_names[sn]
+            if key not in self.duplicates:
+                self.duplicates[key] = []
+            self.duplicates[key].append(name)
+
+        return level
+
+    def stream_tar_files(self, files, backup, snapshot):
+        """
+            Read each tar file once and feed the backup copy, the stage dir
+            and the raw snapshot from the same buffers
+        """
+        if not self.quiet:
+            print('\n{} files will be streamed from: \n {}\n and will be staged in: \n {}'.format(len(files), self.archive_path, self.stage_path))
+
+        for i in [self.stage_path, backup, snapshot]:
+            if not os.path.exists(i):
+                os.makedirs(i)
+
+        f = Files(self.config)
+        pbar = UI()
+        length = len(files)
+        pbar.progress(0)
+
+        for k,v in enumerate(files):
+            src = dir_pattern().format(self.archive_path, v)
+            dst = dir_pattern().format(backup, v)
+
+            fsrc = open(src, 'rb')
+            fdst = open(dst, 'wb')
+            reader = TeeReader(fsrc, [fdst])
+
+            tar = tarfile.open(fileobj=reader, mode='r|')
+            for m in tar:
+                if self.skip_member(m):
+                    continue
+
+                level = self.place_member(m.name, f)
+                roots = [self.stage_path, snapshot]
+
+                if level > 0:
+                    if m.isfile():
+                        first = self.first_names[self.get_placed_name(m.name, f)]
+                        self.resolve_duplicate(first, m, tar.extractfile(m), roots)
+                elif m.isfile():
+                    self.write_member(m, tar.extractfile(m), roots)
+                else:
+                    # Directories and links carry no data
+                    for root in roots:
+                        tar.extract(m, path=root)
+
+            # Copy the end of archive blocks to the backup
+            while len(reader.read(BLOCKSIZE)) > 0:
+                pass
+
+            tar.close()
+            fsrc.close()
+            fdst.close()
+            shutil.copymode(src, dst)
+
+            self.bytes_read['backup'] += reader.bytes
+
+            percent = int((float(k + 1) / float(length)) * 100)
+            pbar.progress(percent)
+
+        # Go to the next line in the console
+        print("")
+        self.print_skipped()
+
+    def write_member(self, member, data, roots, name=None):
+        """ Write the data of a member to each root, recording its digest and size """
+        if name == None:
+            name = member.name
+
+        outputs = []
+        for root in roots:
+            path = dir_pattern().format(root, name)
+            # Other workers may be creating the same directory
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            outputs.append(open(path, 'wb'))
+
+        h = digest.new(self.algorithm)
+        size = 0
+        buf = data.read(BLOCKSIZE)
+        while len(buf) > 0:
+            h.update(buf)
+            size += len(buf)
+            for out in outputs:
+                out.write(buf)
+            buf = data.read(BLOCKSIZE)
+
+        for out in outputs:
+            out.close()
+            os.chmod(out.name, member.mode)
+            os.utime(out.name, (member.mtime, member.mtime))
+            self.cache_hash(out.name, h.digest())
+
+        self.hashes[name] = (h.hexdigest(), size)
+
+    def cache_hash(self, path, value):
+        """ Add the digest of a file that was just written to the digest cache of the job """
+        if self.cache != None:
+            self.cache.put(os.stat(path), value, self.algorithm)
+
+    def resolve_duplicate(self, first, member, data, roots):
+        """
+            Compare a colliding member with the first member of the same name
+            Identical members are dropped without being written, others are
+            written as .vN files and the first member is renamed to .v1
+            Return the name written or None
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOLSIZE)
+        h = digest.new(self.algorithm)
+        buf = data.read(BLOCKSIZE)
+        while len(buf) > 0:
+            h.update(buf)
+            spool.write(buf)
+            buf = data.read(BLOCKSIZE)
+
+        name = first if first not in self.versions else self.versions[first][0]
+        if name not in self.hashes:
+            path = dir_pattern().format(roots[0], name)
+            self.hashes[name] = (Files(self.config).get_hash(path).hex(), os.path.getsize(path))
+
+        if h.hexdigest() == self.hashes[name][0]:
+            spool.close()
+            return
+
+        if first not in self.versions:
+            name = '{}.v1'.format(first)
+            self.versions[first] = [name]
+            self.hashes[name] = self.hashes.pop(first)
+            for root in roots:
+                os.rename(dir_pattern().format(root, first), dir_pattern().format(root, name))
+
+        name = '{}.v{}'.format(member.name, len(self.versions[first]) + 1)
+        self.versions[first].append(name)
+
+        spool.seek(0)
+        self.write_member(member, spool, roots, name=name)
+        spool.close()
+
+        return name
+
     def copy_files(self, files, dest):
         """ Copy the specified array of files to the destination directory """
         # If files is a string make it an array with the string in it
@@ -192,6 +375,9 @@ class UnPack:
         if not os.path.isdir(dest):
             return False
 
+        # The tar files are never changed so the backup may share their inodes
+        m = Materializer(self.config['materialize'], readonly=True)
+
         print("Copying %d tar files to %s" % (len(files), dest))
         pbar = UI()
         length = len(files)
@@ -199,7 +385,10 @@ class UnPack:
         pbar.progress(percent)
         # Copy each file in files to dest show progress on screen
         for k,v in enumerate(files):
-            shutil.copy(v, dest)
+            if not os.path.isabs(v):
+                v = dir_pattern().format(self.archive_path, v)
+            if m.materialize(v, dest) == 'copy':
+                self.bytes_read['backup'] += os.path.getsize(v)
             percent = int((float(k + 1) / float(length)) * 100)
             pbar.progress(percent)
 
@@ -208,69 +397,39 @@ class UnPack:
 
 
     def handle_duplicate_files(self):
-        # Handle duplicates
-        f = Files(self.config)
-        dup_list = {}
+        """
+            Return the collisions that were written as .vN files
+            keyed by the first file name, or False if there were none
+        """
         duplicates = {}
 
-        files = self.file_names
-        dups = self.duplicates
-
-        if len(dups) > 0:
-            for i,n in dups.items():
-                for j,v in enumerate(n):
-                    folder = 'dup_{}'.format(j + 1)
-                    delete = False
-                    move = False
-                    if f.is_same_file(dir_pattern().format(self.stage_path, i), dir_pattern(3).format(self.stage_path, folder, v)):
-                        delete = True
-                        move = False
-                    else:
-                        delete = False
-                        move = True
-
-                    if delete:
-                        os.remove(dir_pattern(3).format(self.stage_path, folder, v))
-                    elif move:
-                        if i not in dup_list:
-                            name = '{}.v1'.format(i)
-                            dup_list[i] = [name]
-                            src = dir_pattern().format(self.stage_path, i)
-                            dst = dir_pattern().format(self.stage_path, name)
-                            try:
-                                os.rename(src, dst)
-                            except OSError:
-                                shutil.move(src, dst)
-
-                        num = len(dup_list[i]) + 1
-                        name = '{}.v{}'.format(v, num)
-                        dup_list[i].append(name)
-                        src = dir_pattern(3).format(self.stage_path, folder, v)
-                        dst = dir_pattern().format(self.stage_path, name)
-                        try:
-                            os.rename(src, dst)
-                        except OSError:
-                            shutil.move(src, dst)
-
-            for i in dup_list:
-                if len(dup_list[i]) > 1:
-                    key = dir_pattern().format(self.local, i)
-                    duplicates[key] = []
-                    for j in dup_list[i]:
-                        duplicates[key].append(dir_pattern().format(self.local, j))
-
-            self.dups = duplicates
-
-            # Delete directory if now empty
-            dupdirs = glob('{}/dup_*'.format(self.stage_path))
-            for i in dupdirs:
-                f.empty_dir(i)
-                os.rmdir(i)
+        for i in self.versions:
+            key = dir_pattern().format(self.local, i)
+            duplicates[key] = []
+            for j in self.versions[i]:
+                duplicates[key].append(dir_pattern().format(self.local, j))
+
+        self.dups = duplicates
 
         return False if duplicates == {} else duplicates
 
 
 
+class TeeReader:
+    """ Read from a file object, copying everything read to the outputs """
+
+    def __init__(self, fileobj, outputs):
+        self.fileobj = fileobj
+        self.outputs = outputs
+        self.bytes = 0
+
+    def read(self, size=-1):
+        buf = self.fileobj.read(size)
+        for out in self.outputs:
+            out.write(buf)
+        self.bytes += len(buf)
+        return buf
+
 ################################################################################
 # Multi threading
 ################################################################################
@@ -283,96 +442,109 @@ class UnTarFiles(threading.Thread):
         self.config = self.tar.config
         temp = self.tar.stage_path
         self.local = dir_pattern().format(temp[-2], temp[-1])
+        self.path = dir_pattern().format(self.tar.archive_path, self.file)
+        self.members = None
+        self.files = []
+        self.collisions = []
+        self.fast = False
         threading.Thread.__init__(self)
 
     def run(self):
         """ Unpack the tar file """
-        # Setup Vars
-        st_files = self.tar.st_files
-        file_names = self.tar.file_names
-        # files = self.tar.members
-        # temp = self.config['']
+        self.get_members()
+        self.place_members()
+        self.extract()
+        self.resolve_duplicates()
 
-        files = []
-        for i in range(len(st_files)):
-            files.append([])
+        return
 
-        # Open the tar file
-        tar = tarfile.open(dir_pattern().format(self.tar.archive_path, self.file), 'r')
+    def get_members(self):
+        """ Read the list of members from the tar file """
+        # Use the fast reader unless the tar file needs tarfile
+        try:
+            with FastTar(self.path) as tar:
+                self.members = tar.getmembers()
+            self.fast = True
+            return self
+        except FastTarError:
+            self.fast = False
+
+        tar = tarfile.open(self.path, 'r')
+        self.members = tar.getmembers()
+        tar.close()
 
-        # Get the content of the tar file and check for duplicate file names
-        members = tar.getmembers()
+        return self
 
+    def open(self):
+        """ Open the tar file with the reader the members were listed with """
+        if self.fast:
+            return FastTar(self.path)
+
+        return tarfile.open(self.path, 'r')
+
+    def place_members(self):
+        """ Sort the members into those that are unpacked and those that collide with an earlier member """
+        files = []
+        collisions = []
         f = Files(self.config)
 
-        # Iterate over each tar file
-        for i,m in enumerate(members):
-
-            # Make sure arrays are not 0 length
-            if len(file_names) == 0:
-                file_names.append([])
-            if len(files) == 0:
-                files.append([])
-            if len(st_files) == 0:
-                st_files.append([])
-
-            # Iterate over each entry in file_names
-            # Add the file name to the correct array
-            for k,v in enumerate(file_names):
-                sf_names = st_files[k]
-                sn = f.strip_name(m.name)
-                if sn == None or sn == 'orig' or sn == 'bad':
-                    sn = m.name
-
-                if not (m.name in v or sn in sf_names):
-                    file_names[k].append(m.name)
-                    files[k].append(m)
-                    st_files[k].append(sn)
-                    break
-
-            else:
-                file_names.append([m.name])
-                files.append([m])
-                st_files.append([sn])
+        for m in self.members:
+            if self.tar.skip_member(m):
+                continue
 
-        duplicates = {}
-        stripped = st_files[0]
-        full_names = file_names[0]
-
-        for i in range(1, len(file_names)):
-            for k,v in enumerate(file_names[i]):
-                try:
-                    myIndex = stripped.index(st_files[i][k])
-                except IndexError:
-                    pass
-                    print("\nOOPS\n")
-                    print("\nI: {}\nK: {}".format(i, k))
-                try:
-                    key = full_names[myIndex]
-                except IndexError:
-                    pass
-                    print("\nOOPS 2\n")
-
-                if key not in duplicates:
-                    duplicates[key] = []
-                duplicates[key].append(v)
-
-        # Extract all files
-        for i in range(len(files)):
-            path = None
-            if i > 0:
-                path = 'dup_{}'.format(i)
-            else:
-                path = ''
-
-            tar.extractall(path=path, members=files[i])
+            if self.tar.place_member(m.name, f) == 0:
+                files.append(m)
+            elif m.isfile():
+                collisions.append(m)
 
-        tar.close()
+        self.files = files
+        self.collisions = collisions
+
+    def extract(self):
+        """ Extract the placed members """
+        tar = self.open()
+
+        if self.fast:
+            # Files are hashed from the mapped tar file and copied by the kernel
+            for m in self.files:
+                if m.isfile():
+                    h = digest.new(self.tar.algorithm)
+                    tar.extract(m, dir_pattern().format(self.tar.stage_path, m.name), h)
+                    self.tar.hashes[m.name] = (h.hexdigest(), m.size)
+                    self.tar.cache_hash(dir_pattern().format(self.tar.stage_path, m.name), h.digest())
+
+            for m in self.files:
+                if m.isdir():
+                    tar.extract(m, dir_pattern().format(self.tar.stage_path, m.name))
+
+            tar.close()
+            return
 
-        self.tar.duplicates = duplicates
+        # Files are hashed as they are written, directories and links are extracted after them
+        for m in self.files:
+            if m.isfile():
+                self.tar.write_member(m, tar.extractfile(m), [self.tar.stage_path])
+
+        tar.extractall(path=self.tar.stage_path, members=[m for m in self.files if not m.isfile()])
+
+        tar.close()
 
         return
 
+    def resolve_duplicates(self):
+        """ Compare the colliding members with the first members, in tar order """
+        if len(self.collisions) == 0:
+            return
+
+        tar = self.open()
+        f = Files(self.config)
+
+        for m in self.collisions:
+            first = self.tar.first_names[self.tar.get_placed_name(m.name, f)]
+            self.tar.resolve_duplicate(first, m, tar.extractfile(m), [self.tar.stage_path])
+
+        tar.close()
+
 ################################################################################
 # Unit tests
 ################################################################################
@@ -421,6 +593,173 @@ class TestExtractTarFiles(unittest.TestCase):
         """ Pass empty list """
         pass
 
+################################################################################
+# Place Member
+################################################################################
+class TestPlaceMember(unittest.TestCase):
+    def setUp(self):
+        from apm.classes import test
+        self.config = test.config()
+        self.tar = UnPack(self.config, 'sgp/sgpmfrsrC1.00', 'sgp/sgpmfrsrC1.00')
+        self.file = Files(self.config)
+
+    def test_1(self):
+        """ Pass names that strip to the same name -> later names are duplicates of the first """
+        names = [
+            'sgpmfrsrC1.00.20140501.000000.raw.20140501_000000.dat',
+            'sgpmfrsrC1.00.20140501.010000.raw.20140501_000000.dat',
+            'sgpmfrsrC1.00.20140501.020000.raw.20140501_000000.dat',
+        ]
+        result = [self.tar.place_member(i, self.file) for i in names]
+        expected = [0, 1, 2]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert self.tar.duplicates == {names[0]: names[1:]}
+
+    def test_2(self):
+        """ Pass names that do not collide -> no duplicates """
+        names = [
+            'sgpmfrsrC1.00.20140501.000000.raw.20140501_000000.dat',
+            'sgpmfrsrC1.00.20140501.000000.raw.20140501_010000.dat',
+            'README',
+        ]
+        result = [self.tar.place_member(i, self.file) for i in names]
+        expected = [0, 0, 0]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert self.tar.duplicates == {}
+
+################################################################################
+# Skip Member
+################################################################################
+class TestSkipMember(unittest.TestCase):
+    def setUp(self):
+        from apm.classes import test
+        self.config = test.config()
+        self.config['member_padding'] = 2
+
+    def get_member(self, name, size=10):
+        member = tarfile.TarInfo(name)
+        member.size = size
+        return member
+
+    def test_1(self):
+        """ Pass members around the date range -> members outside the padding are skipped """
+        tar = UnPack(self.config, 'sgp/sgpmfrsrC1.00', 'sgp/sgpmfrsrC1.00')
+        names = [
+            'sgpmfrsrC1.00.20140430.210000.raw.dat',
+            'sgpmfrsrC1.00.20140430.230000.raw.dat',
+            'sgpmfrsrC1.00.20140503.120000.raw.dat',
+            'sgpmfrsrC1.00.20140508.015959.raw.dat',
+            'sgpmfrsrC1.00.20140508.020000.raw.dat',
+        ]
+        result = [tar.skip_member(self.get_member(i)) for i in names]
+        expected = [True, False, False, False, True]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert tar.skipped == {'members': 2, 'bytes': 20}
+
+    def test_2(self):
+        """ Pass members without a timestamp -> nothing is skipped """
+        tar = UnPack(self.config, 'sgp/sgpmfrsrC1.00', 'sgp/sgpmfrsrC1.00')
+        names = ['README', 'sgpmfrsrC1.00.raw.dat', 'sgpmfrsrC1.00.20140601.dat']
+        result = [tar.skip_member(self.get_member(i)) for i in names]
+        expected = [False, False, False]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ Pass no padding -> nothing is skipped """
+        self.config['member_padding'] = None
+        tar = UnPack(self.config, 'sgp/sgpmfrsrC1.00', 'sgp/sgpmfrsrC1.00')
+        result = tar.skip_member(self.get_member('sgpmfrsrC1.00.20100101.000000.raw.dat'))
+        expected = False
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+# Tee Reader
+################################################################################
+class TestTeeReader(unittest.TestCase):
+    def test_1(self):
+        """ Read in chunks -> outputs receive every byte read """
+        import io
+        source = io.BytesIO(b'0123456789' * 10)
+        outputs = [io.BytesIO(), io.BytesIO()]
+        reader = TeeReader(source, outputs)
+        while len(reader.read(7)) > 0:
+            pass
+
+        result = [i.getvalue() for i in outputs] + [reader.bytes]
+        expected = [b'0123456789' * 10, b'0123456789' * 10, 100]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+# Resolve Duplicate
+################################################################################
+class TestResolveDuplicate(unittest.TestCase):
+    def setUp(self):
+        import io
+        from apm.classes import test
+        self.io = io
+        self.config = test.config()
+        self.config['stage'] = tempfile.mkdtemp()
+        self.tar = UnPack(self.config, 'sgp/sgpmfrsrC1.00', 'sgp/sgpmfrsrC1.00')
+        self.first = 'sgpmfrsrC1.00.20140501.000000.raw.20140501_000000.dat'
+
+        member = tarfile.TarInfo(self.first)
+        member.mtime = 1400000000
+        self.tar.write_member(member, io.BytesIO(b'first'), [self.tar.stage_path])
+
+    def tearDown(self):
+        shutil.rmtree(self.config['stage'])
+
+    def get_member(self, name):
+        member = tarfile.TarInfo(name)
+        member.mtime = 1400000000
+        return member
+
+    def test_1(self):
+        """ Pass an identical member -> nothing is written """
+        name = 'sgpmfrsrC1.00.20140501.010000.raw.20140501_000000.dat'
+        result = self.tar.resolve_duplicate(self.first, self.get_member(name), self.io.BytesIO(b'first'), [self.tar.stage_path])
+        expected = None
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert os.listdir(self.tar.stage_path) == [self.first]
+        assert self.tar.handle_duplicate_files() == False
+
+    def test_2(self):
+        """ Pass different members -> first is renamed to .v1 and the others are written as .vN """
+        names = [
+            'sgpmfrsrC1.00.20140501.010000.raw.20140501_000000.dat',
+            'sgpmfrsrC1.00.20140501.020000.raw.20140501_000000.dat',
+        ]
+        for i,name in enumerate(names):
+            data = self.io.BytesIO('second {}'.format(i).encode())
+            self.tar.resolve_duplicate(self.first, self.get_member(name), data, [self.tar.stage_path])
+
+        result = self.tar.handle_duplicate_files()
+        expected = {
+            'sgp/sgpmfrsrC1.00/{}'.format(self.first): [
+                'sgp/sgpmfrsrC1.00/{}.v1'.format(self.first),
+                'sgp/sgpmfrsrC1.00/{}.v2'.format(names[0]),
+                'sgp/sgpmfrsrC1.00/{}.v3'.format(names[1]),
+            ]
+        }
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+        assert sorted(os.listdir(self.tar.stage_path)) == sorted(i.split('/')[-1] for i in expected['sgp/sgpmfrsrC1.00/{}'.format(self.first)])
+
 ################################################################################
 # Handle Duplicate Files
 ################################################################################
@@ -0,0 +1,522 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import sys
+import json
+import time
+import errno
+import struct
+import select
+import ctypes
+import signal
+import threading
+import subprocess
+
+import unittest
+import tempfile
+import shutil
+
+from apm.classes.trash import is_running
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT = struct.Struct('iIII')
+
+# Seconds between heartbeats, a reader waits up to SYNC_TIMEOUT for the watcher to catch up
+BEAT = 0.2
+SYNC_TIMEOUT = 2.0
+
+# Seconds between writes of the listings while they keep changing
+STATE_INTERVAL = 1.0
+
+# inotify only sees the changes made by this host on these
+UNSUPPORTED_FS = ['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'lustre', 'gpfs', 'ceph', 'panfs', 'afs', 'fuse.sshfs']
+
+TREES = ['collection']
+
+class Inotify:
+    """ Minimal inotify binding through the C library """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """
+            Wait up to timeout for events and read all of the queued ones
+            Return (events, time), every event queued before time is in events
+        """
+        select.select([self.fd], [], [], timeout)
+        now = time.time()
+
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+        return events, now
+
+    def close(self):
+        os.close(self.fd)
+
+def get_fs_type(path):
+    """ Return the type of the filesystem path is on, None if it can not be found """
+    path = os.path.realpath(path)
+    best = ''
+    fs_type = None
+    try:
+        fp = open('/proc/mounts', 'r')
+        mounts = fp.readlines()
+        fp.close()
+    except OSError:
+        return None
+
+    for line in mounts:
+        parts = line.split()
+        if len(parts) < 3:
+            continue
+
+        mount = parts[1].replace('\\040', ' ')
+        if (path == mount or path.startswith(mount.rstrip('/') + '/')) and len(mount) >= len(best):
+            best = mount
+            fs_type = parts[2]
+
+    return fs_type
+
+def is_supported(path):
+    """ Return (supported, reason) for watching path with inotify """
+    if not sys.platform.startswith('linux'):
+        return False, 'inotify is only available on Linux'
+
+    fs_type = get_fs_type(path)
+    if fs_type in UNSUPPORTED_FS:
+        return False, '{} is on {}, changes made by other hosts are not seen'.format(path, fs_type)
+
+    try:
+        Inotify().close()
+    except OSError as e:
+        return False, str(e)
+
+    return True, None
+
+def read_json(path):
+    try:
+        fp = open(path, 'r')
+        data = json.loads(fp.read())
+        fp.close()
+    except (OSError, ValueError):
+        return None
+
+    return data
+
+def write_json(path, data):
+    temp = '{}.tmp'.format(path)
+    fp = open(temp, 'w')
+    fp.write(json.dumps(data, separators=(',', ':')))
+    fp.close()
+    os.replace(temp, path)
+
+class Watcher:
+    """
+        Keep the listing of every directory under the collection directory
+        of a job from inotify events, and write them to <job>/.watch.json so
+        commands can read them instead of listing each directory
+        The listings are written at most every STATE_INTERVAL seconds, a
+        heartbeat is written to <job>/.watch.beat after every read of the
+        events with the time before which every change is in the written
+        listings
+    """
+
+    def __init__(self, job_dir, trees=TREES):
+        self.job_dir = job_dir
+        self.trees = trees
+        self.state_file = os.path.join(job_dir, '.watch.json')
+        self.beat_file = os.path.join(job_dir, '.watch.beat')
+
+        self.inotify = None
+        self.listings = {}
+        self.failed = {}
+        self.wds = {}
+        self.paths = {}
+        self.dirty = False
+        self.written = 0
+        self.synced = 0
+        self.stopped = threading.Event()
+
+    def add(self, relpath):
+        """ Watch a directory and everything under it, then list it """
+        path = os.path.join(self.job_dir, relpath)
+        try:
+            wd = self.inotify.add_watch(path)
+        except OSError as e:
+            # Out of watches or not readable, the tree is scanned by the commands instead
+            if e.errno != errno.ENOENT:
+                self.failed[relpath] = str(e)
+                self.dirty = True
+            return
+
+        self.wds[wd] = relpath
+        self.paths[relpath] = wd
+
+        # Listed after the watch is added so no change is missed
+        entries = {}
+        try:
+            with os.scandir(path) as listing:
+                for entry in listing:
+                    entries[entry.name] = entry.is_dir(follow_symlinks=False)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                self.failed[relpath] = str(e)
+
+        self.listings[relpath] = entries
+        self.dirty = True
+        for name, is_dir in entries.items():
+            if is_dir:
+                self.add('{}/{}'.format(relpath, name))
+
+    def drop(self, relpath):
+        """ Stop watching a directory and everything under it """
+        for i in list(self.failed):
+            if i == relpath or i.startswith(relpath + '/'):
+                self.failed.pop(i)
+                self.dirty = True
+
+        for i in list(self.paths):
+            if i == relpath or i.startswith(relpath + '/'):
+                wd = self.paths.pop(i)
+                self.wds.pop(wd, None)
+                self.listings.pop(i, None)
+                self.inotify.rm_watch(wd)
+                self.dirty = True
+
+    def rescan(self):
+        for root in self.trees:
+            self.drop(root)
+            self.add(root)
+
+    def handle(self, wd, mask, cookie, name):
+        if mask & IN_Q_OVERFLOW:
+            self.rescan()
+            return
+
+        relpath = self.wds.get(wd)
+        if relpath == None:
+            return
+
+        if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+            self.drop(relpath)
+            return
+
+        child = '{}/{}'.format(relpath, name)
+        if mask & (IN_CREATE | IN_MOVED_TO):
+            is_dir = (mask & IN_ISDIR) != 0
+            self.listings[relpath][name] = is_dir
+            if is_dir:
+                self.add(child)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.listings[relpath].pop(name, None)
+            self.drop(child)
+
+        self.dirty = True
+
+    def write_state(self):
+        listings = {}
+        for relpath, entries in self.listings.items():
+            listings[relpath] = {
+                'f': sorted(k for k, v in entries.items() if not v),
+                'd': sorted(k for k, v in entries.items() if v),
+            }
+
+        write_json(self.state_file, {'pid': os.getpid(), 'listings': listings, 'failed': self.failed})
+        self.written = time.time()
+        self.dirty = False
+
+    def run(self):
+        """ Follow the events until stop() is called or the process is terminated """
+        self.inotify = Inotify()
+        try:
+            for root in self.trees:
+                self.add(root)
+
+            while not self.stopped.is_set():
+                events, now = self.inotify.read(BEAT)
+                for event in events:
+                    self.handle(*event)
+
+                # Cleanup replaces the directories, watch the new ones
+                for root in self.trees:
+                    if root not in self.paths and os.path.isdir(os.path.join(self.job_dir, root)):
+                        self.add(root)
+
+                if self.dirty and now - self.written >= STATE_INTERVAL:
+                    self.write_state()
+
+                # While the changes are not written the readers wait for the next write
+                if not self.dirty:
+                    self.synced = now
+
+                write_json(self.beat_file, {'pid': os.getpid(), 'time': self.synced})
+
+        finally:
+            self.inotify.close()
+            for i in [self.beat_file, self.state_file]:
+                if os.path.exists(i):
+                    os.remove(i)
+
+    def stop(self):
+        self.stopped.set()
+
+def get_status(job_dir):
+    """ Return the heartbeat of the watcher of a job, None if none is running """
+    beat = read_json(os.path.join(job_dir, '.watch.beat'))
+    if beat == None or not is_running(beat.get('pid')):
+        return None
+
+    return beat
+
+def start(job_dir):
+    """ Start a watcher for a job in a background process, return its pid """
+    beat = get_status(job_dir)
+    if beat != None:
+        return beat['pid']
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    code = 'import sys; sys.path.insert(0, {!r}); from apm.classes.watcher import Watcher; Watcher({!r}).run()'.format(root, os.path.abspath(job_dir))
+    process = subprocess.Popen(
+        [sys.executable, '-c', code],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+    return process.pid
+
+def stop(job_dir):
+    """ Stop the watcher of a job, return its pid or None if none was running """
+    beat = get_status(job_dir)
+    if beat == None:
+        return None
+
+    os.kill(beat['pid'], signal.SIGTERM)
+    for i in ['.watch.beat', '.watch.json']:
+        path = os.path.join(job_dir, i)
+        if os.path.exists(path):
+            os.remove(path)
+
+    return beat['pid']
+
+class WatchedTree:
+    """ Read only listings of a watched tree, with the listdir and isdir of DirTree """
+
+    def __init__(self, listings, tree):
+        self.listings = listings
+        self.tree = tree
+
+    def get_listing(self, relpath):
+        relpath = relpath.strip('/')
+        key = '{}/{}'.format(self.tree, relpath) if relpath else self.tree
+        if key not in self.listings:
+            raise FileNotFoundError(2, 'No such directory', key)
+
+        return self.listings[key]
+
+    def listdir(self, relpath=''):
+        listing = self.get_listing(relpath)
+        return listing['d'] + listing['f']
+
+    def isdir(self, relpath):
+        parent, name = os.path.split(relpath.strip('/'))
+        try:
+            return name in self.get_listing(parent)['d']
+        except FileNotFoundError:
+            return False
+
+def open_tree(job_dir, tree, timeout=SYNC_TIMEOUT):
+    """
+        Return the listings of a watched tree once the watcher has seen every
+        change made before this call, None if no watcher is running, it
+        does not catch up in time or it could not watch part of the tree, so
+        the caller scans the tree instead
+    """
+    if get_status(job_dir) == None:
+        return None
+
+    start = time.time()
+    while True:
+        beat = read_json(os.path.join(job_dir, '.watch.beat'))
+        if beat != None and beat['time'] > start:
+            break
+        if time.time() - start > timeout:
+            return None
+        time.sleep(BEAT / 4)
+
+    state = read_json(os.path.join(job_dir, '.watch.json'))
+    if state == None or state.get('pid') != beat['pid'] or tree not in state['listings']:
+        return None
+
+    for i in state.get('failed', {}):
+        if i == tree or i.startswith(tree + '/'):
+            return None
+
+    return WatchedTree(state['listings'], tree)
+
+################################################################################
+# Unit tests
+################################################################################
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.dir = '{}/collection/sgp/sgpmfrsrC1.00'.format(self.path)
+        os.makedirs(self.dir)
+        for i in ['a.dat', 'b.dat']:
+            open('{}/{}'.format(self.dir, i), 'w').close()
+
+        self.watcher = Watcher(self.path)
+        self.thread = None
+
+    def tearDown(self):
+        if self.thread != None:
+            self.watcher.stop()
+            self.thread.join()
+        shutil.rmtree(self.path)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.watcher.run)
+        self.thread.start()
+        for i in range(50):
+            if get_status(self.path) != None:
+                break
+            time.sleep(BEAT / 4)
+
+    def test_1(self):
+        """ Change the collection while it is watched -> listings follow """
+        if not is_supported(self.path)[0]:
+            self.skipTest('inotify is not supported here')
+
+        self.start()
+
+        os.remove('{}/a.dat'.format(self.dir))
+        open('{}/c.dat'.format(self.dir), 'w').close()
+        os.makedirs('{}/other_files/old'.format(self.dir))
+        tree = open_tree(self.path, 'collection')
+
+        result = [tree.listdir('sgp/sgpmfrsrC1.00'), tree.isdir('sgp/sgpmfrsrC1.00/other_files'), tree.listdir('sgp/sgpmfrsrC1.00/other_files')]
+        expected = [['other_files', 'b.dat', 'c.dat'], True, ['old']]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_2(self):
+        """ Replace the collection while it is watched -> new directory is listed """
+        if not is_supported(self.path)[0]:
+            self.skipTest('inotify is not supported here')
+
+        self.start()
+
+        os.rename('{}/collection'.format(self.path), '{}/old'.format(self.path))
+        os.mkdir('{}/collection'.format(self.path))
+        time.sleep(BEAT * 2)
+        tree = open_tree(self.path, 'collection')
+
+        result = [tree.listdir(), tree.isdir('sgp')]
+        expected = [[], False]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_3(self):
+        """ Open a tree with no watcher running -> None so the caller scans """
+        result = open_tree(self.path, 'collection')
+        expected = None
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_4(self):
+        """ Run out of watches for a directory -> failure recorded and the tree is scanned instead """
+        class Full:
+            def add_watch(inotify, path):
+                if path.endswith('sgpmfrsrC1.00'):
+                    raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), path)
+                return len(path)
+
+        self.watcher.inotify = Full()
+        self.watcher.add('collection')
+        self.watcher.write_state()
+        write_json('{}/.watch.beat'.format(self.path), {'pid': os.getpid(), 'time': time.time() + 60})
+
+        result = [sorted(self.watcher.failed), open_tree(self.path, 'collection')]
+        expected = [['collection/sgp/sgpmfrsrC1.00'], None]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+    def test_5(self):
+        """ Keep changing the collection while it is watched -> listings written at most every STATE_INTERVAL and still seen """
+        if not is_supported(self.path)[0]:
+            self.skipTest('inotify is not supported here')
+
+        writes = []
+        write_state = self.watcher.write_state
+        def count():
+            writes.append(time.time())
+            write_state()
+
+        self.watcher.write_state = count
+        self.start()
+
+        for i in range(20):
+            open('{}/{}.dat'.format(self.dir, i), 'w').close()
+            time.sleep(BEAT / 2)
+
+        tree = open_tree(self.path, 'collection')
+        gaps = [j - i for i, j in zip(writes, writes[1:])]
+
+        result = [len(tree.listdir('sgp/sgpmfrsrC1.00')), min(gaps) >= STATE_INTERVAL]
+        expected = [22, True]
+
+        print("Result:   {}\nExpected: {}".format(result, expected))
+        assert result == expected
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main(buffer=True)
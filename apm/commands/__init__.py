@@ -5,11 +5,40 @@ __version__ = '1.0'
 __author__ = 'Thom Williams'
 __copyright__ = 'Copyright 2014 PNNL'
 
-from .stage import Stage
-from .rename import Rename
-from .process import Process
-from .review import Review
-from .remove import Remove
-from .archive import Archive
-from .cleanup import Cleanup
-from .demo import Demo
+from .. import load_lazy
+
+# Imported the first time they are used: {name: (module, attribute or None)}
+LAZY = {
+    'Stage': ('apm.commands.stage', 'Stage'),
+    'Rename': ('apm.commands.rename', 'Rename'),
+    'Process': ('apm.commands.process', 'Process'),
+    'Review': ('apm.commands.review', 'Review'),
+    'Remove': ('apm.commands.remove', 'Remove'),
+    'Archive': ('apm.commands.archive', 'Archive'),
+    'Cleanup': ('apm.commands.cleanup', 'Cleanup'),
+    'Demo': ('apm.commands.demo', 'Demo'),
+    'Auto': ('apm.commands.auto', 'Auto'),
+}
+
+# The class that runs each command given to apm
+COMMANDS = {
+    'stage': 'Stage',
+    'rename': 'Rename',
+    'process': 'Process',
+    'review': 'Review',
+    'remove': 'Remove',
+    'archive': 'Archive',
+    'cleanup': 'Cleanup',
+    'prep': 'Demo',
+    'auto': 'Auto',
+}
+
+def get_command(command):
+    """ Import and return the class that runs a command """
+    return load_lazy(__name__, LAZY, COMMANDS[command])
+
+def __getattr__(name):
+    return load_lazy(__name__, LAZY, name)
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY))
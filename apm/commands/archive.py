@@ -86,13 +86,9 @@ class Archive:
 			############################################################
 			# Setup the datastreams to update
 			datastreams = []
-			datastream_path = dir_pattern(3).format(stage, job, 'datastream')
-			for site in os.listdir(datastream_path):
-				path = dir_pattern().format(datastream_path, site)
-				for folder in os.listdir(path):
-					abs_folder = dir_pattern().format(path,folder)
-					if os.path.isdir(abs_folder) and not os.path.islink(abs_folder):
-						datastreams.append(folder)
+			tree = Files(self.config).get_tree('datastream')
+			for site in tree.listdir():
+				datastreams.extend(tree.dirs(site))
 
 
 			# Update the local copy of the archive db
@@ -233,7 +229,6 @@ class Archive:
 
 
 			cwd = os.getcwd()
-			datastream = dir_pattern(3).format(stage, job, 'datastream')
 
 			# Load the list of tar files that need to be archived
 			os.chdir(dir_pattern().format(stage, job))
@@ -254,14 +249,14 @@ class Archive:
 			if len(contents) > 0:
 				del s,p,k,v
 
-			os.chdir(datastream)
-			sites = os.listdir(datastream)
-			for i,s in enumerate(sites):
-				os.chdir(s)
-				processes = os.listdir('.')
-				for j,p in enumerate(processes):
-					no_archive = dir_pattern(4).format(datastream, s, p, 'no_archive')
-					os.chdir(p)
+			os.chdir(cwd)
+
+			# Files are moved through the tree so its listings stay current
+			tree = Files(self.config).get_tree('datastream')
+			for s in tree.listdir():
+				for p in tree.listdir(s):
+					path = dir_pattern().format(s, p)
+					no_archive = dir_pattern(3).format(s, p, 'no_archive')
 
 					if p.split('.')[-1] == '00':
 						# This is a raw datastream
@@ -269,33 +264,29 @@ class Archive:
 
 						# Get a list of non-tar files from the raw datastreams
 						# Move all of these files to a sub-directory
-						rawfiles = [x for x in os.listdir('.') if not x.endswith('tar') if not os.path.isdir(x)]
+						rawfiles = [x for x in tree.files(path) if not x.endswith('tar')]
 
 						# Get a list of all tar files from the raw datastreams
 						# Retrieve the list of tar files that need to be archived
 						# Move all of the files not in the list to a sub-directory
-						tarfiles = [x for x in glob("*.tar") if not os.path.isdir(x)]
+						tarfiles = [x for x in tree.files(path) if x.endswith('.tar') and not x.startswith('.')]
 
 						for x in rawfiles:
-							if not os.path.exists(no_archive):
-								os.mkdir(no_archive)
-							elif not os.path.isdir(no_archive):
+							if not tree.exists(no_archive):
+								tree.mkdir(no_archive)
+							elif not tree.isdir(no_archive):
 								print("Failed")
 								print("There is a file called 'no_archive' in %s.")
 								print("This file must be removed before proceeding.")
 								self.config['exit'] = True
 								return self.config, self.files
 
-							src = dir_pattern(4).format(datastream, s, p, x)
-							try:
-								os.rename(src, no_archive)
-							except OSError:
-								shutil.move(src, no_archive)
+							tree.move(dir_pattern().format(path, x), no_archive)
 
 						for x in tarfiles:
-							if not os.path.exists(no_archive):
-								os.mkdir(no_archive)
-							elif not os.path.isdir(no_archive):
+							if not tree.exists(no_archive):
+								tree.mkdir(no_archive)
+							elif not tree.isdir(no_archive):
 								print("Failed")
 								print("There is a file called 'no_archive' in %s.")
 								print("This file must be removed before proceeding.")
@@ -303,19 +294,15 @@ class Archive:
 								return self.config, self.files
 
 							if s not in tar_archive or p not in tar_archive[s] or x not in tar_archive[s][p]:
-								src = dir_pattern(4).format(datastream, s, p, x)
-								try:
-									os.rename(src, no_archive)
-								except OSError:
-									shutil.move(src, no_archive)
+								tree.move(dir_pattern().format(path, x), no_archive)
 
 					else:
 						# For each processed datastream
 						# Get a list of all the files
 						# Move any files that fall outside the specified date range to a sub-directory
-						if not os.path.exists(no_archive):
-								os.mkdir(no_archive)
-						elif not os.path.isdir(no_archive):
+						if not tree.exists(no_archive):
+								tree.mkdir(no_archive)
+						elif not tree.isdir(no_archive):
 							print("Failed")
 							print("There is a file called 'no_archive' in %s.")
 							print("This file must be removed before proceeding.")
@@ -323,7 +310,7 @@ class Archive:
 							return self.config, self.files
 
 						# Don't include directories
-						files = [x for x in os.listdir('.') if not os.path.isdir(x)]
+						files = tree.files(path)
 
 						timeformat = "%Y%m%d"
 						begin = datetime.strptime(str(self.config['begin']), timeformat)
@@ -334,17 +321,9 @@ class Archive:
 							filedate = datetime.strptime(date, timeformat)
 
 							if not (filedate >= begin and filedate <= end):
-								src = dir_pattern(4).format(datastream, s, p, x)
-								try:
-									os.rename(src, no_archive)
-								except OSError:
-									shutil.move(src, no_archive)
+								tree.move(dir_pattern().format(path, x), no_archive)
 
 
-					os.chdir('..')
-				os.chdir('..')
-			os.chdir(cwd)
-
 			print("Done")
 			self.config['cleanup_status']['archive']['move_files'] = True
 		############################################################
@@ -0,0 +1,150 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import sys
+
+from apm.classes.files import Files
+from apm.classes.ledger import FileLedger
+from apm.classes.scheduler import Scheduler
+from apm.classes.system import dir_pattern
+
+from apm.commands.stage import Stage
+from apm.commands.rename import Rename
+
+class Auto:
+    """
+        Stage and rename the datastreams of a job as a graph of tasks
+        Each datastream is unpacked, copied to the raw snapshot and renamed in
+        that order, but a datastream is renamed as soon as it is staged instead
+        of waiting for the others
+    """
+
+    def __init__(self, config, files=None):
+        """ Initialize with args """
+        self.config = config
+        self.files = FileLedger.wrap(files)
+        self.rename = None
+        self.skipped = []
+
+    def run(self):
+        config = self.config
+
+        # An earlier run left files with naming collisions, they are checked before renaming
+        if config['duplicates']:
+            if config['vap']:
+                return config, self.files
+
+            return Rename(config, self.files).run()
+
+        if not config['ingest']:
+            return Stage(config, self.files).run()
+
+        if self.files == None:
+            self.files = FileLedger()
+
+        stage = Stage(config, self.files)
+        data_paths = stage.prepare(snapshot_each=True)
+        if data_paths == None:
+            return stage.config, self.files
+
+        config = self.config = stage.config
+        scheduler = self.get_scheduler(stage, data_paths)
+
+        try:
+            scheduler.run()
+        except BaseException:
+            # What was staged and renamed before the failure is kept, an unfinished rename is resumed by `apm rename`
+            print('\n{}'.format(scheduler.report()))
+            Files(config, self.files).save_filenames()
+            raise
+
+        stage.finish()
+
+        if self.rename != None:
+            self.rename.finish()
+        else:
+            Files(config, self.files).save_filenames()
+
+        if len(self.skipped) > 0:
+            print('The following datastreams had naming collisions and were not renamed:\n{}\n'.format('\n'.join(sorted(self.skipped))))
+
+        print(scheduler.report())
+        sys.stdout.flush()
+
+        return config, self.files
+
+    def get_scheduler(self, stage, data_paths):
+        """
+            Return the tasks of each datastream: stage, snapshot, rename
+            The raw snapshot is written while unpacking in stream mode
+        """
+        config = self.config
+        workers = max(1, int(config['stage_workers'] or 1))
+        stream = config['stage_mode'] == 'stream'
+
+        # One more worker than the datastreams staged at the same time so renames never wait on unpacking
+        scheduler = Scheduler(workers + 1, {'stage': workers})
+
+        # Data paths unpacked to the same directory are renamed together
+        staged = {}
+        for v in data_paths:
+            task = scheduler.add('stage {}'.format(v['output']), lambda v=v: stage.stage_data_path(config, v), resource='stage')
+            staged.setdefault(v['input'], []).append(task)
+
+        ready = {}
+        for path, tasks in staged.items():
+            if stream:
+                ready[path] = tasks
+            else:
+                ready[path] = [scheduler.add('snapshot {}'.format(path), lambda path=path: stage.snapshot_data_path(config, {'input': path}), tasks, resource='stage')]
+
+        self.rename = None
+        if not config['rename'] or config['vap']:
+            return scheduler
+
+        self.rename = Rename(config, self.files)
+        self.rename.lock = stage.lock
+
+        # A plugin that alters the collection before renaming needs all of it
+        barrier = []
+        if self.rename.manager.hasPluginCommand('hook_rename_preprocess'):
+            barrier = [j for i in ready.values() for j in i]
+        prepared = scheduler.add('prepare rename', self.rename.prepare, barrier)
+
+        renamed = []
+        for path, tasks in ready.items():
+            renamed.append(scheduler.add('rename {}'.format(path), lambda path=path: self.rename_data_path(stage, path), [prepared] + tasks))
+
+        # Directories no data path unpacked to, like the ones written by plugins
+        scheduler.add('rename others', lambda: self.rename_others(stage, list(staged)), renamed)
+
+        return scheduler
+
+    def rename_data_path(self, stage, path):
+        """ Strip the ARM prefix from the files of one staged directory, unless they had naming collisions """
+        config = self.config
+        if not os.path.isdir(dir_pattern(4).format(config['stage'], config['job'], 'collection', path)):
+            return
+
+        if stage.has_duplicates({'input': path}):
+            self.skipped.append(path)
+            return
+
+        site, ins = path.split('/')
+        conflicts = self.rename.rename_process(site, ins)
+        if len(conflicts) > 0:
+            exit("{}\n Please fix these conflicts and try again.".format('\n'.join(conflicts)))
+
+    def rename_others(self, stage, paths):
+        """ Rename the directories of the collection that are not in paths """
+        config = self.config
+        if not os.path.isdir(dir_pattern(3).format(config['stage'], config['job'], 'collection')):
+            return
+
+        tree = self.rename.tree
+        tree.invalidate()
+        for site in sorted(tree.listdir()):
+            for ins in sorted(tree.listdir(site)):
+                path = dir_pattern().format(site, ins)
+                if path not in paths:
+                    self.rename_data_path(stage, path)
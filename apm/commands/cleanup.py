@@ -55,13 +55,9 @@ class Cleanup:
             print("Updating local copy of the archive...",end="")
             # Setup the datastreams to update
             datastreams = []
-            datastream_path = dir_pattern(3).format(stage, job, 'datastream')
-            for site in os.listdir(datastream_path):
-                path = dir_pattern().format(datastream_path, site)
-                for folder in os.listdir(path):
-                    abs_folder = dir_pattern().format(path,folder)
-                    if os.path.isdir(abs_folder) and not os.path.islink(abs_folder):
-                        datastreams.append(folder)
+            tree = Files(self.config).get_tree('datastream')
+            for site in tree.listdir():
+                datastreams.extend(tree.dirs(site))
 
 
             # Update the local copy of the archive db
@@ -103,32 +99,22 @@ class Cleanup:
             fp.close()
             del fp
 
-            os.chdir(datastream_path)
-            for site in os.listdir('.'):
-                path = dir_pattern().format(datastream_path, site)
-                os.chdir(site)
-
-                for folder in os.listdir('.'):
-                    os.chdir(folder)
-
+            for site in tree.listdir():
+                for folder in tree.listdir(site):
                     args = (folder, start, end)
                     result = db.query(query % args, columns=cols)
 
-                    for f in os.listdir('.'):
-                        if not os.path.isdir(dir_pattern().format(os.getcwd(), f)):
-                            try:
-                                new_version = next(d['file_version'] for d in result if d['file_name'] == f)
-                                old_version = next(o['file_version'] for o in oArch[folder] if o['file_name'] == f)
-                                if not new_version > old_version:
-                                    print("Failed")
-                                    print("Not all files have been successfully archived. Please try again later.")
-                                    self.config['exit'] = True
-                                    return self.config, self.files
-                            except StopIteration:
-                                pass
-
-                    os.chdir('..')
-                os.chdir('..')
+                    for f in tree.files(dir_pattern().format(site, folder)):
+                        try:
+                            new_version = next(d['file_version'] for d in result if d['file_name'] == f)
+                            old_version = next(o['file_version'] for o in oArch[folder] if o['file_name'] == f)
+                            if not new_version > old_version:
+                                print("Failed")
+                                print("Not all files have been successfully archived. Please try again later.")
+                                self.config['exit'] = True
+                                return self.config, self.files
+                        except StopIteration:
+                            pass
 
             os.chdir(cwd)
             self.config['cleanup_status']['cleanup']['files_archived'] = True
@@ -155,15 +141,23 @@ class Cleanup:
                 '%s.deletion-list.txt' % job,
             ]
 
+            # Directories are renamed into the trash and deleted in the background
+            trash = f.get_trash()
             try:
                 for i in delete:
                     item = dir_pattern().format(path, i)
                     if os.path.exists(item):
                         if os.path.isdir(item):
-                            f.empty_dir(item)
+                            trash.empty(item)
                         elif os.path.isfile(item):
                             os.remove(item)
 
+                if not trash.is_empty():
+                    trash.start()
+
+                for i in ['datastream', 'collection']:
+                    f.get_tree(i).invalidate()
+
             except:
                 print("Failed")
                 print("Unable to cleanup all files. Please try again, or cleanup project manually.")
@@ -171,6 +165,8 @@ class Cleanup:
                 return self.config, self.files
 
             print("Done")
+            if not trash.is_empty():
+                print("Old files are being deleted in the background, run `apm -j {} trash` to follow the deletion.".format(job))
             self.config['cleanup_status']['cleanup']['files_cleaned_up'] = True
 
         self.config['cleanup_status']['cleanup']['status'] = True
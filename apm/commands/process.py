@@ -20,8 +20,10 @@ from subprocess import PIPE
 from subprocess import check_output
 
 from apm.classes.db import DB
+from apm.classes.ledger import FileLedger
 
 from apm.classes.system import dir_pattern
+from apm.classes.system import get_exit_code
 from apm.classes.system import jprint
 from apm.classes.system import get_shell
 from apm.classes.system import update_env
@@ -47,7 +49,7 @@ class Process:
         global binpath
 
         self.config = config
-        self.files = files
+        self.files = FileLedger.wrap(files)
         self.db = DB(self.config)
         self.manager = PluginManager()
 
@@ -95,7 +97,8 @@ class Process:
 
         # Check for apm or user specified alias
         if not self.setup_alias(db_file):
-            exit()
+            self.config['exit'] = True
+            exit(get_exit_code(self.config))
         print("Done")
 
         if self.config['ingest']:
@@ -145,8 +148,10 @@ class Process:
             sys.stdout.flush()
 
             # Execute an Ingest process
+            # The ingests of different executables run at the same time, up to --ingest-workers of them
             threads = {}
             status = {}
+            workers = self.config.get('ingest_workers')
 
             done = False
 
@@ -162,6 +167,9 @@ class Process:
                     key = v['ingest'].split('/')[-1].split('_')[0]
                     if (key not in threads or status[key] == True) and v['complete'] == False:
                         done = False
+                        if workers and len([i for i in threads.values() if i.is_alive()]) >= workers:
+                            continue
+
                         status[key] = False
                         threads[key] = Ingest(v, self.config, k)
                         if not threads[key]:
@@ -185,10 +193,8 @@ class Process:
                                 for j,sif in site.items():
                                     for k,name in sif.items():
                                         if k in self.files[i][j]:
-                                            self.files[i][j][name] = self.files[i][j][k]
-                                            self.files[i][j].pop(k)
-                                            self.files[i][j][name]['processed_name'] = name
-                                            self.files[i][j][name]['current_name'] = name
+                                            self.files.rename(i, j, k, name)
+                                            self.files.set_value(i, j, name, 'processed_name', name)
 
                     elif v['complete'] == True:
                         pass
@@ -248,7 +254,8 @@ class Process:
                 print("ERROR: Unable to setup vapmgr")
                 print("")
                 print(error)
-                exit()
+                self.config['exit'] = True
+                exit(get_exit_code(self.config))
 
             # Run vapmgr to process the vaps
             starttime = datetime.now().replace(microsecond=0)
@@ -274,7 +281,8 @@ class Process:
                 print("ERROR: Error running vapmgr")
                 print("")
                 print(error)
-                exit()
+                self.config['exit'] = True
+                exit(get_exit_code(self.config))
 
 
             # vapmgr ran successfully
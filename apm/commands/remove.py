@@ -23,6 +23,8 @@ from apm.pmanager.manager import PluginManager
 from apm.classes.db import DB
 from apm.classes.ui import UI
 from apm.classes.files import Files
+from apm.classes.fasttar import FastTar
+from apm.classes.fasttar import FastTarError
 
 # Import commands
 from apm.commands.process import Process
@@ -224,6 +226,13 @@ class Remove:
             #  we make sure to include all files and can check for files that are not being tracked
             # 		(This should never happen)
             c = Files(self.config)
+
+            # Update the snapshot of the raw files in 'datastream', only files changed since the last run are hashed
+            snapshot, changes = c.update_snapshot('datastream', lambda path: path.count('/') == 2 and path.split('/')[1].endswith('.00'))
+            if changes != None and not self.config['quiet']:
+                print("\nRaw files changed since the last snapshot: {} added, {} removed, {} changed".format(
+                    len(changes['added']), len(changes['removed']), len(changes['changed'])))
+
             for i,s in raw_files.items(): 		# i = key, s = site
                 for j,p in s.items():   				# j = key, p = process/instrument
                     pbar = UI()
@@ -231,6 +240,8 @@ class Remove:
                     pbar.progress(percent)
                     count = len(p)
                     l = 1
+                    pairs = []
+                    names = {}
                     for k,f in p.items(): 				# k = key, f = file
                         # Compare the file in 'datastream' with its counterpart in 'file_comparison/raw'
                         if k not in file_history[i][j]: # This if statement should never evaluate "True"
@@ -253,10 +264,28 @@ class Remove:
                             continue # Go to the next iteration of the loop (file cannot be compared because there is no counterpart)
 
                         # Compare the ingested raw file with the unpacked raw file
+                        #  using the digest recorded by stage when there is one
                         file_path = dir_pattern(5).format(stage, job, '%s', i, j)
                         file_1 = dir_pattern().format(file_path % 'datastream', k)
                         file_2 = dir_pattern().format(file_path % 'file_comparison/raw', file_history[i][j][k]['original_name'])
-                        if not c.is_same_file(file_1, file_2):
+                        names[file_1] = k
+
+                        # The snapshot already has the digest of the file
+                        record = file_history[i][j][k]
+                        if snapshot != None and record.get('digest') != None and record.get('digest_type') == snapshot.algorithm:
+                            same = snapshot.get_digest(dir_pattern(3).format(i, j, k)) == record['digest']
+                            if same:
+                                percent = int((float(l) / float(count)) * 100)
+                                pbar.progress(percent)
+                                l = l + 1
+                                continue
+
+                        pairs.append((file_1, file_2, record))
+
+                    # Hash the files of the process concurrently
+                    for file_1, file_2, same in c.compare_files(pairs):
+                        k = names[file_1]
+                        if not same:
                             # The files are not the same. Raw files in datastream need to be rebundled
                             bundle_data = True
 
@@ -767,6 +796,12 @@ class Remove:
 
     def get_all_files_from_tar(self, tar_file, path):
         """ Get a list of all the file names in the specified tar file """
+        try:
+            with FastTar("%s/%s" % (path, tar_file)) as tar:
+                return tar.getnames()
+        except FastTarError:
+            pass
+
         tar = tarfile.open("%s/%s" % (path, tar_file), 'r')
         names = tar.getnames()
         tar.close()
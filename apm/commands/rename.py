@@ -2,9 +2,13 @@
 
 import os
 import sys
+import threading
 from glob import glob
 
 from apm.classes.files import Files
+from apm.classes.ledger import FileLedger
+from apm.classes.renamer import Renamer
+from apm.classes.renamer import RenamePlan
 from apm.classes.system import dir_pattern
 from apm.classes.system import jprint
 
@@ -16,10 +20,13 @@ class Rename:
     def __init__(self, config, files=None):
         """ Initialize with args """
         self.config = config
-        self.files = files
+        self.files = FileLedger.wrap(files)
+        self.manager = PluginManager()
+        self.lock = threading.Lock()
+        self.tree = None
+        self.renamer = None
 
     def run(self):
-        manager = PluginManager()
         config = self.config
         f = Files(config)
         cwd = os.getcwd()
@@ -38,37 +45,122 @@ class Rename:
         print("\nStripping ARM prefix from files... ",end="")
         sys.stdout.flush()
 
-        manager.callPluginCommand('hook_rename_preprocess', {'config': config})
+        renamer = self.prepare()
+        tree = self.tree
 
         os.chdir(collection)
-        sites = set(os.listdir('.'))
-        for site in sites:
-            os.chdir(site)
-            instruments = set(os.listdir('.'))
-            for ins in instruments:
-                os.chdir(ins)
-                files = set(os.listdir('.'))
-                for i in files:
-                    new_name = f.rename_file(i)
-                    if new_name != None:
-                        if i != new_name:
-                            self.files[site][ins][new_name] = self.files[site][ins][i]
-                            self.files[site][ins].pop(i)
 
-                        self.files[site][ins][new_name]['current_name'] = new_name
-                        self.files[site][ins][new_name]['stripped_name'] = new_name
+        # An interrupted run is finished first, auto journals each directory as it
+        # is staged so the ones that were not renamed yet are not in the journal
+        journaled = set()
+        if renamer.has_journal():
+            print("resuming interrupted rename... ",end="")
+            sys.stdout.flush()
+            journaled = set(dir_pattern().format(i.site, i.process) for i in renamer.load())
 
-                os.chdir('..')
+        # Every directory is planned and checked for conflicts before anything is renamed
+        plans = []
+        for site in sorted(tree.listdir()):
+            for ins in sorted(tree.listdir(site)):
+                if dir_pattern().format(site, ins) not in journaled:
+                    plans.append(RenamePlan(dir_pattern(3).format(collection, site, ins), site, ins))
 
-            os.chdir('..')
+        conflicts = renamer.plan(plans, f.strip_name)
+        if len(conflicts) > 0:
+            print("Fail")
+            exit("{}\n Please fix these conflicts and try again.".format('\n'.join(conflicts)))
 
-        manager.callPluginCommand('hook_renamed_files_alter', {'config': config})
+        for plan, moves in renamer.apply():
+            self.record_moves(plan, moves)
+
+        self.finish()
 
         print("Done\n")
         sys.stdout.flush()
 
         return config, self.files
 
+    def prepare(self):
+        """ Let the plugins alter the collection before it is renamed, return the renamer """
+        config = self.config
+        self.manager.callPluginCommand('hook_rename_preprocess', {'config': config})
+
+        # Plugins may have changed the collection
+        self.tree = Files(config).get_tree('collection')
+        self.tree.invalidate()
+
+        self.renamer = self.get_renamer()
+        return self.renamer
+
+    def get_renamer(self):
+        config = self.config
+        return Renamer(dir_pattern(3).format(config['stage'], config['job'], 'rename.journal'))
+
+    def recover(self):
+        """
+            Record the renames an interrupted run already did, so their files are
+            not taken for untracked files before the run is finished
+            Return True if there is a rename to finish
+        """
+        renamer = self.get_renamer()
+        if not renamer.has_journal():
+            return False
+
+        if self.files != None:
+            for plan in renamer.load():
+                self.record_moves(plan, plan.done())
+
+        return True
+
+    def rename_process(self, site, ins):
+        """ Plan and rename one directory of the collection on its own, return its conflicts """
+        config = self.config
+        path = dir_pattern(5).format(config['stage'], config['job'], 'collection', site, ins)
+        plan = RenamePlan(path, site, ins)
+
+        conflicts = self.renamer.add(plan, Files(config).strip_name)
+        if len(conflicts) > 0:
+            return conflicts
+
+        moves = plan.apply()
+        with self.lock:
+            self.record_moves(plan, moves)
+
+        return []
+
+    def record_moves(self, plan, moves):
+        """ Update the tree and the ledger with the renames of a directory """
+        if self.tree != None:
+            self.tree.invalidate(dir_pattern().format(plan.site, plan.process))
+
+        # Nothing is tracked when stage was stopped before it saved the ledger
+        if self.files == None:
+            return
+
+        names = self.files.get(plan.site, {}).get(plan.process, {})
+        for i, new_name in moves:
+            if i in names:
+                self.files.rename(plan.site, plan.process, i, new_name)
+
+        for new_name in [j for i,j in moves] + plan.unchanged:
+            if new_name in names:
+                self.files.set_value(plan.site, plan.process, new_name, 'current_name', new_name)
+                self.files.set_value(plan.site, plan.process, new_name, 'stripped_name', new_name)
+
+    def finish(self):
+        """ Save the new names, then drop the journal and record the renamed collection """
+        config = self.config
+
+        # The journal is only removed once the new names are saved
+        if self.files != None:
+            Files(config, self.files).save_filenames()
+        self.renamer.finish()
+
+        self.manager.callPluginCommand('hook_renamed_files_alter', {'config': config})
+
+        # Record the renamed collection, the digests stage computed are in the cache
+        Files(config).update_snapshot('collection')
+
 
     def check_for_collisions(self):
         """ Check all unpacked files for file naming collisions """
@@ -77,23 +169,19 @@ class Rename:
 
         config = self.config
         f = Files(config, self.files)
-        cwd = os.getcwd()
-        collection = dir_pattern(3).format(config['stage'], config['job'], 'collection')
-        os.chdir(collection)
+        tree = f.get_watched_tree('collection')
+        if tree == None:
+            tree = f.get_tree('collection')
 
-        sites = os.listdir('.')
-        for site in sites:
-            os.chdir(site)
-            instruments = set(os.listdir('.'))
-            for ins in instruments:
-                os.chdir(ins)
-                files = set(os.listdir('.'))
-                names = self.files[site][ins]
+        for site in tree.listdir():
+            for ins in tree.listdir(site):
+                files = set(tree.listdir(dir_pattern().format(site, ins)))
+                names = self.files.get(site, {}).get(ins, {}) if self.files != None else {}
 
                 # Mark files as deleted
                 for k,v in names.items():
-                    if k not in files:
-                        names[k]['deleted'] = True
+                    if k not in files and not v.get('deleted'):
+                        self.files.set_value(site, ins, k, 'deleted', True)
 
                 # Check for duplicates
                 for k,v in names.items():
@@ -106,11 +194,6 @@ class Rename:
                                 print("Files with naming collisions still exist.\nPlease resolve these issues before continuing.\n")
                                 return True
 
-                os.chdir('..')
-
-            os.chdir('..')
-
-        os.chdir(cwd)
         config['duplicates'] = False
         print("Done")
         sys.stdout.flush()
@@ -4,10 +4,15 @@ import os
 import sys
 import shutil
 import uuid
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 from apm.pmanager.manager import PluginManager
 
 from apm.classes.db import DB
 from apm.classes.files import Files
+from apm.classes.ledger import FileLedger
+from apm.classes.materialize import Materializer
 from apm.classes.unpack import UnPack
 from apm.classes.vapmgr import VapMgr
 
@@ -24,232 +29,324 @@ class Stage:
 
     def __init__(self, config, files=None):
         """ Initialize with args """
-        self.files = files
+        self.files = FileLedger.wrap(files)
         self.config = config
         self.cwd = os.getcwd()
         self.manager = PluginManager()
 
     def run(self):
         config = self.config
-        manager = self.manager
 
         if config['ingest']:
             # If staging for Ingest
-
-            # Make sure collection does not have any files that might get overwritten
-            empty = self.check_collection_empty()
-            if not empty:
-                print("\nFiles currently exist in your collection directory.\nPlease empty {}/{}/collection and try again.\n".format(config['stage'], config['job']))
-                config['exit'] = True
+            data_paths = self.prepare()
+            if data_paths == None:
                 return config, self.files
+            config = self.config
 
-            # cd to the stage directory
-            os.chdir(config['stage'])
+            # Stage each instrument
+            workers = max(1, int(config['stage_workers'] or 1))
+            if workers == 1:
+                for v in data_paths:
+                    self.stage_data_path(config, v)
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    jobs = [pool.submit(self.stage_data_path, config, v) for v in data_paths]
+                    for job in jobs:
+                        job.result()
 
-            # Check to see if a plugin needs to modify the datastream
-            temp = manager.callPluginCommand('hook_datastream_alter', {'config': config})
-            config = temp if temp != None else config
+            self.finish()
 
-            # Check to see if a plugin needs to modify the SIF data
-            temp = manager.callPluginCommand('hook_sif_alter', {'config': config})
-            config = temp if temp != None else config
+        elif config['vap']:
+            f = Files(self.config)
+            f.save_env()
 
-            # Establish a database connection
-            db = DB(config)
+            vap = VapMgr(self.config)
+            vap.add_to_env()
 
-            # Get the data_paths
-            data_paths = db.get_data_paths()
+        return config, self.files
 
-            # Check to see if a plugin needs to modify the data_paths
-            temp = manager.callPluginCommand('hook_data_paths_alter', {'config': config, 'data_paths': data_paths})
-            data_paths = temp if temp != None else data_paths
+    def prepare(self, snapshot_each=False):
+        """
+            Check the collection, let the plugins alter the config and return the data paths to stage
+            Return None if staging can not go on
+            With snapshot_each the raw snapshot is taken one data path at a time by snapshot_data_path
+        """
+        config = self.config
+        manager = self.manager
 
-            # for each instrument
-            for k,v in enumerate(data_paths):
-                archive_path = v['output']
-                stage_path = v['input']
+        # Make sure collection does not have any files that might get overwritten
+        empty = self.check_collection_empty()
+        if not empty:
+            print("\nFiles currently exist in your collection directory.\nPlease empty {}/{}/collection and try again.\n".format(config['stage'], config['job']))
+            config['exit'] = True
+            return None
 
-                # Set tar_path and check for plugin modifications
-                tar_path = '{}/{}'.format(config['source'], archive_path)
-                temp = manager.callPluginCommand('hook_tar_path_alter', {'config': config, 'tar_path': tar_path})
-                tar_path = temp if temp != None else tar_path
+        # cd to the stage directory
+        os.chdir(config['stage'])
 
-                if os.path.exists(tar_path):
-                    # Get a list of tar files that match specified dates
-                    tar = UnPack(config, archive_path, stage_path)
-                    tar_files = tar.get_tar_files()
+        # Check to see if a plugin needs to modify the datastream
+        temp = manager.callPluginCommand('hook_datastream_alter', {'config': config})
+        config = temp if temp != None else config
 
-                    temp = manager.callPluginCommand('hook_tar_files_alter', {'config': config})
-                    tar_files = temp if temp != None else tar_files
+        # Check to see if a plugin needs to modify the SIF data
+        temp = manager.callPluginCommand('hook_sif_alter', {'config': config})
+        config = temp if temp != None else config
+        self.config = config
 
-                    if tar_files and len(tar_files) > 0:
-                        # compare_path = '{}/{}/.compare/{}'.format(config['stage'], config['job'], stage_path)
-                        compare_path = dir_pattern(5).format(config['stage'], config['job'], 'file_comparison', 'raw', stage_path)
-                        tar_backup = dir_pattern(5).format(config['stage'], config['job'], 'file_comparison', 'tar', stage_path)
-                        collection_path = '{}/{}/collection/{}'.format(config['stage'], config['job'], stage_path)
+        # Establish a database connection
+        db = DB(config)
 
+        # Get the data_paths
+        data_paths = db.get_data_paths()
 
-                        # Make the above paths if they don't already exist
-                        if not os.path.exists(compare_path):
-                            os.makedirs(compare_path)
+        # In stream mode, or when it is taken per data path, the raw snapshot
+        #  is written while staging so the old one must be removed first
+        self.snapshot_each = snapshot_each and config['stage_mode'] != 'stream'
+        f = Files(self.config)
+        raw_path = dir_pattern(4).format(config['stage'], config['job'], 'file_comparison', 'raw')
+        if (config['stage_mode'] == 'stream' or self.snapshot_each) and os.path.exists(raw_path):
+            f.empty_dir(raw_path)
+            os.rmdir(raw_path)
 
-                        if not os.path.exists(tar_backup):
-                            os.makedirs(tar_backup)
+        # Check to see if a plugin needs to modify the data_paths
+        temp = manager.callPluginCommand('hook_data_paths_alter', {'config': config, 'data_paths': data_paths})
+        data_paths = temp if temp != None else data_paths
 
-                        if not os.path.exists(collection_path):
-                            os.makedirs(collection_path)
+        # Shared by the datastreams staged at the same time
+        self.bytes_read = {'backup': 0, 'extract': 0, 'snapshot': 0}
+        self.lock = threading.Lock()
 
+        # Cap the number of datastreams copying or unpacking at the same time
+        workers = max(1, int(config['stage_workers'] or 1))
+        self.io = threading.BoundedSemaphore(max(1, int(config['io_limit'] or workers)))
 
-                        # Copy the tar files to the backup location
-                        if not tar.copy_files(tar_files, tar_backup):
-                            print("Unable to copy tar files")
+        return data_paths
 
-                        # Unpack the tar files
-                        tar.extract_tar_files(tar_files)
-                        has_dups = tar.handle_duplicate_files()
-                        if has_dups:
-                            config['duplicates'] = True
+    def finish(self):
+        """ Take the raw snapshot of the whole collection if it was not taken while staging and report """
+        config = self.config
+        f = Files(self.config)
 
-                            for i in has_dups:
-                                duplicates[i] = has_dups[i]
+        if config['stage_mode'] != 'stream' and not self.snapshot_each:
+            src = dir_pattern(3).format(config['stage'], config['job'], 'collection')
+            # dst = dir_pattern(3).format(config['stage'], config['job'], '.compare')
+            dst = dir_pattern(4).format(config['stage'], config['job'], 'file_comparison', 'raw')
+            if os.path.exists(dst):
+                f.empty_dir(dst)
+                os.rmdir(dst)
 
-                    else:
-                        temp = tar_path.split('/')
-                        if not config['quiet']:
-                            print('\nData not available for {} using the dates specified'.format(temp[-1]))
-
-                else:
-                    temp = tar_path.split('/')
-                    if not config['quiet']:
-                        print('\nData for {} does not exist.'.format(temp[-1]))
-
-                site, process = stage_path.split('/')
-
-                if self.files == None:
-                    self.files = {}
-
-                if site not in self.files:
-                    self.files[site] = {}
-
-                site = self.files[site]
-                if process not in site:
-                    site[process] = {}
-
-                process = site[process]
-
-                if os.path.exists(dir_pattern(4).format(self.config['stage'], self.config['job'], 'collection', stage_path)):
-                    files = os.listdir(dir_pattern(4).format(self.config['stage'], self.config['job'], 'collection', stage_path))
-                    dup_uuid = {}
-                    for i in files:
-                        original_name = i
-                        temp = i.split('.')
-                        if temp[-1][0] == 'v':
-                            try:
-                                int(temp[-1][1:])
-                                original_name = '.'.join(temp[:-1])
-                            except:
-                                pass
-
-                        process[i] = {
-                            "uuid": str(uuid.uuid4()),
-                            "current_name": i,
-                            "original_name": original_name,
-                            "stripped_name": None,
-                            "processed_name": None,
-                            "unpacked_name": i,
-                            "duplicate_files": [],
-                            "deleted": False,
-                        }
-                        if original_name != i:
-                            dup_uuid[i] = process[i]['uuid']
-
-                    for i in duplicates:
-                        if i.startswith(data_paths[k]['input']):
-                            for j in duplicates[i]:
-                                site, process, name = j.split('/')
-                                for l in duplicates[i]:
-                                    temp = l.split('/')
-                                    if j != l:
-                                        self.files[site][process][name]['duplicate_files'].append(dup_uuid[temp[2]])
-
-
-                    # Copy the config files from /data/conf to /<stage>/<job>/conf
-                    conf_path = "/data/conf/{0}/{0}{1}{2}".format(self.config['site'], self.config['instrument'], self.config['facility'])
-                    conf_dest = "{0}/{1}/conf/{2}".format(self.config['stage'], self.config['job'], self.config['site'])
-                    dest_folder = "{}{}{}".format(self.config['site'], self.config['instrument'], self.config['facility'])
-                    if not os.path.exists(conf_path):
-                        conf_path = "/data/conf/{0}/{1}{2}".format(self.config['site'], self.config['instrument'], self.config['facility'])
-                        conf_dest = "{0}/{1}/conf/{2}".format(self.config['stage'], self.config['job'], self.config['site'])
-                        dest_folder = "{}{}".format(self.config['instrument'], self.config['facility'])
+            self.copy_snapshot(src, dst)
 
+        if not config['quiet']:
+            print('\nBytes read: backup {backup}, extract {extract}, snapshot {snapshot}'.format(**self.bytes_read))
 
-                    if os.path.exists(conf_path):
-                        if not os.path.exists(conf_dest):
-                            os.makedirs(conf_dest)
+        if len(duplicates) > 0:
+            print('')
+            print('The following files had naming collisions when unpacked.\nPlease verify the contents and keep only the appropriate file(s).')
+            print('Please do not rename files, simply delete any unwanted files.')
+            for i in duplicates:
+                print('')
+                for j in duplicates[i]:
+                    print(j)
+            print('')
 
-                        if os.path.exists(dir_pattern().format(conf_dest, dest_folder)):
-                            try:
-                                os.rmdir(dir_pattern().format(conf_dest, dest_folder))
-                            except OSError as e:
-                                if e.errno == errno.ENOTEMPTY:
-                                    exit("Unable to copy config files to {}. Destination is not empty.".format(dir_pattern().format(conf_dest, dest_folder)))
-                                else:
-                                    raise e
+        # The collection was written by unpacking, not through its tree
+        f.get_tree('collection').invalidate()
 
-                        shutil.copytree(conf_path, dir_pattern().format(conf_dest, dest_folder))
+        f.save_env()
 
+    def copy_snapshot(self, src, dst):
+        """ Copy part of the collection to the raw snapshot """
+        # Files in the collection may be changed in place, so even hardlink mode reflinks or copies them
+        m = Materializer(self.config['materialize'])
 
+        def copy(src, dst):
+            if m.materialize(src, dst) == 'copy':
+                with self.lock:
+                    self.bytes_read['snapshot'] += os.path.getsize(src)
+            return dst
 
-            f = Files(self.config)
-            src = dir_pattern(3).format(config['stage'], config['job'], 'collection')
-            # dst = dir_pattern(3).format(config['stage'], config['job'], '.compare')
-            dst = dir_pattern(4).format(config['stage'], config['job'], 'file_comparison', 'raw')
-            if os.path.exists(dst):
-                f.empty_dir(dst)
-                os.rmdir(dst)
+        shutil.copytree(src, dst, copy_function=copy)
 
-            shutil.copytree(src, dst)
+    def snapshot_data_path(self, config, v):
+        """ Copy the unpacked files of one data path to the raw snapshot before they are renamed """
+        src = dir_pattern(4).format(config['stage'], config['job'], 'collection', v['input'])
+        dst = dir_pattern(5).format(config['stage'], config['job'], 'file_comparison', 'raw', v['input'])
+        if not os.path.exists(src):
+            return
+
+        # stage_data_path leaves an empty directory for the snapshot
+        if os.path.exists(dst):
+            Files(config).empty_dir(dst)
+            os.rmdir(dst)
+
+        self.copy_snapshot(src, dst)
+
+    def has_duplicates(self, v):
+        """ Return True if files of a data path had naming collisions when unpacked """
+        with self.lock:
+            return any(i.startswith('{}/'.format(v['input'])) for i in duplicates)
+
+    def stage_data_path(self, config, v):
+        """ Back up and unpack the tar files for one data path and add its files to the ledger """
+        manager = self.manager
+        stream = config['stage_mode'] == 'stream'
+
+        archive_path = v['output']
+        stage_path = v['input']
+
+        # Digest and size of each file unpacked
+        hashes = {}
+
+        # Set tar_path and check for plugin modifications
+        tar_path = '{}/{}'.format(config['source'], archive_path)
+        with self.lock:
+            temp = manager.callPluginCommand('hook_tar_path_alter', {'config': config, 'tar_path': tar_path})
+            tar_path = temp if temp != None else tar_path
+
+        if os.path.exists(tar_path):
+            # Get a list of tar files that match specified dates
+            tar = UnPack(config, archive_path, stage_path)
+            tar_files = tar.get_tar_files()
+
+            with self.lock:
+                temp = manager.callPluginCommand('hook_tar_files_alter', {'config': config})
+                tar_files = temp if temp != None else tar_files
+
+            if tar_files and len(tar_files) > 0:
+                # compare_path = '{}/{}/.compare/{}'.format(config['stage'], config['job'], stage_path)
+                compare_path = dir_pattern(5).format(config['stage'], config['job'], 'file_comparison', 'raw', stage_path)
+                tar_backup = dir_pattern(5).format(config['stage'], config['job'], 'file_comparison', 'tar', stage_path)
+                collection_path = '{}/{}/collection/{}'.format(config['stage'], config['job'], stage_path)
+
+
+                # Make the above paths if they don't already exist
+                if not os.path.exists(compare_path):
+                    os.makedirs(compare_path)
+
+                if not os.path.exists(tar_backup):
+                    os.makedirs(tar_backup)
+
+                if not os.path.exists(collection_path):
+                    os.makedirs(collection_path)
+
+
+                with self.io:
+                    if stream:
+                        # Backup, unpack and snapshot the tar files in a single read
+                        tar.stream_tar_files(tar_files, tar_backup, compare_path)
+                        has_dups = tar.handle_duplicate_files()
+                    else:
+                        # Copy the tar files to the backup location
+                        if not tar.copy_files(tar_files, tar_backup):
+                            print("Unable to copy tar files")
+
+                        # Unpack the tar files
+                        tar.extract_tar_files(tar_files)
+                        has_dups = tar.handle_duplicate_files()
+
+                hashes = tar.hashes
+
+                with self.lock:
+                    for i in tar.bytes_read:
+                        self.bytes_read[i] += tar.bytes_read[i]
+
+                    if has_dups:
+                        config['duplicates'] = True
+
+                        for i in has_dups:
+                            duplicates[i] = has_dups[i]
+
+            else:
+                temp = tar_path.split('/')
+                if not config['quiet']:
+                    print('\nData not available for {} using the dates specified'.format(temp[-1]))
+
+        else:
+            temp = tar_path.split('/')
+            if not config['quiet']:
+                print('\nData for {} does not exist.'.format(temp[-1]))
+
+        # The ledger and the conf dir are shared with the other data paths
+        with self.lock:
+            site, process = stage_path.split('/')
+
+            if self.files == None:
+                self.files = FileLedger()
+
+            if site not in self.files:
+                self.files[site] = {}
+
+            if process not in self.files[site]:
+                self.files[site][process] = {}
+
+            if os.path.exists(dir_pattern(4).format(self.config['stage'], self.config['job'], 'collection', stage_path)):
+                files = os.listdir(dir_pattern(4).format(self.config['stage'], self.config['job'], 'collection', stage_path))
+                dup_uuid = {}
+                for i in files:
+                    original_name = i
+                    temp = i.split('.')
+                    if temp[-1][0] == 'v':
+                        try:
+                            int(temp[-1][1:])
+                            original_name = '.'.join(temp[:-1])
+                        except:
+                            pass
+
+                    self.files.add(site, process, i, {
+                        "uuid": str(uuid.uuid4()),
+                        "current_name": i,
+                        "original_name": original_name,
+                        "stripped_name": None,
+                        "processed_name": None,
+                        "unpacked_name": i,
+                        "duplicate_files": [],
+                        "deleted": False,
+                        "digest": hashes[i][0] if i in hashes else None,
+                        "digest_type": config['digest'] if i in hashes else None,
+                        "size": hashes[i][1] if i in hashes else None,
+                    })
+                    if original_name != i:
+                        dup_uuid[i] = self.files[site][process][i]['uuid']
 
-            if len(duplicates) > 0:
-                print('')
-                print('The following files had naming collisions when unpacked.\nPlease verify the contents and keep only the appropriate file(s).')
-                print('Please do not rename files, simply delete any unwanted files.')
                 for i in duplicates:
-                    print('')
-                    for j in duplicates[i]:
-                        print(j)
-                print('')
+                    if i.startswith(stage_path):
+                        for j in duplicates[i]:
+                            site, process, name = j.split('/')
+                            for l in duplicates[i]:
+                                temp = l.split('/')
+                                if j != l:
+                                    duplicate_files = list(self.files[site][process][name]['duplicate_files']) + [dup_uuid[temp[2]]]
+                                    self.files.set_value(site, process, name, 'duplicate_files', duplicate_files)
+
+
+                # Copy the config files from /data/conf to /<stage>/<job>/conf
+                conf_path = "/data/conf/{0}/{0}{1}{2}".format(self.config['site'], self.config['instrument'], self.config['facility'])
+                conf_dest = "{0}/{1}/conf/{2}".format(self.config['stage'], self.config['job'], self.config['site'])
+                dest_folder = "{}{}{}".format(self.config['site'], self.config['instrument'], self.config['facility'])
+                if not os.path.exists(conf_path):
+                    conf_path = "/data/conf/{0}/{1}{2}".format(self.config['site'], self.config['instrument'], self.config['facility'])
+                    conf_dest = "{0}/{1}/conf/{2}".format(self.config['stage'], self.config['job'], self.config['site'])
+                    dest_folder = "{}{}".format(self.config['instrument'], self.config['facility'])
 
-            f.save_env()
 
-        elif config['vap']:
-            f = Files(self.config)
-            f.save_env()
+                if os.path.exists(conf_path):
+                    if not os.path.exists(conf_dest):
+                        os.makedirs(conf_dest)
 
-            vap = VapMgr(self.config)
-            vap.add_to_env()
+                    if os.path.exists(dir_pattern().format(conf_dest, dest_folder)):
+                        try:
+                            os.rmdir(dir_pattern().format(conf_dest, dest_folder))
+                        except OSError as e:
+                            if e.errno == errno.ENOTEMPTY:
+                                exit("Unable to copy config files to {}. Destination is not empty.".format(dir_pattern().format(conf_dest, dest_folder)))
+                            else:
+                                raise e
 
-        return config, self.files
+                    shutil.copytree(conf_path, dir_pattern().format(conf_dest, dest_folder))
 
     def check_collection_empty(self, folder=None):
         """ Make sure no data will be overwritten if files are unpacked """
-        cwd = os.getcwd()
-        empty = True
-
-        if folder == None:
-            folder = '{}/{}/collection'.format(self.config['stage'], self.config['job'])
-
-        os.chdir(folder)
-
-        files = os.listdir('.')
-        for i in files:
-            if os.path.isdir(i):
-                empty = self.check_collection_empty(folder=i)
-                if not empty:
-                    break;
-            elif os.path.isfile(i):
-                empty = False
-                break;
-
-        os.chdir(cwd)
-        return empty
+        tree = Files(self.config).get_tree('collection')
+        return tree.is_empty(folder if folder != None else '')
@@ -76,3 +76,9 @@ class PluginManager:
 				if c == command:
 					self.call(p, c, options)
 
+	def hasPluginCommand(self, command):
+		"""Return True if any available plugin has the given command"""
+		for p in self.list_plugins():
+			if command in self.load_plugin(p)._commands():
+				return True
+		return False
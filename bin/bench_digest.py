@@ -0,0 +1,98 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import sys
+import glob
+import time
+import hashlib
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apm.classes import digest
+
+BLOCKSIZE = 1048576
+
+# The archive inventory records the md5 of each file
+ALGORITHMS = dict(digest.ALGORITHMS, md5=hashlib.md5)
+
+class MultiHasher:
+    """ Feed the same data to several hashers so each digest costs one read """
+
+    def __init__(self, algorithms):
+        self.hashers = [ALGORITHMS[i]() for i in algorithms]
+
+    def update(self, data):
+        for hasher in self.hashers:
+            hasher.update(data)
+
+def bench_digest():
+    args = get_args()
+    if args.regex != None:
+        files = sorted(glob.glob(args.regex))
+        if len(files) == 0:
+            exit('No files match {}'.format(args.regex))
+
+        data = None
+        size = sum(os.path.getsize(f) for f in files)
+        print('{} files, {:.1f} MB'.format(len(files), size / 1048576.0))
+    else:
+        files = None
+        data = os.urandom(args.size * 1048576)
+        size = len(data)
+        print('{:.1f} MB of random data'.format(size / 1048576.0))
+
+    names = sorted(ALGORITHMS) + ['+'.join([args.local, 'md5'])]
+    for name in names:
+        best = None
+        for i in range(args.repeat):
+            start = time.time()
+            hasher = MultiHasher(name.split('+'))
+            if data != None:
+                view = memoryview(data)
+                for j in range(0, size, BLOCKSIZE):
+                    hasher.update(view[j:j + BLOCKSIZE])
+            else:
+                for f in files:
+                    hash_file(f, hasher)
+            elapsed = time.time() - start
+            best = elapsed if best == None else min(best, elapsed)
+
+        print('{:12} {:8.3f}s {:10.1f} MB/s'.format(name, best, size / 1048576.0 / best))
+
+def hash_file(path, hasher):
+    """ Hash a file the way Files.get_hash reads it """
+    buf = bytearray(BLOCKSIZE)
+    view = memoryview(buf)
+    fp = open(path, 'rb', buffering=0)
+    count = fp.readinto(buf)
+    while count > 0:
+        hasher.update(view[:count])
+        count = fp.readinto(buf)
+    fp.close()
+
+help_description='''
+Measure the throughput of each digest APM can use, and of the local
+digest and md5 computed in the same read pass. Uses random data in
+memory unless files are given.
+'''
+
+example ='''
+EXAMPLE:
+    bench_digest.py -s 512
+    bench_digest.py -re '/data/project/0021/tmp/*/datastream/sgp/*/*' -r 3
+'''
+
+def get_args():
+    parser = argparse.ArgumentParser(description=help_description, epilog=example, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-re', type=str, dest='regex', default=None, help='glob pattern for the files to hash')
+    parser.add_argument('-s', type=int, dest='size', default=256, help='MB of random data to hash when no files are given')
+    parser.add_argument('-r', type=int, dest='repeat', default=3, help='number of runs, the fastest is reported')
+    parser.add_argument('-l', type=str, dest='local', default='sha256', help='local digest to pair with md5')
+
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    bench_digest()
@@ -0,0 +1,91 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import sys
+import gc
+import json
+import time
+import uuid
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apm.classes.ledger import FileLedger
+from apm.classes.record import FileRecord
+
+def bench_ledger():
+    args = get_args()
+    text = make_ledger(args.files, args.processes)
+    print('{} tracked files in {} processes, {:.1f} MB of json'.format(args.files, args.processes, len(text) / 1048576.0))
+
+    for name, method in [('dict records', load_dicts), ('FileRecords', load_records), ('FileLedger', load_ledger)]:
+        gc.collect()
+        tracemalloc.start()
+        start = time.time()
+        files = method(text)
+        elapsed = time.time() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print('{:14} {:8.1f} MB {:6.0f} bytes/file {:8.3f}s'.format(name, size / 1048576.0, size / float(args.files), elapsed))
+        del files
+
+def make_ledger(count, processes):
+    """ Return the json of a ledger shaped like the ones stage writes """
+    files = {'sgp': {}}
+    for i in range(count):
+        process = 'sgpproc{}C1.00'.format(i % processes)
+        name = '{}.{}.{:06d}.raw.dat'.format(process, 20140501 + i // 86400 % 28, i % 86400)
+        files['sgp'].setdefault(process, {})[name] = {
+            'uuid': str(uuid.uuid4()),
+            'current_name': name,
+            'original_name': name,
+            'stripped_name': None,
+            'processed_name': None,
+            'unpacked_name': name,
+            'duplicate_files': [],
+            'deleted': False,
+        }
+
+    return json.dumps(files)
+
+def load_dicts(text):
+    return json.loads(text)
+
+def load_records(text):
+    """ Convert the records without building the ledger indexes """
+    files = json.loads(text)
+    for site in files:
+        for process in files[site]:
+            records = files[site][process]
+            for name in records:
+                records[name] = FileRecord(records[name])
+                records[name].share(name)
+
+    return files
+
+def load_ledger(text):
+    return FileLedger(json.loads(text))
+
+help_description='''
+Measure the memory used by the tracked files of a job, as plain dicts,
+as FileRecords and as an indexed FileLedger.
+'''
+
+example ='''
+EXAMPLE:
+    bench_ledger.py -n 1000000
+'''
+
+def get_args():
+    parser = argparse.ArgumentParser(description=help_description, epilog=example, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-n', type=int, dest='files', default=1000000, help='number of tracked files')
+    parser.add_argument('-p', type=int, dest='processes', default=10, help='number of processes the files are spread over')
+
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    bench_ledger()
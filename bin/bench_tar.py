@@ -0,0 +1,115 @@
+#!/apps/base/python3/bin/python3
+
+import os
+import sys
+import time
+import glob
+import shutil
+import tarfile
+import hashlib
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apm.classes.fasttar import FastTar
+from apm.classes.fasttar import FastTarError
+
+def bench_tar():
+    args = get_args()
+    files = sorted(glob.glob(args.regex))
+    if len(files) == 0:
+        exit('No tar files match {}'.format(args.regex))
+
+    size = sum(os.path.getsize(f) for f in files)
+    print('{} tar files, {:.1f} MB'.format(len(files), size / 1048576.0))
+
+    results = {}
+    for name, method in [('tarfile', tarfile_run), ('fasttar', fasttar_run)]:
+        for step in ['list', 'extract']:
+            best = None
+            for i in range(args.repeat):
+                dest = tempfile.mkdtemp(dir=args.dest)
+                start = time.time()
+                skipped = method(files, step, dest)
+                elapsed = time.time() - start
+                shutil.rmtree(dest)
+                best = elapsed if best == None else min(best, elapsed)
+
+            results[(name, step)] = best
+            print('{:8} {:8} {:8.3f}s {:10.1f} MB/s  ({} files fell back to tarfile)'.format(name, step, best, size / 1048576.0 / best, skipped))
+
+    for step in ['list', 'extract']:
+        print('{} speedup: {:.2f}x'.format(step, results[('tarfile', step)] / results[('fasttar', step)]))
+
+def tarfile_run(files, step, dest):
+    """ List or extract through tarfile, hashing each file as it is written """
+    for f in files:
+        tar = tarfile.open(f, 'r')
+        members = tar.getmembers()
+        if step == 'extract':
+            for m in members:
+                if not m.isfile():
+                    continue
+
+                path = '{}/{}'.format(dest, m.name)
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+
+                h = hashlib.sha256()
+                data = tar.extractfile(m)
+                out = open(path, 'wb')
+                buf = data.read(1048576)
+                while len(buf) > 0:
+                    h.update(buf)
+                    out.write(buf)
+                    buf = data.read(1048576)
+                out.close()
+
+            tar.extractall(path=dest, members=[m for m in members if not m.isfile()])
+        tar.close()
+
+    return 0
+
+def fasttar_run(files, step, dest):
+    """ List or extract with the fast reader, falling back to tarfile """
+    skipped = 0
+    for f in files:
+        try:
+            with FastTar(f) as tar:
+                members = tar.getmembers()
+                if step == 'extract':
+                    for m in members:
+                        h = hashlib.sha256()
+                        tar.extract(m, '{}/{}'.format(dest, m.name), h)
+        except FastTarError:
+            skipped += 1
+            tarfile_run([f], step, dest)
+
+    return skipped
+
+help_description='''
+Compare the time it takes tarfile and the fast tar reader used by stage
+to list and extract the members of tar files. Extraction includes
+hashing each file with sha256 as stage does.
+'''
+
+example ='''
+EXAMPLE:
+    bench_tar.py -re '/data/archive/sgp/sgpmfrsrC1.00/*.201405*.tar' -r 3
+'''
+
+def get_args():
+    parser = argparse.ArgumentParser(description=help_description, epilog=example, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    requiredArguments = parser.add_argument_group('required arguments.')
+    requiredArguments.add_argument('-re', type=str, dest='regex', help='glob pattern for the tar files to read', required=True)
+
+    parser.add_argument('-r', type=int, dest='repeat', default=3, help='number of runs, the fastest is reported')
+    parser.add_argument('-d', type=str, dest='dest', default=None, help='directory to extract into')
+
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    bench_tar()